@@ -0,0 +1,15 @@
+import logging
+
+from fastapi import APIRouter
+
+from app.core.catalogs import get_catalog_registry
+
+router = APIRouter(prefix="/catalogs", tags=["Catalogs"])
+logger = logging.getLogger(__name__)
+
+
+@router.get("/")
+async def list_catalogs():
+    """已配置的数据目录：请求通过 catalog 字段选择目录；loaded 为已加载的状态，空闲回收后为空。"""
+    registry = get_catalog_registry()
+    return {"default": registry.default.name, "catalogs": [catalog.describe() for catalog in registry.catalogs()], "stats": registry.stats()}
@@ -0,0 +1,83 @@
+import logging
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.answer_cache import get_answer_cache
+from app.core.catalogs import get_catalog_registry, get_catalog_stats, use_catalog
+from app.core.embedding_sidecar import get_sidecar_stats
+from app.core.llm_gateway import get_llm_gateway
+from app.core.nl2sql_workflow import get_coalescing_stats
+from app.core.priority_lanes import get_lane_stats
+from app.core.query_executor import get_connection_pool
+from app.core.query_stats import get_query_stats
+from app.core.schema_index import get_schema_index_stats
+from app.core.session_store import get_session_store
+from app.core.sql_dry_run import get_dry_run_stats
+from app.core.telemetry import register_collector, render_prometheus
+from app.core.value_index import get_value_index_stats
+from app.core.warmup import get_warm_up_stats
+
+router = APIRouter(tags=["Metrics"])
+logger = logging.getLogger(__name__)
+
+Family = Tuple[str, str, List[Tuple[Dict[str, str], Any]]]
+
+
+def _numeric(stats: Dict[str, Any]) -> Dict[str, float]:
+    return {key: value for key, value in stats.items() if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def _flat_family(name: str, documentation: str, stats: Dict[str, Any]) -> Family:
+    return name, documentation, [({"stat": key}, value) for key, value in sorted(_numeric(stats).items())]
+
+
+def _catalog_family(name: str, documentation: str, state_key: str, stats: Callable[[], Dict[str, Any]]) -> Family:
+    """按数据目录打 catalog 标签；只采集已加载该项状态的目录，采集本身不触发加载，也不计为一次使用。"""
+    samples = []
+    for catalog in get_catalog_registry().catalogs():
+        if state_key not in catalog.state:
+            continue
+        with use_catalog(catalog.name, touch=False):
+            values = stats()
+        samples.extend(({"catalog": catalog.name, "stat": key}, value) for key, value in sorted(_numeric(values).items()))
+    return name, documentation, samples
+
+
+def _collect_runtime_stats() -> List[Family]:
+    families = [
+        _catalog_family("datainsight_answer_cache", "NL2SQL answer cache counters and size.", "answer_cache", lambda: get_answer_cache().stats()),
+        _flat_family("datainsight_coalescing", "Single-flight coalescing of identical NL2SQL requests.", get_coalescing_stats()),
+        _flat_family("datainsight_sql_dry_run", "Generated SQL dry-run and repair counters.", get_dry_run_stats()),
+        _flat_family("datainsight_query_stats_store", "Per-fingerprint query statistics store.", get_query_stats().stats()),
+        _catalog_family("datainsight_duckdb_pool", "Pooled read-only DuckDB connections.", "connection_pool", lambda: get_connection_pool().stats()),
+        _catalog_family("datainsight_nl2sql_sessions", "NL2SQL conversation session store.", "sessions", lambda: get_session_store().stats()),
+        _catalog_family("datainsight_value_index", "Column value-linking index size.", "value_index", get_value_index_stats),
+        _catalog_family("datainsight_schema_index", "Schema retrieval index size.", "schema_index", get_schema_index_stats),
+        _flat_family("datainsight_catalogs", "Data catalog registry: loaded catalogs, evictions and process RSS.", get_catalog_stats()),
+        _flat_family("datainsight_embedding_sidecar", "Worker-side embedding sidecar client counters.", get_sidecar_stats()),
+        _flat_family("datainsight_warmup", "Background start-up warm-up progress and step durations.", get_warm_up_stats()),
+    ]
+
+    provider_samples = []
+    for provider in get_llm_gateway().stats():
+        for key, value in sorted(_numeric(provider).items()):
+            provider_samples.append(({"provider": provider["name"], "stat": key}, value))
+        provider_samples.append(({"provider": provider["name"], "stat": "breaker_open"}, int(provider["breaker"] != "closed")))
+    families.append(("datainsight_llm_provider", "LLM gateway per-provider counters and breaker state.", provider_samples))
+
+    lane_samples = []
+    for lane, stats in get_lane_stats().items():
+        lane_samples.extend(({"lane": lane, "stat": key}, value) for key, value in sorted(_numeric(stats).items()))
+    families.append(("datainsight_priority_lane", "Per-lane concurrency, queue depth, admissions, 429 rejections and deadline drops.", lane_samples))
+    return families
+
+
+register_collector(_collect_runtime_stats)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Prometheus 文本格式指标：各阶段耗时直方图、请求计数，以及缓存、合并、网关、试绑定等运行时统计。"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
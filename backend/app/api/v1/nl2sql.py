@@ -1,37 +1,246 @@
+import asyncio
+import json
 import logging
+import time
+from typing import Any, AsyncIterator, Dict, Optional
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
-from app.core.nl2sql_workflow import run_nl2sql_workflow
-from app.core.schema_index import init_schema_index
-from app.models.nl_request import NLRequest
+from app.core.catalogs import get_catalog_registry, use_catalog
+from app.core.nl2sql_workflow import NL2SQL_BATCH_MAX_QUESTIONS, run_nl2sql_batch, run_nl2sql_workflow
+from app.core.query_executor import injected_row_limit, stream_sql
+from app.core.session_store import get_session_store
+from app.models.nl_request import NLBatchRequest, NLRequest
 
 router = APIRouter(prefix="/nl2sql", tags=["LLM"])
 logger = logging.getLogger(__name__)
 
 
-try:
-    init_schema_index()
-except Exception as exc:
-    logger.warning("初始化 schema 索引失败（后续按需初始化）：%s", exc)
-
-
 @router.post("/")
 async def nl2sql_handler(req: NLRequest):
-    """自然语言 → RAG 检索 schema → LLM 生成 SQL。"""
+    """
+    自然语言 → RAG 检索 schema → LLM 生成 SQL；verbosity 控制返回哪些字段，debug 时才生成 prompt 等调试产物。
+    带 session_id 时，追问（如“换成3月”“再按营业部拆分”）基于上一轮的意图、规则与 SQL 增量处理。
+    """
     user_question = req.text.strip() if req.text else ""
     if not user_question:
         raise HTTPException(status_code=400, detail="text 字段不能为空")
 
     logger.info("收到 NL2SQL 请求：%s", user_question)
 
+    with use_catalog(req.catalog):
+        try:
+            result = await run_nl2sql_workflow(user_question, verbosity=req.verbosity, session_id=req.session_id)
+        except Exception as exc:
+            logger.error("NL2SQL 工作流失败：%s", exc)
+            raise HTTPException(status_code=502, detail="NL2SQL 工作流执行失败")
+
+    if not result.get("sql"):
+        raise HTTPException(status_code=500, detail="未能从模型输出中解析出 SQL")
+
+    return result
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.post("/stream")
+async def nl2sql_stream_handler(req: NLRequest):
+    """
+    NL2SQL 的 SSE 版本：各阶段完成即推送 intent / tables / rules 事件，
+    LLM 生成时逐段推送 sql_token，试绑定修复了 SQL 时推送 sql_repaired，最后推送包含校验结果的 result 事件。
+    """
+    user_question = req.text.strip() if req.text else ""
+    if not user_question:
+        raise HTTPException(status_code=400, detail="text 字段不能为空")
+
+    logger.info("收到 NL2SQL 流式请求：%s", user_question)
+    # 未知目录在开始推送前就返回 404。
+    get_catalog_registry().get(req.catalog)
+
+    async def event_stream() -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue()
+        # create_task 复制当前上下文，工作流任务运行在所选数据目录上。
+        with use_catalog(req.catalog):
+            workflow = asyncio.create_task(
+                run_nl2sql_workflow(
+                    user_question,
+                    on_event=lambda event, data: queue.put_nowait((event, data)),
+                    verbosity="standard",
+                    session_id=req.session_id,
+                )
+            )
+        workflow.add_done_callback(lambda _: queue.put_nowait(None))
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield _sse(*item)
+
+            try:
+                result = workflow.result()
+            except Exception as exc:
+                logger.error("NL2SQL 流式工作流失败：%s", exc)
+                yield _sse("error", {"detail": "NL2SQL 工作流执行失败"})
+                return
+
+            if not result.get("sql"):
+                yield _sse("error", {"detail": "未能从模型输出中解析出 SQL"})
+                return
+
+            yield _sse(
+                "result",
+                {
+                    "sql": result["sql"],
+                    "generation_mode": result["generation_mode"],
+                    "validation": result["validation"],
+                    "dry_run": result.get("dry_run"),
+                    "cache": result.get("cache"),
+                    "stage_timings": result["stage_timings"],
+                    "session": result.get("session"),
+                },
+            )
+        finally:
+            # 客户端提前断开时取消仍在运行的工作流，避免白白消耗 LLM 调用。
+            if not workflow.done():
+                workflow.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/batch")
+async def nl2sql_batch_handler(req: NLBatchRequest):
+    """
+    批量 NL2SQL：问题去重后共享一次 schema / 知识库快照和一次批量向量编码，按 concurrency 有限并发执行。
+    以 NDJSON 流式返回，每完成一个问题输出一行 result（indices 为该问题在请求列表中的位置），最后一行为 summary。
+    """
+    questions = [question for question in req.questions if question and question.strip()]
+    if not questions:
+        raise HTTPException(status_code=400, detail="questions 不能为空")
+    if len(req.questions) > NL2SQL_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {NL2SQL_BATCH_MAX_QUESTIONS} 个问题")
+    if req.concurrency is not None and req.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency 必须大于 0")
+
+    logger.info("收到 NL2SQL 批量请求：%d 个问题", len(req.questions))
+    get_catalog_registry().get(req.catalog)
+
+    async def ndjson_stream() -> AsyncIterator[str]:
+        with use_catalog(req.catalog):
+            batch = run_nl2sql_batch(req.questions, req.concurrency, req.verbosity)
+            try:
+                async for item in batch:
+                    yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+            except Exception as exc:
+                logger.error("NL2SQL 批量请求失败：%s", exc)
+                yield json.dumps({"type": "error", "detail": "NL2SQL 批量请求执行失败"}, ensure_ascii=False) + "\n"
+            finally:
+                await batch.aclose()
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/ask")
+async def nl2sql_ask_handler(req: NLRequest):
+    """
+    生成并执行：一次请求内完成 NL2SQL、校验与执行，以 SSE 返回。
+    先推送 sql 事件（内容按 verbosity 裁剪，默认 minimal），校验未通过时推送 error 且不执行；
+    之后以连接池中的只读连接执行，首批结果一拿到就推送 rows 事件，其余结果分批推送，最后推送 done。
+    """
+    user_question = req.text.strip() if req.text else ""
+    if not user_question:
+        raise HTTPException(status_code=400, detail="text 字段不能为空")
+
+    logger.info("收到 NL2SQL 生成并执行请求：%s", user_question)
+    get_catalog_registry().get(req.catalog)
+
+    async def event_stream() -> AsyncIterator[str]:
+        with use_catalog(req.catalog):
+            events = _ask_events(user_question, req)
+            try:
+                async for event in events:
+                    yield event
+            finally:
+                # 客户端提前断开时立即归还连接池里的连接。
+                await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _ask_events(user_question: str, req: NLRequest) -> AsyncIterator[str]:
+    started = time.perf_counter()
     try:
-        result = run_nl2sql_workflow(user_question)
+        result = await run_nl2sql_workflow(user_question, verbosity=req.verbosity or "minimal", session_id=req.session_id)
     except Exception as exc:
         logger.error("NL2SQL 工作流失败：%s", exc)
-        raise HTTPException(status_code=502, detail="NL2SQL 工作流执行失败")
+        yield _sse("error", {"detail": "NL2SQL 工作流执行失败"})
+        return
 
     if not result.get("sql"):
-        raise HTTPException(status_code=500, detail="未能从模型输出中解析出 SQL")
+        yield _sse("error", {"detail": "未能从模型输出中解析出 SQL"})
+        return
 
-    return result
+    nl2sql_ms = round((time.perf_counter() - started) * 1000, 2)
+    yield _sse("sql", {**result, "elapsed_ms": nl2sql_ms})
+
+    validation = result.get("validation") or {}
+    if not validation.get("is_valid"):
+        yield _sse("error", {"detail": "SQL 校验未通过，未执行", "errors": validation.get("errors", [])})
+        return
+
+    row_count = 0
+    first_batch_ms = None
+    row_limit = injected_row_limit(result["sql"])
+    batches = stream_sql(result["sql"])
+    try:
+        async for batch in batches:
+            if first_batch_ms is None:
+                first_batch_ms = round((time.perf_counter() - started) * 1000, 2)
+            row_count += len(batch["rows"])
+            yield _sse("rows", batch)
+    except Exception as exc:
+        logger.error("SQL 执行失败：%s", exc)
+        yield _sse("error", {"detail": f"SQL 执行失败：{exc}"})
+        return
+    finally:
+        await batches.aclose()
+
+    yield _sse(
+        "done",
+        {
+            "row_count": row_count,
+            # 只有系统追加的 LIMIT 才算截断；SQL 自带的 LIMIT 是用户要的结果。
+            "truncated": row_limit is not None and row_count >= row_limit,
+            "timings": {
+                "nl2sql_ms": nl2sql_ms,
+                "first_batch_ms": first_batch_ms,
+                "total_ms": round((time.perf_counter() - started) * 1000, 2),
+            },
+        },
+    )
+
+
+@router.delete("/session/{session_id}")
+async def nl2sql_session_delete_handler(session_id: str, catalog: Optional[str] = None):
+    """结束会话：丢弃上一轮的意图、规则与 SQL，之后同一 session_id 的问题按新问题处理。会话按数据目录隔离。"""
+    with use_catalog(catalog, touch=False):
+        deleted = get_session_store().delete(session_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    return {"session_id": session_id, "deleted": True}
@@ -1,13 +1,18 @@
 import logging
 
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Response
 from pydantic import BaseModel
 
-from app.core.query_executor import run_sql
+from app.core.catalogs import use_catalog
+from app.core.query_executor import injected_row_limit, run_sql
 
 
 class QueryRequest(BaseModel):
     sql: str
+    # 目标数据目录，不传时使用默认目录。
+    catalog: Optional[str] = None
 
 
 router = APIRouter(prefix="/query", tags=["Query"])
@@ -15,15 +20,25 @@ logger = logging.getLogger(__name__)
 
 
 @router.post("/")
-async def run_query(req: QueryRequest):
-    """接收 SQL，执行并返回结果。"""
+async def run_query(req: QueryRequest, response: Response):
+    """
+    接收 SQL，执行并返回结果。未写 LIMIT 的 SELECT 会被追加 LIMIT QUERY_MAX_ROWS：
+    此时响应头 X-Row-Limit 为追加的行数上限，X-Result-Truncated 表示结果是否可能被截断（返回行数达到上限）。
+    """
     sql = req.sql.strip() if req.sql else ""
     if not sql:
         raise HTTPException(status_code=400, detail="SQL 不能为空")
 
     logger.info("收到 Query SQL：%s", sql)
-    try:
-        return await run_sql(sql)
-    except Exception as exc:
-        logger.error("SQL 执行失败：%s", exc)
-        raise HTTPException(status_code=500, detail=str(exc))
+    with use_catalog(req.catalog):
+        try:
+            rows = await run_sql(sql)
+        except Exception as exc:
+            logger.error("SQL 执行失败：%s", exc)
+            raise HTTPException(status_code=500, detail=str(exc))
+
+    row_limit = injected_row_limit(sql)
+    if row_limit is not None:
+        response.headers["X-Row-Limit"] = str(row_limit)
+    response.headers["X-Result-Truncated"] = "true" if row_limit is not None and len(rows) >= row_limit else "false"
+    return rows
@@ -1,8 +1,9 @@
 # app/api/v1/rag.py
 ## DEBUG RAG 检索相关接口
 from fastapi import APIRouter, Query
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
+from app.core.catalogs import use_catalog
 from app.core.schema_index import (
     init_schema_index,
     get_relevant_tables,
@@ -10,6 +11,7 @@ from app.core.schema_index import (
    # _load_schema_from_duckdb,   # 直接复用 schema 读取函数
 )
 from app.core.schema_service import get_full_schema
+from app.core.value_index import get_value_index, link_values
 
 router = APIRouter(
     prefix="/rag",
@@ -18,12 +20,13 @@ router = APIRouter(
 
 
 @router.get("/tables")
-def get_all_tables():
+def get_all_tables(catalog: Optional[str] = None):
     """
     返回数据库所有表结构。
     用来确认 DuckDB schema 是否正确加载。
     """
-    tables = get_full_schema()
+    with use_catalog(catalog):
+        tables = get_full_schema()
     return {
         "tables": tables,
         "total": len(tables),
@@ -32,14 +35,16 @@ def get_all_tables():
 
 @router.get("/search")
 def rag_search(query: str = Query(..., description="自然语言查询，例如：'查询用户订单金额'"),
-               top_k: int = 5):
+               top_k: int = 5,
+               catalog: Optional[str] = None):
     """
     基于自然语言做 RAG 检索，返回最相关的表结构与格式化文本。
     """
-    # 初始化 RAG（如果未初始化）
-    init_schema_index()
+    with use_catalog(catalog):
+        # 初始化 RAG（如果未初始化）
+        init_schema_index()
 
-    tables = get_relevant_tables(query, top_k=top_k)
+        tables = get_relevant_tables(query, top_k=top_k)
     formatted = format_tables_for_prompt(tables)
 
     return {
@@ -54,3 +59,25 @@ def rag_search(query: str = Query(..., description="自然语言查询，例如
         ],
         "formatted_schema": formatted
     }
+
+
+@router.get("/values")
+def value_search(query: str = Query(..., description="问题或取值片段，例如：'北京营业部' 或 'E00'"),
+                 limit: int = 10,
+                 catalog: Optional[str] = None):
+    """
+    列值索引调试：返回问题中链接到的 `列 = 值` 实体，以及按前缀、编辑距离 1 查到的候选取值。
+    """
+    with use_catalog(catalog):
+        index = get_value_index()
+        entities = link_values(query) if index is not None else []
+    if index is None:
+        return {"query": query, "available": False, "entities": [], "prefix": [], "fuzzy": []}
+
+    return {
+        "query": query,
+        "available": True,
+        "entities": entities,
+        "prefix": index.prefix(query, limit=limit),
+        "fuzzy": index.fuzzy(query, limit=limit),
+    }
@@ -1,5 +1,8 @@
+from typing import Optional
+
 from fastapi import APIRouter
 import logging
+from app.core.catalogs import use_catalog
 from app.core.schema_service import (
     get_full_schema as load_full_schema,
 )
@@ -14,5 +17,6 @@ router = APIRouter(
 
 
 @router.get("/")
-def get_full_schema() -> dict:
-    return load_full_schema()
+def get_full_schema(catalog: Optional[str] = None) -> dict:
+    with use_catalog(catalog):
+        return load_full_schema()
@@ -0,0 +1,18 @@
+import logging
+
+from fastapi import APIRouter, Query
+
+from app.core.query_stats import get_query_stats
+
+router = APIRouter(prefix="/stats", tags=["Stats"])
+logger = logging.getLogger(__name__)
+
+
+@router.get("/queries")
+async def top_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: str = Query("total_time", pattern="^(total_time|calls|mean_time|p95_time|rows)$"),
+):
+    """按 SQL 指纹聚合的查询统计，默认按总耗时取前 N 个，用于挑选预聚合与缓存目标。"""
+    store = get_query_stats()
+    return {"order_by": order_by, "store": store.stats(), "queries": store.top(limit, order_by)}
@@ -0,0 +1,132 @@
+"""
+NL2SQL 答案缓存：缓存已通过校验的 问题 → SQL 结果。
+
+查找顺序：先按规范化问题精确匹配，再在问题向量上做最近邻检索（需超过相似度阈值）。
+每条记录带 schema 版本与知识库版本，版本变化后自动视为过期；容量超限时按 LRU 淘汰。
+"""
+
+import copy
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.core.catalogs import current_catalog
+
+logger = logging.getLogger(__name__)
+
+NL2SQL_CACHE_MAX_ENTRIES = int(os.getenv("NL2SQL_CACHE_MAX_ENTRIES", "1000"))
+NL2SQL_CACHE_SIMILARITY = float(os.getenv("NL2SQL_CACHE_SIMILARITY", "0.95"))
+
+
+def normalize_question(question: str) -> str:
+    """全角转半角、统一小写、去掉空白和结尾标点，作为精确匹配的键。"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    text = re.sub(r"\s+", "", text)
+    return text.rstrip("?？。.!！")
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = NL2SQL_CACHE_MAX_ENTRIES, similarity_threshold: float = NL2SQL_CACHE_SIMILARITY) -> None:
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stale_evictions": 0, "lru_evictions": 0}
+
+    def _drop_stale(self, versions: Dict[str, str]) -> None:
+        stale = [key for key, entry in self._entries.items() if entry["versions"] != versions]
+        for key in stale:
+            del self._entries[key]
+        self._stats["stale_evictions"] += len(stale)
+
+    def lookup_exact(self, question: str, versions: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["versions"] != versions:
+                self._drop_stale(versions)
+                return None
+            self._entries.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            return self._hit(entry, "exact", 1.0)
+
+    def lookup_semantic(self, slots: Dict[str, List[str]], embedding: Any, versions: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """在槽位一致的记录中找余弦相似度最高的一条；槽位不同（如月份、工号不同）的问题绝不复用。"""
+        best_key, best_score = None, -1.0
+        with self._lock:
+            self._drop_stale(versions)
+            if embedding is not None:
+                for key, entry in self._entries.items():
+                    if entry["slots"] != slots or entry["embedding"] is None:
+                        continue
+                    score = float((entry["embedding"] * embedding).sum())
+                    if score > best_score:
+                        best_key, best_score = key, score
+
+            if best_key is None or best_score < self.similarity_threshold:
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(best_key)
+            self._stats["semantic_hits"] += 1
+            return self._hit(self._entries[best_key], "semantic", best_score)
+
+    def store(
+        self,
+        question: str,
+        slots: Dict[str, List[str]],
+        embedding: Any,
+        versions: Dict[str, str],
+        result: Dict[str, Any],
+    ) -> None:
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = {
+                "question": question,
+                "slots": slots,
+                "embedding": embedding,
+                "versions": dict(versions),
+                "result": copy.deepcopy(result),
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["lru_evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "max_entries": self.max_entries}
+
+    @staticmethod
+    def _hit(entry: Dict[str, Any], match: str, similarity: float) -> Dict[str, Any]:
+        result = copy.deepcopy(entry["result"])
+        result["cache"] = {
+            "hit": True,
+            "match": match,
+            "similarity": round(similarity, 4),
+            "cached_question": entry["question"],
+        }
+        return result
+
+
+def get_answer_cache() -> AnswerCache:
+    """当前数据目录的答案缓存：同一问题在不同库上的答案互不复用。"""
+    return current_catalog().get_state("answer_cache", AnswerCache)
+
+
+def is_cacheable(result: Dict[str, Any]) -> bool:
+    """只缓存校验无错误且无告警的结果，避免把可疑 SQL 复用给其他问题。"""
+    validation = result.get("validation") or {}
+    return bool(result.get("sql") and validation.get("is_valid") and not validation.get("warnings"))
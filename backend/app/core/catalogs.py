@@ -0,0 +1,282 @@
+"""
+数据目录（catalog）注册表：一个部署同时服务多个业务域，每个域有自己的 DuckDB 库和知识库。
+
+DATA_CATALOGS 为 JSON 列表（或指向 JSON 文件的路径），每项形如：
+    {"name": "sales", "duckdb_path": "/data/sales.duckdb", "knowledge_dir": "/data/sales/knowledge",
+     "description": "销售域", "memory_limit": "2GB", "value_index_path": "/data/sales/value_index.json"}
+只有 name 和 duckdb_path 必填。未配置时只有一个 default 目录，沿用 DUCKDB_PATH / KNOWLEDGE_DIR。
+请求通过 catalog 字段选择目录，不传时使用 DEFAULT_CATALOG（默认第一个目录）。
+
+每个目录的 schema 索引、知识库、连接池、列值索引、试绑定空表库、答案缓存和会话各自独立，首次使用时才构建，
+挂在 Catalog.state 上；Embedding 模型在所有目录之间共用。请求处理期间用 use_catalog 标记当前目录
+（contextvars，随 asyncio 任务和 to_thread 传递），底层模块通过 current_catalog() 取各自的状态，不必层层传参。
+
+空闲回收（run_catalog_evictor 定期执行）：超过 CATALOG_IDLE_SECONDS 未使用的目录，以及进程 RSS
+超过 CATALOG_MEMORY_LIMIT_MB 时按最久未使用顺序挑出的目录，在没有进行中请求时释放全部状态
+（关闭连接池、丢弃索引与缓存），下次使用时重新构建。
+"""
+
+import asyncio
+import contextvars
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_DUCKDB_PATH = os.getenv("DUCKDB_PATH", os.path.join(BASE_DIR, "app", "example.duckdb"))
+DEFAULT_KNOWLEDGE_DIR = os.getenv("KNOWLEDGE_DIR", os.path.join(BASE_DIR, "app", "knowledge"))
+DATA_CATALOGS = os.getenv("DATA_CATALOGS", "").strip()
+DEFAULT_CATALOG = os.getenv("DEFAULT_CATALOG", "")
+# 单个 DuckDB 库的内存上限（如 "1GB"）；不设时 DuckDB 默认用到物理内存的 80%，多个目录同时加载时容易超卖。
+CATALOG_DUCKDB_MEMORY_LIMIT = os.getenv("CATALOG_DUCKDB_MEMORY_LIMIT", "")
+CATALOG_IDLE_SECONDS = float(os.getenv("CATALOG_IDLE_SECONDS", "1800"))
+# 进程 RSS 超过该值时回收最久未使用的目录；0 表示不按内存回收。
+CATALOG_MEMORY_LIMIT_MB = float(os.getenv("CATALOG_MEMORY_LIMIT_MB", "0"))
+# 按内存回收时，最近这么多秒内用过的目录不回收，避免反复重建。
+CATALOG_MIN_IDLE_SECONDS = float(os.getenv("CATALOG_MIN_IDLE_SECONDS", "60"))
+CATALOG_EVICT_INTERVAL_SECONDS = float(os.getenv("CATALOG_EVICT_INTERVAL_SECONDS", "30"))
+
+
+class UnknownCatalogError(KeyError):
+    pass
+
+
+class Catalog:
+    def __init__(
+        self,
+        name: str,
+        duckdb_path: str,
+        knowledge_dir: Optional[str] = None,
+        description: str = "",
+        memory_limit: Optional[str] = None,
+        value_index_path: Optional[str] = None,
+        is_default: bool = False,
+    ) -> None:
+        self.name = name
+        self.duckdb_path = duckdb_path
+        self.knowledge_dir = knowledge_dir or DEFAULT_KNOWLEDGE_DIR
+        self.description = description
+        self.memory_limit = memory_limit or CATALOG_DUCKDB_MEMORY_LIMIT
+        self.value_index_path = value_index_path
+        self.is_default = is_default
+        self.state: Dict[str, Any] = {}
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get_state(self, key: str, factory: Callable[[], Any]) -> Any:
+        """取本目录的某项状态，首次使用时用 factory 创建；factory 应只创建轻量容器，重活留给调用方按需做。"""
+        value = self.state.get(key)
+        if value is None:
+            with self._lock:
+                value = self.state.get(key)
+                if value is None:
+                    value = factory()
+                    self.state[key] = value
+        return value
+
+    def enter(self) -> None:
+        with self._lock:
+            self.active += 1
+            self.last_used = time.monotonic()
+
+    def exit(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self.last_used = time.monotonic()
+
+    def release(self, idle_before: Optional[float] = None) -> List[str]:
+        """
+        丢弃全部状态，返回释放的状态名；带 close() 的对象（连接池）随后关闭。
+        给定 idle_before 时只在没有进行中请求、且最后使用早于该时间点时释放：检查与摘除状态在同一把锁内完成，
+        期间不会有新请求进入（enter 也要拿这把锁），摘除之后进来的请求会重新创建状态。
+        """
+        with self._lock:
+            if idle_before is not None and (self.active or self.last_used > idle_before):
+                return []
+            state, self.state = self.state, {}
+        for key, value in state.items():
+            close = getattr(value, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception as exc:
+                    logger.warning("释放目录 %s 的 %s 失败：%s", self.name, key, exc)
+        if state:
+            self.evictions += 1
+        return sorted(state)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "duckdb_path": self.duckdb_path,
+            "knowledge_dir": self.knowledge_dir,
+            "default": self.is_default,
+            "loaded": sorted(self.state),
+            "active_requests": self.active,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "evictions": self.evictions,
+        }
+
+
+def _load_catalog_configs() -> List[Dict[str, Any]]:
+    if not DATA_CATALOGS:
+        return [{"name": "default", "duckdb_path": DEFAULT_DUCKDB_PATH, "knowledge_dir": DEFAULT_KNOWLEDGE_DIR}]
+    raw = DATA_CATALOGS
+    if not raw.startswith("["):
+        with open(raw, "r", encoding="utf-8") as handle:
+            raw = handle.read()
+    configs = json.loads(raw)
+    if not isinstance(configs, list) or not configs:
+        raise ValueError("DATA_CATALOGS 必须是非空 JSON 列表。")
+    for config in configs:
+        if not config.get("name") or not config.get("duckdb_path"):
+            raise ValueError(f"目录配置缺少 name 或 duckdb_path：{config}")
+    return configs
+
+
+def _current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class CatalogRegistry:
+    def __init__(self, configs: List[Dict[str, Any]], default: str = "") -> None:
+        self._catalogs: Dict[str, Catalog] = {}
+        default = default or configs[0]["name"]
+        for config in configs:
+            catalog = Catalog(
+                config["name"],
+                config["duckdb_path"],
+                config.get("knowledge_dir"),
+                config.get("description", ""),
+                config.get("memory_limit"),
+                config.get("value_index_path"),
+                is_default=config["name"] == default,
+            )
+            self._catalogs[catalog.name] = catalog
+        if default not in self._catalogs:
+            raise ValueError(f"DEFAULT_CATALOG={default} 不在已配置的目录中。")
+        self.default = self._catalogs[default]
+        self._stats = {"idle_evictions": 0, "memory_evictions": 0}
+
+    def get(self, name: Optional[str] = None) -> Catalog:
+        if not name:
+            return self.default
+        catalog = self._catalogs.get(name)
+        if catalog is None:
+            raise UnknownCatalogError(name)
+        return catalog
+
+    def catalogs(self) -> List[Catalog]:
+        return list(self._catalogs.values())
+
+    def evict_idle(self, now: Optional[float] = None, rss_mb: Optional[float] = None) -> List[str]:
+        """先回收空闲超时的目录，再在内存超限时按最久未使用顺序回收，进行中有请求的目录不动。"""
+        now = time.monotonic() if now is None else now
+        evicted = []
+        for catalog in self.catalogs():
+            if catalog.state and catalog.release(idle_before=now - CATALOG_IDLE_SECONDS):
+                evicted.append(catalog.name)
+                self._stats["idle_evictions"] += 1
+
+        if CATALOG_MEMORY_LIMIT_MB > 0:
+            rss_mb = _current_rss_mb() if rss_mb is None else rss_mb
+            candidates = sorted(
+                (catalog for catalog in self.catalogs() if catalog.state and not catalog.active and now - catalog.last_used > CATALOG_MIN_IDLE_SECONDS),
+                key=lambda catalog: catalog.last_used,
+            )
+            while rss_mb > CATALOG_MEMORY_LIMIT_MB and candidates:
+                catalog = candidates.pop(0)
+                # 挑选之后可能又有请求进来，以释放时的检查为准。
+                if not catalog.release(idle_before=now - CATALOG_MIN_IDLE_SECONDS):
+                    continue
+                evicted.append(catalog.name)
+                self._stats["memory_evictions"] += 1
+                gc.collect()
+                rss_mb = _current_rss_mb()
+
+        if evicted:
+            logger.info("回收空闲数据目录：%s", evicted)
+        return evicted
+
+    def close(self) -> None:
+        for catalog in self.catalogs():
+            catalog.release()
+
+    def stats(self) -> Dict[str, float]:
+        catalogs = self.catalogs()
+        return {
+            **self._stats,
+            "configured": len(catalogs),
+            "loaded": sum(1 for catalog in catalogs if catalog.state),
+            "active_requests": sum(catalog.active for catalog in catalogs),
+            "rss_mb": round(_current_rss_mb(), 1),
+        }
+
+
+_registry: Optional[CatalogRegistry] = None
+_registry_lock = threading.Lock()
+_current: "contextvars.ContextVar[Optional[Catalog]]" = contextvars.ContextVar("catalog", default=None)
+
+
+def get_catalog_registry() -> CatalogRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = CatalogRegistry(_load_catalog_configs(), DEFAULT_CATALOG)
+    return _registry
+
+
+def current_catalog() -> Catalog:
+    """当前请求的目录；未在 use_catalog 范围内（启动预热、命令行工具等）时为默认目录。"""
+    return _current.get() or get_catalog_registry().default
+
+
+@contextmanager
+def use_catalog(name: Optional[str] = None, touch: bool = True) -> Iterator[Catalog]:
+    """在当前上下文内切换到指定目录；未知目录抛 UnknownCatalogError。touch=False 时不计为一次使用（指标采集等）。"""
+    catalog = get_catalog_registry().get(name)
+    token = _current.set(catalog)
+    if touch:
+        catalog.enter()
+    try:
+        yield catalog
+    finally:
+        if touch:
+            catalog.exit()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 异步生成器可能在另一个上下文里被关闭，此时该上下文本就会随之丢弃。
+            pass
+
+
+async def run_catalog_evictor(interval: float = CATALOG_EVICT_INTERVAL_SECONDS) -> None:
+    registry = get_catalog_registry()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(registry.evict_idle)
+        except Exception as exc:
+            logger.warning("回收空闲数据目录失败：%s", exc)
+
+
+def get_catalog_stats() -> Dict[str, float]:
+    return get_catalog_registry().stats()
@@ -1,53 +1,373 @@
-from typing import Any, Dict, List
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+
+from app.core.knowledge_base import get_knowledge_version, load_knowledge_base
+from app.core.schema_index import format_tables_for_prompt
+
+# 整个 prompt（静态前缀 + 动态部分）的 token 预算；前缀先计入，剩余额度放不下的动态段落按优先级丢弃。
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# 字段数不超过该值的表保留全部字段，否则只保留相关字段。
+PROMPT_MAX_COLUMNS_PER_TABLE = int(os.getenv("PROMPT_MAX_COLUMNS_PER_TABLE", "12"))
+# 裁剪后至少保留的字段数：主键/关联键之外不足时按表内顺序补齐前几列，避免整张表一个字段都不剩。
+PROMPT_MIN_COLUMNS_PER_TABLE = int(os.getenv("PROMPT_MIN_COLUMNS_PER_TABLE", "4"))
+# 静态前缀（指令 + 规则词表 + 热点表 schema）的 token 上限，计入 PROMPT_TOKEN_BUDGET，应明显小于后者。
+PROMPT_PREFIX_TOKEN_BUDGET = int(os.getenv("PROMPT_PREFIX_TOKEN_BUDGET", "2000"))
+# 修改下面的指令文本时同步升级修订号，便于区分不同版本前缀的缓存命中情况。
+PROMPT_PREFIX_REVISION = "sqlgen-r1"
+
+_SQL_INSTRUCTIONS = """
+你是证券公司收入分析 SQL 助手。请根据给定的 schema、指标规则、业务术语规则、时间规则和关联规则生成 SQL。
+
+请严格遵守以下要求：
+1. 只允许输出一条 SELECT / WITH SQL，不要输出解释或 Markdown。
+2. 只能使用给定 schema 中存在的表和字段，不要臆造。
+3. 优先遵循业务规则中的指标编码、时间映射和术语口径。
+4. 如果某条业务规则依赖的表不在 schema 中，不要编造该表；尽量使用已知表生成最接近的 SQL。
+5. 如果无法完整满足规则，请保持 SQL 保守，不要伪造条件。
+6. 下方[规则词表]与[常用表 Schema]对所有问题通用；本次问题相关的补充规则与表结构在用户消息中给出。
+""".strip()
+
+# 时间规则不进词表：只有问题里出现了对应粒度的时间，命中的那几条才放进动态部分。
+_GLOSSARY_TITLES = {
+    "metrics": "指标规则",
+    "business_terms": "业务术语规则",
+    "join_rules": "Join 规则",
+}
+
+_CJK = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# 看起来像关联键的字段名：id、xxx_id、xxx_num、xxx_no、xxx_code、xxx_key。
+_KEY_COLUMN = re.compile(r"^(?:id|.+_(?:id|num|no|code|key))$", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 token/字，其余字符约 4 字符/token。"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def _hot_table_names(full_schema: Dict[str, Dict[str, Any]]) -> List[str]:
+    """热点表：知识库规则直接引用、且 schema 中存在的表。"""
+    kb = load_knowledge_base()
+    names: Set[str] = set()
+    for rule in kb.get("metrics", []):
+        if rule.get("source_table"):
+            names.add(rule["source_table"])
+    for rule in kb.get("business_terms", []):
+        names.update(rule.get("required_tables", []))
+    for rule in kb.get("join_rules", []):
+        names.update(rule.get("tables", []))
+    return sorted(name for name in names if name in full_schema)
+
+
+@lru_cache(maxsize=8)
+def _render_static_prefix(knowledge_version: str, hot_tables_json: str) -> Dict[str, Any]:
+    used_tokens = estimate_tokens(_SQL_INSTRUCTIONS)
+    schema_parts: List[str] = []
+    table_names: List[str] = []
+    for table in json.loads(hot_tables_json):
+        text = format_tables_for_prompt([table]).strip()
+        cost = estimate_tokens(text)
+        if used_tokens + cost > PROMPT_PREFIX_TOKEN_BUDGET:
+            continue
+        used_tokens += cost
+        schema_parts.append(text)
+        table_names.append(table["table_name"])
+
+    glossary_parts: List[str] = []
+    rule_ids: List[str] = []
+    kb = load_knowledge_base()
+    for category, title in _GLOSSARY_TITLES.items():
+        for rule in kb.get(category, []):
+            text = f"（{title}）\n{rule.get('context_text', '')}"
+            cost = estimate_tokens(text)
+            if used_tokens + cost > PROMPT_PREFIX_TOKEN_BUDGET:
+                continue
+            used_tokens += cost
+            glossary_parts.append(text)
+            rule_ids.append(rule.get("id"))
+
+    text = "\n\n".join(
+        [
+            _SQL_INSTRUCTIONS,
+            "[规则词表]\n" + ("\n\n".join(glossary_parts) or "无"),
+            "[常用表 Schema]\n" + ("\n\n".join(schema_parts) or "无"),
+        ]
+    )
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+    return {
+        "text": text,
+        "version": f"{PROMPT_PREFIX_REVISION}-{digest}",
+        "tokens": estimate_tokens(text),
+        "rule_ids": frozenset(rule_ids),
+        "table_names": frozenset(table_names),
+    }
+
+
+def build_static_prefix(full_schema: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    SQL 生成 prompt 的静态前缀：固定指令 + 规则词表 + 热点表 schema。
+    内容只取决于知识库与热点表结构，同版本下逐字节一致，便于服务商复用前缀缓存。
+    """
+    hot_tables = [
+        {"table_name": name, "comment": full_schema[name].get("comment", ""), "columns": full_schema[name].get("columns", [])}
+        for name in _hot_table_names(full_schema)
+    ]
+    hot_tables_json = json.dumps(hot_tables, ensure_ascii=False, sort_keys=True, default=str)
+    return _render_static_prefix(get_knowledge_version(), hot_tables_json)
+
+
+def _compact_intent(parsed_intent: Dict[str, Any]) -> str:
+    compact = {key: value for key, value in parsed_intent.items() if value not in (None, "", [], {}, False)}
+    return json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+
+
+def _rule_identifiers(rules: List[Dict[str, Any]]) -> Set[str]:
+    """收集规则里引用到的字段名，这些字段在裁剪 schema 时必须保留。"""
+    identifiers: Set[str] = set()
+    for rule in rules:
+        for key in ["code_field", "value_field", "time_field"]:
+            if rule.get(key):
+                identifiers.add(rule[key].lower())
+        for text in [*rule.get("join_keys", []), rule.get("sql_hint", "")]:
+            identifiers.update(token.lower() for token in _IDENTIFIER.findall(text or ""))
+    return identifiers
+
+
+def _column_score(column: Dict[str, Any], user_question: str, rule_identifiers: Set[str]) -> int:
+    name = str(column.get("name") or "")
+    comment = str(column.get("comment") or "")
+    score = 0
+    if name.lower() in rule_identifiers:
+        score += 100
+    if name and name.lower() in user_question.lower():
+        score += 80
+    if comment:
+        score += 10 * sum(1 for char in set(user_question) if _CJK.match(char) and char in comment)
+    if column.get("pk"):
+        score += 20
+    return score
+
+
+def _prune_columns(table: Dict[str, Any], user_question: str, rule_identifiers: Set[str]) -> Dict[str, Any]:
+    columns = table.get("columns", [])
+    if len(columns) <= PROMPT_MAX_COLUMNS_PER_TABLE:
+        return table
+
+    scored = [(_column_score(column, user_question, rule_identifiers), index, column) for index, column in enumerate(columns)]
+    keys = [item for item in scored if item[2].get("pk") or _KEY_COLUMN.match(str(item[2].get("name") or ""))]
+    required = [item for item in scored if item[0] >= 100 or item in keys]
+    optional = sorted((item for item in scored if 0 < item[0] and item not in required), key=lambda item: item[0], reverse=True)
+    kept = required + optional[: max(0, PROMPT_MAX_COLUMNS_PER_TABLE - len(required))]
+    for item in scored:
+        if len(kept) >= PROMPT_MIN_COLUMNS_PER_TABLE:
+            break
+        if item not in kept:
+            kept.append(item)
+    kept.sort(key=lambda item: item[1])
+    return {**table, "columns": [column for _, _, column in kept], "pruned_columns": len(columns) - len(kept)}
+
+
+def _rule_section(title: str, rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # 精确命中的规则没有检索分数，排在最前。
+    ranked = sorted(rules, key=lambda rule: rule.get("score", float("inf")), reverse=True)
+    return {"title": title, "items": [rule.get("context_text", "") for rule in ranked]}
 
 
 def build_sql_generation_prompt(
     user_question: str,
     parsed_intent: Dict[str, Any],
-    schema_text: str,
+    schema_tables: List[Dict[str, Any]],
     metric_rules: List[Dict[str, Any]],
     business_term_rules: List[Dict[str, Any]],
     join_rules: List[Dict[str, Any]],
     time_rules: List[Dict[str, Any]],
     missing_tables: List[str],
-) -> str:
-    metric_sections = "\n\n".join(rule.get("context_text", "") for rule in metric_rules) or "（未检索到指标规则）"
-    term_sections = "\n\n".join(rule.get("context_text", "") for rule in business_term_rules) or "（未检索到业务术语规则）"
-    join_sections = "\n\n".join(rule.get("context_text", "") for rule in join_rules) or "（未检索到 Join 规则）"
-    time_sections = "\n\n".join(rule.get("context_text", "") for rule in time_rules) or "（未检索到时间规则）"
-    missing_table_text = ", ".join(missing_tables) if missing_tables else "无"
-
-    return f"""
-你是证券公司收入分析 SQL 助手。请根据给定的 schema、指标规则、业务术语规则、时间规则和关联规则生成 SQL。
+    hinted_tables: Optional[Set[str]] = None,
+    full_schema: Optional[Dict[str, Dict[str, Any]]] = None,
+    token_budget: Optional[int] = None,
+    include_debug: bool = False,
+) -> Dict[str, Any]:
+    """
+    组装 SQL 生成 prompt：system 消息是静态前缀，user 消息是本次请求的动态部分。
 
-请严格遵守以下要求：
-1. 只允许输出一条 SELECT / WITH SQL，不要输出解释或 Markdown。
-2. 只能使用给定 schema 中存在的表和字段，不要臆造。
-3. 优先遵循业务规则中的指标编码、时间映射和术语口径。
-4. 如果某条业务规则依赖的表不在 schema 中，不要编造该表；尽量使用已知表生成最接近的 SQL。
-5. 如果无法完整满足规则，请保持 SQL 保守，不要伪造条件。
+    静态前缀已包含的规则与表不会在动态部分重复出现。token 预算先扣除静态前缀，动态部分用剩余额度依次放入：
+    指标规则 → 规则依赖的表 → 时间规则 → Join 规则 → 业务术语规则 → 其余检索到的表（按检索分数），
+    放不下的段落整体丢弃并记录在 dropped_sections 中；宽表只保留规则引用或与问题相关的字段。
+    用户问题放在最后，保证前面的内容尽可能稳定。
+    拼接后的完整 prompt 文本与实际使用的 schema 文本只用于调试，include_debug=True 时才生成，否则为 None。
+    """
+    budget = token_budget or PROMPT_TOKEN_BUDGET
+    hinted_tables = hinted_tables or set()
+    prefix = build_static_prefix(full_schema or {})
+    all_rules = [*metric_rules, *business_term_rules, *join_rules, *time_rules]
+    rule_identifiers = _rule_identifiers(all_rules)
+
+    def _dynamic_rules(rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [rule for rule in rules if rule.get("id") not in prefix["rule_ids"]]
+
+    tail = f"""
+[规则依赖但 schema 中缺失的表]
+{", ".join(missing_tables) if missing_tables else "无"}
+
+[查询解析结果]
+{_compact_intent(parsed_intent)}
 
 [用户问题]
 {user_question}
+""".strip()
 
-[查询解析结果]
-{parsed_intent}
+    used_tokens = prefix["tokens"] + estimate_tokens(tail)
+    dropped: List[str] = []
+
+    dynamic_tables = [table for table in schema_tables if table["table_name"] not in prefix["table_names"]]
+    ranked_tables = sorted(
+        dynamic_tables,
+        key=lambda table: (table["table_name"] in hinted_tables, table.get("score", 0)),
+        reverse=True,
+    )
+    pruned_tables = [_prune_columns(table, user_question, rule_identifiers) for table in ranked_tables]
+    hinted = [table for table in pruned_tables if table["table_name"] in hinted_tables]
+    retrieved = [table for table in pruned_tables if table["table_name"] not in hinted_tables]
 
-[指标规则]
-{metric_sections}
+    sections = [
+        _rule_section("指标规则", _dynamic_rules(metric_rules)),
+        {"title": "Schema", "tables": hinted},
+        _rule_section("时间规则", _dynamic_rules(time_rules)),
+        _rule_section("Join 规则", _dynamic_rules(join_rules)),
+        _rule_section("业务术语规则", _dynamic_rules(business_term_rules)),
+        {"title": "Schema", "tables": retrieved},
+    ]
 
-[业务术语规则]
-{term_sections}
+    rendered: Dict[str, List[str]] = {}
+    included_tables: List[Dict[str, Any]] = []
+    for section in sections:
+        items = section.get("items")
+        if items is None:
+            items = [format_tables_for_prompt([table]).strip() for table in section["tables"]]
+            names = [table["table_name"] for table in section["tables"]]
+        else:
+            names = [f"{section['title']}#{index + 1}" for index in range(len(items))]
 
-[Join 规则]
-{join_sections}
+        for index, (name, text) in enumerate(zip(names, items)):
+            cost = estimate_tokens(text) + 2
+            if used_tokens + cost > budget:
+                dropped.append(name)
+                continue
+            used_tokens += cost
+            rendered.setdefault(section["title"], []).append(text)
+            if "tables" in section:
+                included_tables.append(section["tables"][index])
 
-[时间规则]
-{time_sections}
+    body = [
+        f"[本次补充的{title}]\n" + "\n\n".join(rendered[title])
+        for title in ["指标规则", "业务术语规则", "Join 规则", "时间规则", "Schema"]
+        if rendered.get(title)
+    ]
+    user_content = "\n\n".join([*body, tail])
 
-[Schema]
-{schema_text}
+    prompt_text = schema_text = None
+    if include_debug:
+        prefix_schema_tables = [
+            {"table_name": name, **{key: full_schema[name].get(key) for key in ["comment", "columns"]}}
+            for name in sorted(prefix["table_names"])
+        ] if full_schema else []
+        used_tables = prefix_schema_tables + included_tables
+        prompt_text = prefix["text"] + "\n\n" + user_content
+        schema_text = format_tables_for_prompt(used_tables) if used_tables else ""
+    return {
+        "messages": [
+            {"role": "system", "content": prefix["text"]},
+            {"role": "user", "content": user_content},
+        ],
+        "prompt": prompt_text,
+        "prefix_version": prefix["version"],
+        "schema_text": schema_text,
+        "prompt_tokens": prefix["tokens"] + estimate_tokens(user_content),
+        "prefix_tokens": prefix["tokens"],
+        "token_budget": budget,
+        "dropped_sections": dropped,
+        "pruned_columns": sum(table.get("pruned_columns", 0) for table in included_tables),
+    }
+
+
+def build_sql_edit_prompt(
+    follow_up: str,
+    parsed_intent: Dict[str, Any],
+    previous_question: str,
+    previous_sql: str,
+    schema_tables: List[Dict[str, Any]],
+    new_rules: List[Dict[str, Any]],
+    missing_tables: List[str],
+    full_schema: Optional[Dict[str, Dict[str, Any]]] = None,
+    token_budget: Optional[int] = None,
+    include_debug: bool = False,
+) -> Dict[str, Any]:
+    """
+    会话追问的精简修改 prompt：system 消息沿用静态前缀；user 消息只给上一轮问题与 SQL、合并后的意图、
+    本轮新增的规则和 SQL 需要的表（按追问裁剪字段），要求模型在上一轮 SQL 上做最小修改。
+    返回结构与 build_sql_generation_prompt 相同。
+    """
+    budget = token_budget or PROMPT_TOKEN_BUDGET
+    prefix = build_static_prefix(full_schema or {})
+    rule_identifiers = _rule_identifiers(new_rules) | {token.lower() for token in _IDENTIFIER.findall(previous_sql)}
+
+    tail = f"""
+[上一轮问题]
+{previous_question}
+
+[上一轮 SQL]
+{previous_sql}
 
 [规则依赖但 schema 中缺失的表]
-{missing_table_text}
+{", ".join(missing_tables) if missing_tables else "无"}
+
+[合并后的查询解析结果]
+{_compact_intent(parsed_intent)}
+
+[追问]
+{follow_up}
+
+请在上一轮 SQL 的基础上做最小修改以满足追问，输出修改后的完整 SQL。
 """.strip()
+
+    used_tokens = prefix["tokens"] + estimate_tokens(tail)
+    dropped: List[str] = []
+    rendered: List[str] = []
+    rule_texts = [rule.get("context_text", "") for rule in new_rules if rule.get("id") not in prefix["rule_ids"]]
+    tables = [
+        _prune_columns(table, follow_up, rule_identifiers)
+        for table in schema_tables
+        if table["table_name"] not in prefix["table_names"]
+    ]
+    items = [(f"规则#{index + 1}", "[本轮新增规则]\n" + text) for index, text in enumerate(rule_texts)]
+    items += [(table["table_name"], "[Schema]\n" + format_tables_for_prompt([table]).strip()) for table in tables]
+    for name, text in items:
+        cost = estimate_tokens(text) + 2
+        if used_tokens + cost > budget:
+            dropped.append(name)
+            continue
+        used_tokens += cost
+        rendered.append(text)
+
+    user_content = "\n\n".join([*rendered, tail])
+    return {
+        "messages": [
+            {"role": "system", "content": prefix["text"]},
+            {"role": "user", "content": user_content},
+        ],
+        "prompt": prefix["text"] + "\n\n" + user_content if include_debug else None,
+        "prefix_version": prefix["version"],
+        "schema_text": format_tables_for_prompt(tables) if include_debug and tables else None,
+        "prompt_tokens": prefix["tokens"] + estimate_tokens(user_content),
+        "prefix_tokens": prefix["tokens"],
+        "token_budget": budget,
+        "dropped_sections": dropped,
+        "pruned_columns": sum(table.get("pruned_columns", 0) for table in tables),
+    }
@@ -0,0 +1,233 @@
+"""
+DuckDB 数据快照：不停服、不覆盖正在被读取的文件地更新数据。
+
+在 DUCKDB_PATH 同目录准备版本化文件（example.<快照号>.duckdb），再原子替换指针文件
+（example.duckdb.current）完成切换。各进程取连接时比对指针文件：新请求使用新快照，
+已在执行的查询在旧快照上跑完，旧快照最后一个读者归还后关闭其连接（见 query_executor.ConnectionPool）。
+schema 目录、schema 索引、列值索引与答案缓存都以快照号为版本键，切换后自动失效。
+
+没有指针文件时直接使用 DUCKDB_PATH，快照号由文件 mtime/size 生成，兼容直接覆盖文件的旧做法。
+配置了多个数据目录（见 catalogs）时，各目录的库文件各自有快照与指针文件，默认作用于当前目录。
+
+发布与回滚（backend 目录下，任一进程执行即可，运行中的 worker 会自动切换）：
+    python -m app.core.db_snapshots publish /data/export/new.duckdb     # 拷贝为新快照并切换（--move 改为移动）
+    python -m app.core.db_snapshots list
+    python -m app.core.db_snapshots rollback <快照号>
+    python -m app.core.db_snapshots --catalog sales publish /data/export/sales.duckdb
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.catalogs import current_catalog, use_catalog
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - 运行环境缺依赖时仅在调用时失败
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# 发布新快照后保留的快照文件数（含当前快照），更早的文件被删除；进程内仍打开的旧文件在读者归还后才真正释放。
+DB_SNAPSHOT_KEEP = int(os.getenv("DB_SNAPSHOT_KEEP", "3"))
+
+_SNAPSHOT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class Snapshot(NamedTuple):
+    id: str
+    path: str
+
+
+def _db_path(db_path: Optional[str] = None) -> str:
+    """未指定库文件时使用当前数据目录的 DuckDB 文件。"""
+    return db_path or current_catalog().duckdb_path
+
+
+def pointer_path(db_path: Optional[str] = None) -> str:
+    return f"{_db_path(db_path)}.current"
+
+
+def _snapshot_file(snapshot_id: str, db_path: Optional[str] = None) -> str:
+    stem, ext = os.path.splitext(_db_path(db_path))
+    return f"{stem}.{snapshot_id}{ext or '.duckdb'}"
+
+
+def _snapshot_file_pattern(db_path: Optional[str] = None) -> "re.Pattern[str]":
+    stem, ext = os.path.splitext(os.path.basename(_db_path(db_path)))
+    return re.compile(rf"^{re.escape(stem)}\.([A-Za-z0-9_-]+){re.escape(ext or '.duckdb')}$")
+
+
+# 指针文件路径 -> ((inode, mtime_ns, size), 解析出的快照)
+_cached: Dict[str, Tuple[Tuple[int, int, int], Snapshot]] = {}
+_cache_lock = threading.Lock()
+
+
+def current_snapshot(db_path: Optional[str] = None) -> Snapshot:
+    """当前快照；每次调用只做一次 stat，指针文件未变化时直接复用解析结果。"""
+    db_path = _db_path(db_path)
+    pointer = pointer_path(db_path)
+    try:
+        stat = os.stat(pointer)
+    except FileNotFoundError:
+        stat = os.stat(db_path)
+        return Snapshot(f"file-{stat.st_mtime_ns:x}-{stat.st_size:x}", db_path)
+
+    # 指针文件通过 os.replace 更新，inode 必然变化；mtime 精度较粗的文件系统上也能识别切换。
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _cached.get(pointer)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with _cache_lock:
+        with open(pointer, "r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+        snapshot = Snapshot(payload["snapshot_id"], os.path.join(os.path.dirname(db_path), payload["file"]))
+        if cached is not None and cached[1].id != snapshot.id:
+            logger.info("数据快照已切换：%s → %s（%s）", cached[1].id, snapshot.id, db_path)
+        _cached[pointer] = (key, snapshot)
+    return snapshot
+
+
+def _write_pointer(snapshot_id: str, path: str, db_path: Optional[str] = None) -> None:
+    pointer = pointer_path(db_path)
+    tmp_path = f"{pointer}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump({"snapshot_id": snapshot_id, "file": os.path.basename(path), "published_at": time.time()}, handle)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, pointer)
+
+
+def connect_read_only(path: Optional[str] = None, memory_limit: Optional[str] = None) -> Any:
+    """
+    只读打开库文件，默认为当前数据目录的当前快照。DuckDB 不允许同一进程用不同配置打开同一个文件，
+    所以连库一律经过这里：内存上限统一取当前数据目录的 memory_limit（见 catalogs）。
+    """
+    if duckdb is None:
+        raise RuntimeError("duckdb is not installed")
+    memory_limit = memory_limit or current_catalog().memory_limit
+    config = {"memory_limit": memory_limit} if memory_limit else {}
+    return duckdb.connect(path or current_snapshot().path, read_only=True, config=config)
+
+
+def _validate(path: str) -> int:
+    """切换前确认文件是可读的 DuckDB 库，返回表数量。"""
+    with connect_read_only(path) as conn:
+        return len(conn.execute("SHOW TABLES;").fetchall())
+
+
+def list_snapshots(db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """同目录下的全部快照文件，按修改时间从新到旧。"""
+    db_path = _db_path(db_path)
+    directory = os.path.dirname(db_path) or "."
+    pattern = _snapshot_file_pattern(db_path)
+    try:
+        current_id = current_snapshot(db_path).id
+    except OSError:
+        current_id = None
+    snapshots = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if not match:
+            continue
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        snapshots.append(
+            {"snapshot_id": match.group(1), "path": path, "size": stat.st_size, "mtime": stat.st_mtime, "current": match.group(1) == current_id}
+        )
+    snapshots.sort(key=lambda item: item["mtime"], reverse=True)
+    return snapshots
+
+
+def prune_snapshots(keep: int = DB_SNAPSHOT_KEEP, db_path: Optional[str] = None) -> List[str]:
+    """删除超出保留数量的旧快照文件，当前快照永不删除。"""
+    removed = []
+    kept = 0
+    for snapshot in list_snapshots(db_path):
+        if snapshot["current"] or kept < keep - 1:
+            kept += 0 if snapshot["current"] else 1
+            continue
+        try:
+            os.remove(snapshot["path"])
+            removed.append(snapshot["snapshot_id"])
+        except OSError as exc:
+            logger.warning("删除旧快照 %s 失败：%s", snapshot["path"], exc)
+    return removed
+
+
+def publish_snapshot(
+    source: str, snapshot_id: Optional[str] = None, move: bool = False, keep: int = DB_SNAPSHOT_KEEP, db_path: Optional[str] = None
+) -> Snapshot:
+    """把 source 放到库文件旁成为新快照并原子切换；源文件先校验，切换失败不影响当前快照。"""
+    db_path = _db_path(db_path)
+    snapshot_id = snapshot_id or f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    if not _SNAPSHOT_ID_PATTERN.match(snapshot_id):
+        raise ValueError(f"快照号只能包含字母、数字、下划线和连字符：{snapshot_id}")
+    target = _snapshot_file(snapshot_id, db_path)
+    if os.path.exists(target):
+        raise FileExistsError(f"快照已存在：{target}")
+
+    tmp_path = f"{target}.tmp"
+    if move:
+        shutil.move(source, tmp_path)
+    else:
+        shutil.copyfile(source, tmp_path)
+    try:
+        tables = _validate(tmp_path)
+    except Exception:
+        # --move 时这是源文件唯一的一份，放回原处而不是删掉。
+        if move:
+            shutil.move(tmp_path, source)
+        else:
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, target)
+    _write_pointer(snapshot_id, target, db_path)
+    removed = prune_snapshots(keep, db_path)
+    logger.info("已发布数据快照 %s（%d 张表），清理旧快照：%s", snapshot_id, tables, removed or "无")
+    return Snapshot(snapshot_id, target)
+
+
+def rollback_snapshot(snapshot_id: str, db_path: Optional[str] = None) -> Snapshot:
+    target = _snapshot_file(snapshot_id, db_path)
+    if not os.path.exists(target):
+        raise FileNotFoundError(f"快照不存在：{target}")
+    _write_pointer(snapshot_id, target, db_path)
+    logger.info("已切换回数据快照 %s", snapshot_id)
+    return Snapshot(snapshot_id, target)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="DuckDB 数据快照发布与回滚")
+    parser.add_argument("--catalog", default=None, help="数据目录名，默认为 DEFAULT_CATALOG")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="发布新快照并切换")
+    publish.add_argument("source", help="新的 DuckDB 文件")
+    publish.add_argument("--id", default=None, help="快照号，默认按时间生成")
+    publish.add_argument("--move", action="store_true", help="移动而不是拷贝源文件（同一文件系统时更快）")
+    publish.add_argument("--keep", type=int, default=DB_SNAPSHOT_KEEP, help="保留的快照文件数")
+    commands.add_parser("list", help="列出快照")
+    rollback = commands.add_parser("rollback", help="切换回已有快照")
+    rollback.add_argument("snapshot_id")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with use_catalog(args.catalog, touch=False):
+        if args.command == "publish":
+            print(json.dumps(publish_snapshot(args.source, args.id, args.move, args.keep)._asdict(), ensure_ascii=False))
+        elif args.command == "rollback":
+            print(json.dumps(rollback_snapshot(args.snapshot_id)._asdict(), ensure_ascii=False))
+        else:
+            print(json.dumps(list_snapshots(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+schema 检索使用的 Embedding 后端，按部署通过 EMBEDDING_BACKEND 选择：
+
+- text2vec（默认）：text2vec.SentenceModel 加载 EMBEDDING_MODEL（默认 BAAI/bge-large-zh）；
+  换成 BAAI/bge-small-zh-v1.5 等小模型即为“蒸馏小模型”方案；
+- onnx：onnxruntime 在 CPU 上运行导出的（默认 int8 动态量化）ONNX 模型，只依赖 onnxruntime 与 tokenizers，
+  不加载 torch。模型目录（EMBEDDING_ONNX_DIR）包含 model.onnx、tokenizer.json 和 embedding.json，
+  由本模块导出：
+
+    python -m app.core.embedding_backends export-onnx sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \\
+        --output app/models/minilm --pooling mean
+
+导出需要 torch、transformers 与 onnxruntime，在构建机上执行一次即可。
+选哪个后端用 bench/embedding_backends.py 在自己的 schema 与问题集上实测 recall@k、单次查询延迟和内存后决定。
+其他后端可通过 register_embedding_backend 注册。
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "text2vec")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-large-zh")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(BACKEND_DIR, "app", "models", "minilm"))
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", "256"))
+
+
+def _installed(*modules: str) -> bool:
+    return all(importlib.util.find_spec(module) is not None for module in modules)
+
+
+class EmbeddingBackend:
+    """后端接口：encode 返回 float32 的 numpy 矩阵（每行一个文本），是否归一化由调用方处理。"""
+
+    name = "base"
+
+    def available(self) -> bool:
+        raise NotImplementedError
+
+    def load(self) -> None:
+        """加载模型；首次 encode 前由调用方在加载锁内调用一次。"""
+
+    def encode(self, texts: Sequence[str]) -> Any:
+        raise NotImplementedError
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class Text2VecBackend(EmbeddingBackend):
+    name = "text2vec"
+
+    def __init__(self, source: Optional[str] = None):
+        self.model_name = source or EMBEDDING_MODEL
+        self._model: Any = None
+
+    def available(self) -> bool:
+        return _installed("text2vec")
+
+    def load(self) -> None:
+        if self._model is None:
+            self._model = importlib.import_module("text2vec").SentenceModel(self.model_name)
+
+    def encode(self, texts: Sequence[str]) -> Any:
+        return self._model.encode(list(texts)).astype("float32", copy=False)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "model": self.model_name}
+
+
+class OnnxBackend(EmbeddingBackend):
+    name = "onnx"
+
+    def __init__(self, source: Optional[str] = None):
+        self.model_dir = source or EMBEDDING_ONNX_DIR
+        self.model_path = os.path.join(self.model_dir, "model.onnx")
+        self.config: Dict[str, Any] = {}
+        self._session: Any = None
+        self._tokenizer: Any = None
+        self._input_names: List[str] = []
+
+    def available(self) -> bool:
+        # 仓库里的 model.onnx 是空占位文件，导出后才可用。
+        return (
+            _installed("onnxruntime", "tokenizers", "numpy")
+            and os.path.isfile(self.model_path)
+            and os.path.getsize(self.model_path) > 0
+            and os.path.isfile(os.path.join(self.model_dir, "tokenizer.json"))
+        )
+
+    def load(self) -> None:
+        if self._session is not None:
+            return
+        ort = importlib.import_module("onnxruntime")
+        tokenizers = importlib.import_module("tokenizers")
+
+        config_path = os.path.join(self.model_dir, "embedding.json")
+        if os.path.isfile(config_path):
+            with open(config_path, "r", encoding="utf-8") as handle:
+                self.config = json.load(handle)
+
+        options = ort.SessionOptions()
+        if EMBEDDING_ONNX_THREADS:
+            options.intra_op_num_threads = EMBEDDING_ONNX_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [item.name for item in self._session.get_inputs()]
+
+        tokenizer = tokenizers.Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=int(self.config.get("max_length", EMBEDDING_MAX_LENGTH)))
+        tokenizer.enable_padding(pad_id=int(self.config.get("pad_id", 0)), pad_token=self.config.get("pad_token", "[PAD]"))
+        self._tokenizer = tokenizer
+
+    def encode(self, texts: Sequence[str]) -> Any:
+        import numpy as np
+
+        encodings = self._tokenizer.encode_batch(list(texts))
+        input_ids = np.array([item.ids for item in encodings], dtype=np.int64)
+        attention_mask = np.array([item.attention_mask for item in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": np.zeros_like(input_ids)}
+        hidden = self._session.run(None, {name: feeds[name] for name in self._input_names})[0]
+        if hidden.ndim == 2:
+            return hidden.astype(np.float32, copy=False)
+        if self.config.get("pooling", "cls") == "mean":
+            mask = attention_mask[:, :, None].astype(np.float32)
+            return ((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)).astype(np.float32)
+        return hidden[:, 0].astype(np.float32)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "model_dir": self.model_dir, **self.config}
+
+
+_BACKENDS: Dict[str, Callable[[Optional[str]], EmbeddingBackend]] = {
+    "text2vec": Text2VecBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def register_embedding_backend(name: str, factory: Callable[[Optional[str]], EmbeddingBackend]) -> None:
+    _BACKENDS[name] = factory
+
+
+def create_embedding_backend(spec: Optional[str] = None) -> EmbeddingBackend:
+    """spec 形如 "onnx" 或 "text2vec:BAAI/bge-small-zh-v1.5"（冒号后为模型名或模型目录），默认取 EMBEDDING_BACKEND。"""
+    name, _, source = (spec or EMBEDDING_BACKEND).partition(":")
+    if name not in _BACKENDS:
+        raise ValueError(f"未知的 Embedding 后端：{name}（可选：{', '.join(sorted(_BACKENDS))}）")
+    return _BACKENDS[name](source or None)
+
+
+def export_onnx(model_name: str, output_dir: str, pooling: str = "cls", max_length: int = 256, quantize: bool = True) -> Dict[str, Any]:
+    """把 HuggingFace 模型导出为 ONNX（可选 int8 动态量化），连同 tokenizer.json 与 embedding.json 写入 output_dir。"""
+    torch = importlib.import_module("torch")
+    transformers = importlib.import_module("transformers")
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+    model = transformers.AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["示例文本"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(output_dir, "model.fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    model_path = os.path.join(output_dir, "model.onnx")
+    if quantize:
+        quantization = importlib.import_module("onnxruntime.quantization")
+        quantization.quantize_dynamic(fp32_path, model_path, weight_type=quantization.QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+
+    config = {
+        "source_model": model_name,
+        "pooling": pooling,
+        "max_length": max_length,
+        "pad_id": tokenizer.pad_token_id or 0,
+        "pad_token": tokenizer.pad_token or "[PAD]",
+        "quantized": "int8" if quantize else "fp32",
+    }
+    with open(os.path.join(output_dir, "embedding.json"), "w", encoding="utf-8") as handle:
+        json.dump(config, handle, ensure_ascii=False, indent=2)
+    logger.info("ONNX 模型已导出到 %s（%.1f MB）：%s", output_dir, os.path.getsize(model_path) / 1024 / 1024, config)
+    return config
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Embedding 后端工具")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export-onnx", help="把 HuggingFace 模型导出为（int8 量化的）ONNX")
+    export.add_argument("model", help="HuggingFace 模型名或本地路径")
+    export.add_argument("--output", default=EMBEDDING_ONNX_DIR, help="输出目录")
+    export.add_argument("--pooling", choices=["cls", "mean"], default="cls", help="bge 系列用 cls，sentence-transformers 系列用 mean")
+    export.add_argument("--max-length", type=int, default=EMBEDDING_MAX_LENGTH)
+    export.add_argument("--no-quantize", action="store_true", help="保留 fp32 权重")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    export_onnx(args.model, args.output, args.pooling, args.max_length, not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""
+Embedding sidecar：同机多个 uvicorn worker 共用一份 Embedding 模型与 schema 向量索引。
+
+`uvicorn --workers N` 时每个 worker 各自加载 bge-large-zh（权重超过 1 GB）和 FAISS 索引，
+节点能放几个 worker 取决于模型占多少内存。sidecar 模式下由一个独立进程持有模型和索引，
+worker 只持有表元数据，通过 Unix socket 请求编码与检索，worker 内存不随模型大小增长。
+
+协议：每行一个 JSON 请求、每行一个 JSON 响应（同一连接上按顺序应答）。
+    {"op": "encode", "texts": [...]}                         → {"ok": true, "embeddings": <矩阵>}
+    {"op": "search", "queries": [...], "top_k": 10, "catalog": "sales"} → {"ok": true, "hits": [[[表名, 分数], ...], ...]}
+    {"op": "search", "embeddings": <矩阵>, "top_k": 10, "catalog": "sales"}
+    该目录的向量索引缺失或正在重建时 hits 为 null，worker 退化为关键词匹配。
+    {"op": "ping"} / {"op": "stats"}
+矩阵以 {"shape": [行, 列], "data": base64(float32 小端)} 传输。
+同一时间窗口（EMBEDDING_SIDECAR_BATCH_WINDOW_MS）内到达的编码请求合并成一次 model.encode，
+检索请求在同一批里按数据目录（catalog，缺省为默认目录）各合并成一次 FAISS 查询。
+
+启动（backend 目录下）：
+    python -m app.core.embedding_sidecar --socket /run/datainsight/embedding.sock
+    EMBEDDING_SIDECAR_SOCKET=/run/datainsight/embedding.sock uvicorn app.main:app --workers 4
+
+worker 侧连接失败或超时只记录日志：编码返回 None、检索退化为关键词匹配，
+之后 EMBEDDING_SIDECAR_RETRY_SECONDS 内不再尝试连接，避免每个请求都等超时。
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core.catalogs import get_catalog_registry, use_catalog
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SIDECAR_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_SIDECAR_TIMEOUT_SECONDS", "5"))
+EMBEDDING_SIDECAR_RETRY_SECONDS = float(os.getenv("EMBEDDING_SIDECAR_RETRY_SECONDS", "5"))
+EMBEDDING_SIDECAR_MAX_CONNECTIONS = int(os.getenv("EMBEDDING_SIDECAR_MAX_CONNECTIONS", "8"))
+EMBEDDING_SIDECAR_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_SIDECAR_BATCH_WINDOW_MS", "2"))
+EMBEDDING_SIDECAR_MAX_BATCH = int(os.getenv("EMBEDDING_SIDECAR_MAX_BATCH", "64"))
+
+_STREAM_LIMIT = 64 * 1024 * 1024
+
+
+def _encode_matrix(matrix: Any) -> Dict[str, Any]:
+    import numpy as np
+
+    array = np.ascontiguousarray(matrix, dtype="<f4")
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def _decode_matrix(payload: Dict[str, Any]) -> Any:
+    import numpy as np
+
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype="<f4").reshape(payload["shape"])
+
+
+# ---------------------------------------------------------------------------
+# sidecar 进程
+# ---------------------------------------------------------------------------
+
+
+class _Batcher:
+    """把时间窗口内到达的编码/检索请求合并成一次 model.encode 与一次 FAISS 查询。"""
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "asyncio.Queue[Tuple[List[str], Optional[int], Optional[str], asyncio.Future]]" = asyncio.Queue()
+        self.stats: Dict[str, float] = {"batches": 0, "texts": 0, "requests": 0, "max_batch_texts": 0, "encode_ms_total": 0.0}
+
+    async def submit(self, texts: List[str], top_k: Optional[int] = None, catalog: Optional[str] = None) -> Any:
+        """top_k 为 None 时返回向量矩阵，否则返回每个文本在 catalog 数据目录上的检索结果。"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, top_k, catalog, future))
+        return await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            try:
+                results = await asyncio.to_thread(self._process, batch)
+            except Exception as exc:
+                logger.exception("[Sidecar] 批量编码失败")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (*_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _process(self, batch: List[Tuple[List[str], Optional[int], Optional[str], asyncio.Future]]) -> List[Any]:
+        from app.core import schema_index
+
+        texts = [text for item_texts, *_ in batch for text in item_texts]
+        started = time.perf_counter()
+        embeddings = schema_index.encode_texts_local(texts)
+        self.stats["encode_ms_total"] += (time.perf_counter() - started) * 1000
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        self.stats["texts"] += len(texts)
+        self.stats["max_batch_texts"] = max(self.stats["max_batch_texts"], len(texts))
+        if embeddings is None:
+            raise RuntimeError("Embedding 模型不可用")
+
+        # 编码不分数据目录，检索按目录分组：每个目录一次 FAISS 查询。
+        rows, offset = [], 0
+        searches: Dict[Optional[str], List[int]] = {}
+        for position, (item_texts, top_k, catalog, _) in enumerate(batch):
+            rows.append(list(range(offset, offset + len(item_texts))))
+            offset += len(item_texts)
+            if top_k:
+                searches.setdefault(catalog, []).append(position)
+
+        hits: Dict[int, List[Any]] = {}
+        for catalog, positions in searches.items():
+            catalog_rows = [row for position in positions for row in rows[position]]
+            search_k = max(batch[position][1] for position in positions)
+            catalog_hits = _search_named(embeddings[catalog_rows], search_k, catalog)
+            if catalog_hits is None:
+                hits.update((position, None) for position in positions)
+                continue
+            catalog_iter = iter(catalog_hits)
+            for position in positions:
+                hits[position] = [next(catalog_iter)[: batch[position][1]] for _ in rows[position]]
+
+        return [embeddings[rows[position]] if item[1] is None else hits[position] for position, item in enumerate(batch)]
+
+
+def _index_sizes(get_schema_index_stats: Any) -> Dict[str, int]:
+    """各数据目录已构建的 schema 索引合计。"""
+    sizes = {"catalogs": 0, "tables": 0}
+    for catalog in get_catalog_registry().catalogs():
+        if "schema_index" in catalog.state:
+            with use_catalog(catalog.name, touch=False):
+                sizes["catalogs"] += 1
+                sizes["tables"] += get_schema_index_stats()["tables"]
+    return sizes
+
+
+def _search_named(embeddings: Any, top_k: int, catalog: Optional[str] = None) -> Optional[List[List[Tuple[str, float]]]]:
+    from app.core import schema_index
+
+    with use_catalog(catalog):
+        rows = schema_index.search_local(embeddings, top_k)
+    if rows is None:
+        return None
+    return [[(table_meta["table_name"], score) for table_meta, score in row] for row in rows]
+
+
+class EmbeddingSidecar:
+    def __init__(self, socket_path: str, window_ms: float = EMBEDDING_SIDECAR_BATCH_WINDOW_MS, max_batch: int = EMBEDDING_SIDECAR_MAX_BATCH):
+        self.socket_path = socket_path
+        self.batcher = _Batcher(window_ms, max_batch)
+        self.started_at = time.time()
+        self.connections = 0
+
+    async def _dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True}
+        if op == "stats":
+            from app.core.schema_index import get_schema_index_stats
+
+            return {
+                "ok": True,
+                "stats": {
+                    **self.batcher.stats,
+                    "connections": self.connections,
+                    **_index_sizes(get_schema_index_stats),
+                    "uptime_seconds": round(time.time() - self.started_at, 1),
+                },
+            }
+        if op == "encode":
+            embeddings = await self.batcher.submit([str(text) for text in request.get("texts") or []])
+            return {"ok": True, "embeddings": _encode_matrix(embeddings)}
+        if op == "search":
+            top_k = max(1, int(request.get("top_k", 10)))
+            catalog = request.get("catalog")
+            # 未知目录在入队前拒绝，不拖累同批次的其他请求。
+            get_catalog_registry().get(catalog)
+            if request.get("embeddings") is not None:
+                hits = await asyncio.to_thread(_search_named, _decode_matrix(request["embeddings"]), top_k, catalog)
+            else:
+                hits = await self.batcher.submit([str(text) for text in request.get("queries") or []], top_k, catalog)
+            return {"ok": True, "hits": hits}
+        return {"ok": False, "error": f"未知操作：{op}"}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self._dispatch(json.loads(line))
+                except Exception as exc:
+                    response = {"ok": False, "error": str(exc)}
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self) -> None:
+        from app.core import schema_index
+
+        # sidecar 自己持有模型和索引：即使共用的 .env 配置了 socket，也不能再转发给自己。
+        schema_index.EMBEDDING_SIDECAR_SOCKET = ""
+        # 默认目录的索引启动时构建，其余目录在第一次检索时构建。
+        await asyncio.to_thread(schema_index.init_schema_index)
+        await asyncio.to_thread(schema_index._get_embedding_model)
+        tables = schema_index.get_schema_index_stats()["tables"]
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        directory = os.path.dirname(self.socket_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path, limit=_STREAM_LIMIT)
+        batcher_task = asyncio.create_task(self.batcher.run())
+        logger.info("[Sidecar] 已就绪：%s，默认目录共 %d 张表。", self.socket_path, tables)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+# ---------------------------------------------------------------------------
+# worker 侧客户端
+# ---------------------------------------------------------------------------
+
+
+class _Connection:
+    def __init__(self, path: str, timeout: float):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.reader = self.sock.makefile("rb")
+
+    def call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        self.sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("sidecar 关闭了连接")
+        return json.loads(line)
+
+    def close(self) -> None:
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class SidecarClient:
+    """同步客户端：连接按需创建、用完放回空闲池，可在多个线程里并发调用。"""
+
+    def __init__(self, path: str, timeout: float = EMBEDDING_SIDECAR_TIMEOUT_SECONDS, max_connections: int = EMBEDDING_SIDECAR_MAX_CONNECTIONS):
+        self.path = path
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle: List[_Connection] = []
+        self._lock = threading.Lock()
+        self._unavailable_until = 0.0
+        self._stats: Dict[str, float] = {"requests": 0, "failures": 0, "skipped": 0, "index_not_ready": 0, "latency_ms_total": 0.0}
+
+    def _call(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if time.monotonic() < self._unavailable_until:
+            self._stats["skipped"] += 1
+            return None
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        started = time.perf_counter()
+        self._stats["requests"] += 1
+        try:
+            if connection is None:
+                connection = _Connection(self.path, self.timeout)
+            response = connection.call(request)
+        except (OSError, ValueError) as exc:
+            if connection is not None:
+                connection.close()
+            self._stats["failures"] += 1
+            self._unavailable_until = time.monotonic() + EMBEDDING_SIDECAR_RETRY_SECONDS
+            logger.warning("[Sidecar] 请求失败（%s 秒内不再尝试）：%s", EMBEDDING_SIDECAR_RETRY_SECONDS, exc)
+            return None
+        self._stats["latency_ms_total"] += (time.perf_counter() - started) * 1000
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+
+        if not response.get("ok"):
+            self._stats["failures"] += 1
+            logger.warning("[Sidecar] %s 失败：%s", request.get("op"), response.get("error"))
+            return None
+        return response
+
+    def encode(self, texts: Sequence[str]) -> Optional[Any]:
+        response = self._call({"op": "encode", "texts": list(texts)})
+        return _decode_matrix(response["embeddings"]) if response else None
+
+    def search(
+        self, query: str, top_k: int, query_embedding: Optional[Any] = None, catalog: Optional[str] = None
+    ) -> Optional[List[Tuple[str, float]]]:
+        """在 catalog 数据目录上检索，返回 [(表名, 分数)]；sidecar 不可用或该目录索引尚未就绪时返回 None。"""
+        request: Dict[str, Any] = {"op": "search", "top_k": top_k, "catalog": catalog}
+        if query_embedding is not None:
+            request["embeddings"] = _encode_matrix(query_embedding.reshape(1, -1))
+        else:
+            request["queries"] = [query]
+        response = self._call(request)
+        if not response:
+            return None
+        if response["hits"] is None:
+            self._stats["index_not_ready"] += 1
+            logger.info("[Sidecar] 数据目录 %s 的向量索引尚未就绪，退化为关键词匹配。", catalog or "默认")
+            return None
+        return [(name, float(score)) for name, score in response["hits"][0]]
+
+    def remote_stats(self) -> Optional[Dict[str, Any]]:
+        response = self._call({"op": "stats"})
+        return response["stats"] if response else None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            idle = len(self._idle)
+        return {**self._stats, "idle_connections": idle, "available": int(time.monotonic() >= self._unavailable_until)}
+
+
+_clients: Dict[str, SidecarClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_sidecar_client(path: str) -> SidecarClient:
+    client = _clients.get(path)
+    if client is None:
+        with _clients_lock:
+            client = _clients.setdefault(path, SidecarClient(path))
+    return client
+
+
+def get_sidecar_stats() -> Dict[str, float]:
+    """worker 侧客户端计数；未配置 sidecar 时为空。"""
+    from app.core.schema_index import EMBEDDING_SIDECAR_SOCKET
+
+    if not EMBEDDING_SIDECAR_SOCKET:
+        return {}
+    return get_sidecar_client(EMBEDDING_SIDECAR_SOCKET).stats()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Embedding 模型与 schema 向量索引 sidecar")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SIDECAR_SOCKET", ""), help="Unix socket 路径")
+    parser.add_argument("--batch-window-ms", type=float, default=EMBEDDING_SIDECAR_BATCH_WINDOW_MS)
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SIDECAR_MAX_BATCH)
+    args = parser.parse_args(argv)
+    if not args.socket:
+        parser.error("需要 --socket 或环境变量 EMBEDDING_SIDECAR_SOCKET")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    sidecar = EmbeddingSidecar(args.socket, args.batch_window_ms, args.max_batch)
+    try:
+        asyncio.run(sidecar.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,12 @@
+import hashlib
 import json
 import logging
 import os
-from functools import lru_cache
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Optional
 
-logger = logging.getLogger(__name__)
+from app.core.catalogs import current_catalog
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-KNOWLEDGE_DIR = os.path.join(BASE_DIR, "knowledge")
+logger = logging.getLogger(__name__)
 
 CATEGORY_FILES = {
     "metrics": "metrics.json",
@@ -88,12 +87,12 @@ def _entry_to_context(entry: Dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
-def _load_category(category: str) -> List[Dict[str, Any]]:
+def _load_category(knowledge_dir: str, category: str) -> List[Dict[str, Any]]:
     filename = CATEGORY_FILES.get(category)
     if not filename:
         return []
 
-    path = os.path.join(KNOWLEDGE_DIR, filename)
+    path = os.path.join(knowledge_dir, filename)
     if not os.path.exists(path):
         logger.warning("知识库文件不存在：%s", path)
         return []
@@ -110,13 +109,35 @@ def _load_category(category: str) -> List[Dict[str, Any]]:
     return entries
 
 
-@lru_cache(maxsize=1)
-def load_knowledge_base() -> Dict[str, List[Dict[str, Any]]]:
-    kb = {category: _load_category(category) for category in CATEGORY_FILES}
-    logger.info("知识库加载完成：%s", {key: len(value) for key, value in kb.items()})
+def _load_knowledge_dir(knowledge_dir: str) -> Dict[str, List[Dict[str, Any]]]:
+    kb = {category: _load_category(knowledge_dir, category) for category in CATEGORY_FILES}
+    logger.info("知识库加载完成（%s）：%s", knowledge_dir, {key: len(value) for key, value in kb.items()})
     return kb
 
 
+def _knowledge_dir_version(knowledge_dir: str) -> str:
+    digest = hashlib.sha1()
+    for category, filename in sorted(CATEGORY_FILES.items()):
+        path = os.path.join(knowledge_dir, filename)
+        digest.update(category.encode("utf-8"))
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def load_knowledge_base() -> Dict[str, List[Dict[str, Any]]]:
+    """当前数据目录的知识库，每个目录首次使用时加载一次。"""
+    catalog = current_catalog()
+    return catalog.get_state("knowledge_base", lambda: _load_knowledge_dir(catalog.knowledge_dir))
+
+
+def get_knowledge_version() -> str:
+    """知识库版本号：所有知识文件内容的摘要，用于让依赖知识库的缓存自动失效。"""
+    catalog = current_catalog()
+    return catalog.get_state("knowledge_version", lambda: _knowledge_dir_version(catalog.knowledge_dir))
+
+
 def list_knowledge_names(category: str) -> List[str]:
     kb = load_knowledge_base()
     return [entry.get("name", "") for entry in kb.get(category, []) if entry.get("name")]
@@ -156,5 +177,9 @@ def retrieve_knowledge(category: str, query: str, top_k: int = 3) -> List[Dict[s
     return results
 
 
-def get_time_rules() -> List[Dict[str, Any]]:
-    return load_knowledge_base().get("time_rules", [])
+def get_time_rules(grain: Optional[str] = None) -> List[Dict[str, Any]]:
+    """返回时间规则；指定 grain 时只返回对应粒度（month/year）的规则。"""
+    rules = load_knowledge_base().get("time_rules", [])
+    if grain is None:
+        return rules
+    return [rule for rule in rules if rule.get("grain") == grain]
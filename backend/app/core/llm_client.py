@@ -1,66 +1,160 @@
+import asyncio
 import logging
 import os
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from dotenv import load_dotenv
-from openai import OpenAI
+from app.core.llm_gateway import LLM_TIMEOUT_SECONDS, close_llm_gateway, get_llm_gateway
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# 单进程内最多 LLM_MAX_CONCURRENCY 个请求在途，其余排队等待；限流、重试、熔断由 LLM 网关负责。
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
 
-LLM_API_KEY = os.getenv("LLM_API_KEY") or os.getenv("KIMI_API_KEY") or os.getenv("DEEPSEEK_API_KEY")
-LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.moonshot.cn/v1")
-LLM_MODEL = os.getenv("LLM_MODEL", "kimi2.5")
+_semaphore: Optional[asyncio.Semaphore] = None
 
-_client = None
 
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
 
-def _get_client() -> OpenAI:
-    global _client
-    if not LLM_API_KEY:
-        logger.error("未检测到 LLM API Key，请在 .env 中配置 LLM_API_KEY。")
-        raise ValueError("LLM_API_KEY is not set in environment variables.")
 
-    if _client is None:
-        _client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL)
-    return _client
+def _extract_usage(usage: Any) -> Dict[str, int]:
+    """统一各服务商的 usage 字段，cached_tokens 为命中前缀缓存的 prompt token 数。"""
+    if usage is None:
+        return {}
 
+    def _get(obj: Any, key: str) -> Any:
+        return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
 
-def call_llm(messages: List[Dict[str, Any]], max_tokens: int = 256, temperature: float = 0) -> str:
+    details = _get(usage, "prompt_tokens_details")
+    cached = (
+        (_get(details, "cached_tokens") if details is not None else None)
+        or _get(usage, "prompt_cache_hit_tokens")
+        or _get(usage, "cached_tokens")
+        or 0
+    )
+    return {
+        "prompt_tokens": _get(usage, "prompt_tokens") or 0,
+        "completion_tokens": _get(usage, "completion_tokens") or 0,
+        "cached_tokens": cached,
+    }
+
+
+async def close_llm_client() -> None:
+    """关闭各服务商的连接池，供应用退出时调用。"""
+    await close_llm_gateway()
+
+
+async def call_llm_with_usage(
+    messages: List[Dict[str, Any]],
+    max_tokens: int = 256,
+    temperature: float = 0,
+    timeout: Optional[float] = None,
+    prompt_cache_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """调用 LLM，返回 {"content": 输出文本, "usage": token 用量（含前缀缓存命中数）}。"""
     if not messages:
         raise ValueError("Messages must not be empty.")
 
     first_message = messages[0].get("content", "") if messages else ""
-    logger.info("调用 LLM，model=%s, 首条消息前 50 字符：%r", LLM_MODEL, str(first_message)[:50])
+    logger.info("调用 LLM，首条消息前 50 字符：%r", str(first_message)[:50])
 
     try:
-        response = _get_client().chat.completions.create(
-            model=LLM_MODEL,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+        async with _get_semaphore():
+            response = await get_llm_gateway().complete(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout or LLM_TIMEOUT_SECONDS,
+                prompt_cache_key=prompt_cache_key,
+            )
     except Exception as exc:
-        logger.error("调用 LLM 失败（model=%s, base_url=%s）：%s", LLM_MODEL, LLM_BASE_URL, exc)
+        logger.error("调用 LLM 失败：%s", exc)
         raise
 
+    usage = _extract_usage(getattr(response, "usage", None))
     llm_output = response.choices[0].message.content or ""
     if not llm_output:
         logger.warning("LLM 返回内容为空。")
-        return ""
-
-    logger.info("LLM 输出前 80 字符：%r", llm_output[:80])
-    return llm_output
-
+        return {"content": "", "usage": usage}
+
+    logger.info("LLM 输出前 80 字符：%r，usage=%s", llm_output[:80], usage)
+    return {"content": llm_output, "usage": usage}
+
+
+async def call_llm(
+    messages: List[Dict[str, Any]],
+    max_tokens: int = 256,
+    temperature: float = 0,
+    timeout: Optional[float] = None,
+    prompt_cache_key: Optional[str] = None,
+) -> str:
+    result = await call_llm_with_usage(messages, max_tokens, temperature, timeout, prompt_cache_key)
+    return result["content"]
+
+
+async def stream_llm(
+    messages: List[Dict[str, Any]],
+    max_tokens: int = 256,
+    temperature: float = 0,
+    timeout: Optional[float] = None,
+    prompt_cache_key: Optional[str] = None,
+    usage: Optional[Dict[str, int]] = None,
+) -> AsyncIterator[str]:
+    """以流式模式调用 LLM，逐段产出增量文本；传入 usage 字典时在结束后写入 token 用量。"""
+    if not messages:
+        raise ValueError("Messages must not be empty.")
 
-def generate_sql_from_llm(prompt: str) -> str:
-    normalized_prompt = prompt.strip() if prompt else ""
-    if not normalized_prompt:
+    logger.info("流式调用 LLM。")
+    async with _get_semaphore():
+        try:
+            async for chunk in get_llm_gateway().stream(
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=timeout or LLM_TIMEOUT_SECONDS,
+                prompt_cache_key=prompt_cache_key,
+            ):
+                if usage is not None and getattr(chunk, "usage", None) is not None:
+                    usage.update(_extract_usage(chunk.usage))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as exc:
+            logger.error("流式调用 LLM 失败：%s", exc)
+            raise
+
+
+def _validate_messages(messages: List[Dict[str, Any]]) -> None:
+    if not messages or not any(str(message.get("content") or "").strip() for message in messages):
         raise ValueError("Prompt must not be empty.")
 
-    return call_llm(
-        messages=[{"role": "user", "content": normalized_prompt}],
+
+async def generate_sql_from_llm(messages: List[Dict[str, Any]], prompt_cache_key: Optional[str] = None) -> Dict[str, Any]:
+    _validate_messages(messages)
+    return await call_llm_with_usage(
+        messages=messages,
         max_tokens=512,
         temperature=0,
+        prompt_cache_key=prompt_cache_key,
     )
+
+
+async def stream_sql_from_llm(
+    messages: List[Dict[str, Any]],
+    prompt_cache_key: Optional[str] = None,
+    usage: Optional[Dict[str, int]] = None,
+) -> AsyncIterator[str]:
+    _validate_messages(messages)
+    async for delta in stream_llm(
+        messages=messages,
+        max_tokens=512,
+        temperature=0,
+        prompt_cache_key=prompt_cache_key,
+        usage=usage,
+    ):
+        yield delta
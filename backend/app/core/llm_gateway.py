@@ -0,0 +1,362 @@
+"""
+LLM 网关：在多个 OpenAI 兼容服务商之间做限流、重试、熔断与对冲请求。
+
+- 每个服务商一个令牌桶（LLM 请求数/秒 + 突发容量），超速的请求在本地排队而不是打出 429。
+- 可重试错误（超时、连接错误、429、5xx）按带抖动的指数退避重试，每次重试换到下一个未熔断、本次调用还没试过的服务商。
+- 连续失败达到阈值的服务商熔断一段时间，流量自动转移到其他服务商；冷却后放一个探测请求。
+- 开启对冲时，首个请求超过该服务商近期 p95 延迟仍未返回，就向下一个服务商再发一份，取先返回者。
+  p95 只按非流式完整响应的耗时统计；流式请求的首包耗时单独记录，不混入。
+
+服务商通过 LLM_PROVIDERS（JSON 列表）配置；未配置时沿用 LLM_BASE_URL / LLM_MODEL / LLM_API_KEY 单服务商。
+服务商的 prompt_cache 选项控制前缀缓存的提示方式：
+- "auto"（默认）：依赖服务商自动前缀缓存，不额外传参；
+- "cache_key"：通过 prompt_cache_key 把相同前缀的请求路由到同一缓存；
+- "cache_control"：在 system 消息上标注 cache_control（兼容 Anthropic 风格网关）。
+流式请求默认附带 stream_options.include_usage 以统计缓存命中，不支持的服务商可设 "stream_usage": false。
+
+openai SDK 导入要数百毫秒，这里只在首次创建客户端（或后台预热调用 preload_openai）时导入，不拖慢进程启动。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+LLM_API_KEY = os.getenv("LLM_API_KEY") or os.getenv("KIMI_API_KEY") or os.getenv("DEEPSEEK_API_KEY")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.moonshot.cn/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "kimi2.5")
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+LLM_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", "3"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+
+class TokenBucket:
+    """令牌桶限流：rate 为每秒补充的令牌数，capacity 为允许的突发量。rate <= 0 表示不限流。"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后打开，cooldown 秒后半开放行一个探测请求，成功即关闭。"""
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def before_request(self) -> None:
+        if self.state == "half_open":
+            self._probing = True
+
+    def cancel_probe(self) -> None:
+        self._probing = False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probing = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class LLMProvider:
+    def __init__(self, config: Dict[str, Any]) -> None:
+        self.name = config.get("name") or config["base_url"]
+        self.base_url = config["base_url"]
+        self.model = config["model"]
+        self.api_key = config.get("api_key") or os.getenv(config.get("api_key_env", ""), "") or LLM_API_KEY
+        self.bucket = TokenBucket(float(config.get("rate_per_second", 0)), float(config.get("burst", 1)))
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SECONDS)
+        self.prompt_cache = config.get("prompt_cache", "auto")
+        self.stream_usage = bool(config.get("stream_usage", True))
+        self.latencies: deque = deque(maxlen=200)
+        self.stream_ttfb: deque = deque(maxlen=200)
+        self.stats = {"requests": 0, "failures": 0, "retries": 0, "hedges": 0}
+        self._client: Optional["AsyncOpenAI"] = None
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        if not self.api_key:
+            logger.error("服务商 %s 未配置 API Key，请在 .env 中配置 LLM_API_KEY。", self.name)
+            raise ValueError("LLM_API_KEY is not set in environment variables.")
+
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+            )
+            self._client = preload_openai().AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client, max_retries=0)
+        return self._client
+
+    def prepare_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """按服务商能力改写请求参数：流式请求附带 usage，按前缀缓存方式处理 prompt_cache_key（静态前缀版本号）。"""
+        params = dict(params)
+        if params.get("stream") and self.stream_usage:
+            params["stream_options"] = {"include_usage": True}
+        cache_key = params.pop("prompt_cache_key", None)
+        if not cache_key or self.prompt_cache == "auto":
+            return params
+        if self.prompt_cache == "cache_key":
+            params["extra_body"] = {**params.get("extra_body", {}), "prompt_cache_key": cache_key}
+        elif self.prompt_cache == "cache_control":
+            params["messages"] = [
+                {
+                    **message,
+                    "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+                }
+                if message.get("role") == "system" and isinstance(message.get("content"), str)
+                else message
+                for message in params["messages"]
+            ]
+        return params
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        return _p95(self.latencies)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "breaker": self.breaker.state,
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+            "stream_ttfb_p95_seconds": round(_p95(self.stream_ttfb), 3) if self.stream_ttfb else None,
+            **self.stats,
+        }
+
+
+def _p95(samples: deque) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def _load_provider_configs() -> List[Dict[str, Any]]:
+    raw = os.getenv("LLM_PROVIDERS", "").strip()
+    if raw:
+        configs = json.loads(raw)
+        if not isinstance(configs, list) or not configs:
+            raise ValueError("LLM_PROVIDERS 必须是非空 JSON 列表。")
+        return configs
+    return [{"name": "default", "base_url": LLM_BASE_URL, "model": LLM_MODEL, "api_key": LLM_API_KEY}]
+
+
+def preload_openai() -> Any:
+    """导入并返回 openai 模块；只有第一次调用较慢。"""
+    import openai
+
+    return openai
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    # openai 尚未导入时不可能抛出它的异常。
+    openai = sys.modules.get("openai")
+    if openai is None:
+        return False
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+class LLMGateway:
+    def __init__(self, providers: List[LLMProvider]) -> None:
+        self.providers = providers
+
+    def _candidates(self, tried: Sequence[LLMProvider] = ()) -> List[LLMProvider]:
+        """
+        按配置顺序返回当前未熔断的服务商，本次调用已失败过的排到最后，重试时自然轮换到下一个；
+        全部熔断时仍返回全部，交给重试兜底。
+        """
+        healthy = [provider for provider in self.providers if provider.breaker.available()] or list(self.providers)
+        return [provider for provider in healthy if provider not in tried] + [provider for provider in healthy if provider in tried]
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * (2 ** attempt)))
+
+    async def _request(self, provider: LLMProvider, params: Dict[str, Any]) -> Any:
+        await provider.bucket.acquire()
+        provider.breaker.before_request()
+        provider.stats["requests"] += 1
+        started = time.monotonic()
+        try:
+            response = await provider.client.chat.completions.create(model=provider.model, **provider.prepare_params(params))
+        except asyncio.CancelledError:
+            provider.breaker.cancel_probe()
+            raise
+        except Exception as exc:
+            # 只有超时、限流、5xx 之类才说明服务商不健康；4xx 参数错误说明服务商仍可达。
+            if _is_retryable(exc):
+                provider.stats["failures"] += 1
+                provider.breaker.record_failure()
+            else:
+                provider.breaker.record_success()
+            raise
+        # 流式请求此时只拿到首包，耗时单独记录，避免拉低对冲用的完整响应 p95。
+        (provider.stream_ttfb if params.get("stream") else provider.latencies).append(time.monotonic() - started)
+        provider.breaker.record_success()
+        return response
+
+    async def _hedged_request(self, candidates: List[LLMProvider], params: Dict[str, Any]) -> Any:
+        primary = candidates[0]
+        if not LLM_HEDGE_ENABLED:
+            return await self._request(primary, params)
+
+        backup = candidates[1] if len(candidates) > 1 else primary
+        pending = {asyncio.create_task(self._request(primary, params))}
+        last_error: Optional[BaseException] = None
+        try:
+            done, pending = await asyncio.wait(pending, timeout=primary.hedge_delay())
+            if not done:
+                logger.info("LLM 请求超过 %s 的 p95 延迟，向 %s 发送对冲请求。", primary.name, backup.name)
+                backup.stats["hedges"] += 1
+                pending.add(asyncio.create_task(self._request(backup, params)))
+
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                if not pending:
+                    raise last_error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, **params: Any) -> Any:
+        """非流式调用，返回服务商原始响应对象。"""
+        last_error: Optional[BaseException] = None
+        tried: List[LLMProvider] = []
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            candidates = self._candidates(tried)
+            try:
+                return await self._hedged_request(candidates, params)
+            except Exception as exc:
+                last_error = exc
+                if not _is_retryable(exc) or attempt == LLM_MAX_RETRIES:
+                    raise
+                candidates[0].stats["retries"] += 1
+                tried.append(candidates[0])
+                delay = self._backoff(attempt)
+                logger.warning("LLM 调用失败（%s），%.2fs 后第 %d 次重试：%s", candidates[0].name, delay, attempt + 1, exc)
+                await asyncio.sleep(delay)
+        raise last_error
+
+    async def stream(self, **params: Any) -> AsyncIterator[Any]:
+        """流式调用：只在收到首个分片之前重试，已开始输出后不再切换服务商。"""
+        tried: List[LLMProvider] = []
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            provider = self._candidates(tried)[0]
+            started = False
+            try:
+                stream = await self._request(provider, {**params, "stream": True})
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+                return
+            except Exception as exc:
+                if started or not _is_retryable(exc) or attempt == LLM_MAX_RETRIES:
+                    raise
+                provider.stats["retries"] += 1
+                tried.append(provider)
+                delay = self._backoff(attempt)
+                logger.warning("LLM 流式调用失败（%s），%.2fs 后第 %d 次重试：%s", provider.name, delay, attempt + 1, exc)
+                await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.close()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [provider.snapshot() for provider in self.providers]
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_llm_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway([LLMProvider(config) for config in _load_provider_configs()])
+        logger.info("LLM 网关初始化完成，服务商：%s", [provider.name for provider in _gateway.providers])
+    return _gateway
+
+
+async def close_llm_gateway() -> None:
+    global _gateway
+    if _gateway is not None:
+        await _gateway.close()
+        _gateway = None
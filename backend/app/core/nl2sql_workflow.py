@@ -1,17 +1,44 @@
+import asyncio
 import logging
-from typing import Any, Dict, List, Set
-
-from app.core.context_builder import build_sql_generation_prompt
-from app.core.knowledge_base import find_exact_matches, get_time_rules, retrieve_knowledge
-from app.core.llm_client import generate_sql_from_llm
-from app.core.query_parser import parse_user_query
-from app.core.schema_index import format_tables_for_prompt, get_relevant_tables
-from app.core.schema_service import get_full_schema
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from app.core.answer_cache import get_answer_cache, is_cacheable, normalize_question
+from app.core.context_builder import build_sql_edit_prompt, build_sql_generation_prompt
+from app.core.catalogs import current_catalog
+from app.core.db_snapshots import current_snapshot
+from app.core.knowledge_base import find_exact_matches, get_knowledge_version, get_time_rules, load_knowledge_base, retrieve_knowledge
+from app.core.llm_client import generate_sql_from_llm, stream_sql_from_llm
+from app.core.query_stats import get_query_stats
+from app.core.query_parser import extract_query_slots, heuristic_parse, is_follow_up, merge_follow_up_intent, parse_user_query
+from app.core.rule_sql_compiler import compile_sql_from_rules
+from app.core.schema_index import encode_texts, format_tables_for_prompt, get_relevant_tables
+from app.core.schema_service import get_schema_snapshot, get_schema_version
+from app.core.session_store import get_session_store
+from app.core.singleflight import SingleFlight
+from app.core.sql_analysis import analyze_sql, replace_filter_literals
+from app.core.sql_dry_run import check_and_repair_sql
 from app.core.sql_validator import validate_generated_sql
+from app.core.telemetry import PROMPT_TOKENS, set_span_attributes, span, start_trace
+from app.core.workflow_graph import StageGraph
 from app.utils.sql_parser import extract_sql
 
 logger = logging.getLogger(__name__)
 
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+# 响应详细程度：minimal 只含 SQL 与校验结果；standard 另含意图、规则名称、试绑定、SQL 分析与阶段耗时；
+# debug 另含完整 prompt、使用的 schema 文本、LLM 原始输出与命中规则全文，这些调试产物只在 debug 时生成。
+VERBOSITY_LEVELS = ("minimal", "standard", "debug")
+NL2SQL_DEFAULT_VERBOSITY = os.getenv("NL2SQL_DEFAULT_VERBOSITY", "standard")
+
+NL2SQL_BATCH_MAX_QUESTIONS = int(os.getenv("NL2SQL_BATCH_MAX_QUESTIONS", "500"))
+NL2SQL_BATCH_CONCURRENCY = int(os.getenv("NL2SQL_BATCH_CONCURRENCY", "4"))
+NL2SQL_BATCH_MAX_CONCURRENCY = int(os.getenv("NL2SQL_BATCH_MAX_CONCURRENCY", "16"))
+
+_inflight_requests = SingleFlight()
+
 
 def _normalize_schema(full_schema: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     normalized = {}
@@ -30,6 +57,17 @@ def _normalize_schema(full_schema: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     return normalized
 
 
+def _schema_snapshot() -> Dict[str, Dict[str, Any]]:
+    source = get_schema_snapshot()
+    # 每个数据目录一份 (原始 schema 快照, 规范化结果)，随 get_schema_snapshot 返回的对象（即数据快照）整体替换。
+    normalized = current_catalog().get_state("normalized_schema", lambda: {"snapshot": (None, None)})
+    cached_source, schema = normalized["snapshot"]
+    if cached_source is not source:
+        schema = _normalize_schema(source)
+        normalized["snapshot"] = (source, schema)
+    return schema
+
+
 def _collect_table_hints(metric_rules: List[Dict[str, Any]], business_term_rules: List[Dict[str, Any]], join_rules: List[Dict[str, Any]]) -> Set[str]:
     hinted_tables: Set[str] = set()
     for rule in metric_rules:
@@ -42,10 +80,11 @@ def _collect_table_hints(metric_rules: List[Dict[str, Any]], business_term_rules
     return hinted_tables
 
 
-def _fetch_schema_context(user_question: str, hinted_tables: Set[str]) -> Dict[str, Any]:
-    relevant_tables = get_relevant_tables(user_question, top_k=10)
-    full_schema = _normalize_schema(get_full_schema())
-
+def _merge_schema_context(
+    relevant_tables: List[Dict[str, Any]],
+    hinted_tables: Set[str],
+    full_schema: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
     combined = {table["table_name"]: table for table in relevant_tables}
     missing_tables = []
     for table_name in hinted_tables:
@@ -55,10 +94,9 @@ def _fetch_schema_context(user_question: str, hinted_tables: Set[str]) -> Dict[s
             missing_tables.append(table_name)
 
     schema_tables = list(combined.values())
-    schema_text = format_tables_for_prompt(schema_tables)
     return {
-        "schema_text": schema_text,
         "schema_tables": schema_tables,
+        "hinted_tables": hinted_tables,
         "available_table_names": list(full_schema.keys()),
         "missing_tables": missing_tables,
     }
@@ -73,7 +111,9 @@ def _retrieve_rules(user_question: str, parsed_intent: Dict[str, Any]) -> Dict[s
         find_exact_matches("business_terms", business_terms) if business_terms else retrieve_knowledge("business_terms", user_question, top_k=3)
     )
     join_rules = retrieve_knowledge("join_rules", user_question, top_k=3)
-    time_rules = get_time_rules()
+    # 只带上与问题时间粒度匹配的时间规则，未识别出时间时不带。
+    time_range = parsed_intent.get("time_range") or {}
+    time_rules = get_time_rules(time_range["grain"]) if time_range.get("grain") else []
 
     return {
         "metric_rules": metric_rules,
@@ -83,56 +123,785 @@ def _retrieve_rules(user_question: str, parsed_intent: Dict[str, Any]) -> Dict[s
     }
 
 
-def run_nl2sql_workflow(user_question: str) -> Dict[str, Any]:
-    parsed_intent = parse_user_query(user_question)
-    rules = _retrieve_rules(user_question, parsed_intent)
+def _try_rule_sql(
+    user_question: str,
+    parsed_intent: Dict[str, Any],
+    rules: Dict[str, List[Dict[str, Any]]],
+    full_schema: Dict[str, Dict[str, Any]],
+    debug: bool = False,
+) -> Dict[str, Any]:
+    compiled = compile_sql_from_rules(user_question, parsed_intent, rules, full_schema)
+    if not compiled:
+        return {}
 
-    hinted_tables = _collect_table_hints(
-        rules["metric_rules"],
-        rules["business_term_rules"],
-        rules["join_rules"],
-    )
-    schema_context = _fetch_schema_context(user_question, hinted_tables)
+    return {
+        "sql": compiled["sql"],
+        "llm_output": "",
+        "prompt": "",
+        "schema_context": {
+            "schema_text": format_tables_for_prompt(compiled["tables"]) if debug else None,
+            "available_table_names": list(full_schema.keys()),
+            "missing_tables": [],
+        },
+    }
 
-    prompt = build_sql_generation_prompt(
-        user_question=user_question,
-        parsed_intent=parsed_intent,
-        schema_text=schema_context["schema_text"],
-        metric_rules=rules["metric_rules"],
-        business_term_rules=rules["business_term_rules"],
-        join_rules=rules["join_rules"],
-        time_rules=rules["time_rules"],
-        missing_tables=schema_context["missing_tables"],
-    )
 
-    llm_output = generate_sql_from_llm(prompt)
-    sql = extract_sql(llm_output)
-    validation = validate_generated_sql(
-        sql=sql,
-        parsed_intent=parsed_intent,
-        metric_rules=rules["metric_rules"],
-        available_table_names=schema_context["available_table_names"],
-    )
+def _build_result(
+    parsed_intent: Dict[str, Any],
+    rules: Dict[str, List[Dict[str, Any]]],
+    generation: Dict[str, Any],
+    generation_mode: str,
+    debug: bool = False,
+) -> Dict[str, Any]:
+    sql = generation["sql"]
+    schema_context = generation["schema_context"]
+    with span("validate") as validate_span:
+        analysis = analyze_sql(sql)
+        validation = validate_generated_sql(
+            sql=sql,
+            parsed_intent=parsed_intent,
+            metric_rules=rules["metric_rules"],
+            available_table_names=schema_context["available_table_names"],
+            analysis=analysis,
+        )
+        dry_run = generation.get("dry_run")
+        if dry_run and dry_run["status"] == "failed":
+            validation["is_valid"] = False
+            validation["errors"].append(f"SQL 绑定失败：{dry_run['errors'][-1].splitlines()[0]}")
+        validate_span.set(
+            is_valid=validation["is_valid"],
+            errors=len(validation["errors"]),
+            warnings=len(validation["warnings"]),
+            tables=len(analysis["tables"]),
+        )
 
     logger.info(
-        "NL2SQL 工作流完成，metrics=%s, business_terms=%s, warnings=%s",
+        "NL2SQL 工作流完成，mode=%s, prompt_tokens=%s, metrics=%s, business_terms=%s, warnings=%s",
+        generation_mode,
+        (generation.get("prompt_stats") or {}).get("prompt_tokens"),
         parsed_intent.get("metrics"),
         parsed_intent.get("business_terms"),
         validation.get("warnings"),
     )
 
-    return {
+    knowledge = {
+        "metrics": rules["metric_rules"],
+        "business_terms": rules["business_term_rules"],
+        "join_rules": rules["join_rules"],
+        "time_rules": rules["time_rules"],
+    }
+    result = {
         "sql": sql,
-        "raw_output": llm_output,
-        "used_schema": schema_context["schema_text"],
+        "generation_mode": generation_mode,
         "parsed_intent": parsed_intent,
         "retrieved_knowledge": {
-            "metrics": rules["metric_rules"],
-            "business_terms": rules["business_term_rules"],
-            "join_rules": rules["join_rules"],
-            "time_rules": rules["time_rules"],
+            **{category: [rule.get("name", "") for rule in items] for category, items in knowledge.items()},
             "missing_tables": schema_context["missing_tables"],
         },
         "validation": validation,
-        "generation_prompt": prompt,
+        "prompt_stats": generation.get("prompt_stats"),
+        "dry_run": dry_run,
+        "sql_analysis": {
+            "tables": analysis["tables"],
+            "columns": analysis["columns"],
+            "filter_literals": analysis["filter_literals"],
+            "normalized": analysis["normalized"],
+        },
+    }
+    if debug:
+        result.update(
+            {
+                "raw_output": generation["llm_output"],
+                "used_schema": schema_context["schema_text"],
+                "retrieved_knowledge": {**knowledge, "missing_tables": schema_context["missing_tables"]},
+                "generation_prompt": generation["prompt"],
+            }
+        )
+    return result
+
+
+def _summarize_rules(rules: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[str]]:
+    return {category: [rule.get("name", "") for rule in items] for category, items in rules.items()}
+
+
+def _describe_intent(parsed_intent: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "query_type": parsed_intent.get("query_type"),
+        "metrics": len(parsed_intent.get("metrics") or []),
+        "business_terms": len(parsed_intent.get("business_terms") or []),
+    }
+
+
+def _describe_rules(rules: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+    return {category: len(items) for category, items in rules.items()}
+
+
+async def _generate_with_llm(
+    assembled: Dict[str, Any],
+    schema_context: Dict[str, Any],
+    on_event: Optional[EventCallback],
+) -> Dict[str, Any]:
+    """按组装好的 prompt 调用 LLM 生成 SQL；传入 on_event 时以流式模式逐段推送 sql_token。"""
+    PROMPT_TOKENS.observe(assembled["prompt_tokens"])
+
+    messages = assembled["messages"]
+    cache_key = assembled["prefix_version"]
+    with span("llm_generate", streaming=on_event is not None) as llm_span:
+        if on_event is None:
+            generation = await generate_sql_from_llm(messages, prompt_cache_key=cache_key)
+            llm_output, usage = generation["content"], generation["usage"]
+        else:
+            chunks: List[str] = []
+            usage: Dict[str, int] = {}
+            async for delta in stream_sql_from_llm(messages, prompt_cache_key=cache_key, usage=usage):
+                chunks.append(delta)
+                on_event("sql_token", {"text": delta})
+            llm_output = "".join(chunks)
+        llm_span.set(output_chars=len(llm_output), **usage)
+    if usage:
+        logger.info(
+            "SQL 生成 prompt_tokens=%s，命中前缀缓存 %s tokens（前缀版本 %s）",
+            usage.get("prompt_tokens"),
+            usage.get("cached_tokens"),
+            cache_key,
+        )
+    return {
+        "sql": extract_sql(llm_output),
+        "llm_output": llm_output,
+        "prompt": assembled["prompt"],
+        "schema_context": {**schema_context, "schema_text": assembled["schema_text"]},
+        "prompt_stats": {
+            "prompt_tokens": assembled["prompt_tokens"],
+            "prefix_tokens": assembled["prefix_tokens"],
+            "prefix_version": cache_key,
+            "token_budget": assembled["token_budget"],
+            "dropped_sections": assembled["dropped_sections"],
+            "pruned_columns": assembled["pruned_columns"],
+            "llm_usage": usage or None,
+        },
+    }
+
+
+async def _check_generation(
+    generation: Dict[str, Any],
+    schema: Dict[str, Dict[str, Any]],
+    on_event: Optional[EventCallback],
+    schema_version: Optional[str] = None,
+) -> Dict[str, Any]:
+    report = await check_and_repair_sql(generation["sql"], schema, schema_version)
+    if report["sql"] != generation["sql"] and on_event is not None:
+        on_event("sql_repaired", {"sql": report["sql"], "fixes": report["fixes"]})
+    return {**generation, "sql": report["sql"], "dry_run": report}
+
+
+# _retrieve_rules 用到的意图字段。
+_RULE_INTENT_FIELDS = ("metrics", "business_terms", "time_range")
+
+# 阶段完成时推送给流式客户端的事件：阶段名 -> (事件名, 数据构造函数)
+_STAGE_EVENTS = {
+    "heuristic_intent": ("intent", lambda value: {"source": "heuristic", "parsed_intent": value}),
+    "parsed_intent": ("intent", lambda value: {"source": "llm", "parsed_intent": value}),
+    "heuristic_rules": ("rules", lambda value: {"source": "heuristic", "rules": _summarize_rules(value)}),
+    "rules": ("rules", lambda value: {"source": "llm", "rules": _summarize_rules(value)}),
+    "tables": (
+        "tables",
+        lambda value: {"tables": [{"table_name": table["table_name"], "score": table.get("score")} for table in value]},
+    ),
+}
+
+
+def _build_workflow_graph(
+    user_question: str,
+    on_event: Optional[EventCallback] = None,
+    query_embedding: Optional[Any] = None,
+    schema: Optional[Dict[str, Dict[str, Any]]] = None,
+    debug: bool = False,
+    schema_version: Optional[str] = None,
+) -> StageGraph:
+    """
+    NL2SQL 阶段依赖图：
+    schema / tables / heuristic_parse 互不依赖，一开始就并发启动；
+    规则编译命中时后续 LLM 阶段全部跳过，仍在运行的向量检索被取消；
+    未命中时完整路径复用规则解析结果，LLM 意图与规则意图一致时也复用已检索的规则。
+    传入 schema 时（批量请求共享的快照）不再重新读取数据库结构；schema_version 用作试绑定空表库的缓存键。
+    """
+
+    async def llm_generation(parsed_intent, rules, schema_context, schema):
+        with span("prompt_build") as prompt_span:
+            assembled = build_sql_generation_prompt(
+                user_question=user_question,
+                parsed_intent=parsed_intent,
+                schema_tables=schema_context["schema_tables"],
+                metric_rules=rules["metric_rules"],
+                business_term_rules=rules["business_term_rules"],
+                join_rules=rules["join_rules"],
+                time_rules=rules["time_rules"],
+                missing_tables=schema_context["missing_tables"],
+                hinted_tables=schema_context["hinted_tables"],
+                full_schema=schema,
+                include_debug=debug,
+            )
+            prompt_span.set(
+                prompt_tokens=assembled["prompt_tokens"],
+                prefix_tokens=assembled["prefix_tokens"],
+                dropped_sections=len(assembled["dropped_sections"]),
+            )
+        return await _generate_with_llm(assembled, schema_context, on_event)
+
+    async def sql_check(llm_generation, schema):
+        return await _check_generation(llm_generation, schema, on_event, schema_version)
+
+    async def heuristic_intent(heuristic_parse):
+        return await parse_user_query(user_question, use_llm=False, heuristic_result=heuristic_parse)
+
+    async def parsed_intent(rule_sql_fast, heuristic_parse):
+        return await parse_user_query(user_question, heuristic_result=heuristic_parse)
+
+    def rules(parsed_intent, heuristic_intent, heuristic_rules):
+        # 规则检索只看指标、术语和时间粒度，LLM 没改动这几项时沿用快速路径已检索到的规则。
+        if all(parsed_intent.get(key) == heuristic_intent.get(key) for key in _RULE_INTENT_FIELDS):
+            return heuristic_rules
+        return _retrieve_rules(user_question, parsed_intent)
+
+    def rule_sql(parsed_intent, rules, schema, heuristic_intent, heuristic_rules):
+        # 意图和规则都与快速路径相同时，规则编译必然同样失败，不再重跑。
+        if parsed_intent == heuristic_intent and rules is heuristic_rules:
+            return {}
+        return _try_rule_sql(user_question, parsed_intent, rules, schema, debug)
+
+    graph = StageGraph()
+    graph.add(
+        "schema",
+        lambda: schema if schema is not None else _schema_snapshot(),
+        describe=lambda value: {"tables": len(value), "shared": schema is not None},
+    )
+    graph.add(
+        "tables",
+        lambda: get_relevant_tables(user_question, top_k=10, query_embedding=query_embedding),
+        describe=lambda tables: {"matched_tables": len(tables)},
+    )
+    graph.add("heuristic_parse", lambda: heuristic_parse(user_question))
+    graph.add("heuristic_intent", heuristic_intent, deps=["heuristic_parse"], describe=_describe_intent)
+    graph.add(
+        "heuristic_rules",
+        lambda heuristic_intent: _retrieve_rules(user_question, heuristic_intent),
+        deps=["heuristic_intent"],
+        describe=_describe_rules,
+    )
+    graph.add(
+        "rule_sql_fast",
+        lambda heuristic_intent, heuristic_rules, schema: _try_rule_sql(user_question, heuristic_intent, heuristic_rules, schema, debug),
+        deps=["heuristic_intent", "heuristic_rules", "schema"],
+        describe=lambda compiled: {"hit": bool(compiled)},
+    )
+    graph.add(
+        "parsed_intent",
+        parsed_intent,
+        deps=["rule_sql_fast", "heuristic_parse"],
+        when=lambda rule_sql_fast, heuristic_parse: not rule_sql_fast,
+        describe=_describe_intent,
+    )
+    graph.add("rules", rules, deps=["parsed_intent", "heuristic_intent", "heuristic_rules"], describe=_describe_rules)
+    graph.add(
+        "rule_sql",
+        rule_sql,
+        deps=["parsed_intent", "rules", "schema", "heuristic_intent", "heuristic_rules"],
+        describe=lambda compiled: {"hit": bool(compiled)},
+    )
+    graph.add(
+        "schema_context",
+        lambda rules, tables, schema, rule_sql: _merge_schema_context(
+            tables,
+            _collect_table_hints(rules["metric_rules"], rules["business_term_rules"], rules["join_rules"]),
+            schema,
+        ),
+        deps=["rules", "tables", "schema", "rule_sql"],
+        when=lambda rules, tables, schema, rule_sql: not rule_sql,
+        describe=lambda context: {"schema_tables": len(context["schema_tables"]), "missing_tables": len(context["missing_tables"])},
+    )
+    graph.add("llm_generation", llm_generation, deps=["parsed_intent", "rules", "schema_context", "schema"])
+    graph.add(
+        "sql_check",
+        sql_check,
+        deps=["llm_generation", "schema"],
+        describe=lambda checked: {"dry_run": checked["dry_run"]["status"], "repair_llm_calls": checked["dry_run"]["llm_calls"]},
+    )
+    return graph
+
+
+async def _run_workflow_graph(
+    user_question: str,
+    on_event: Optional[EventCallback],
+    query_embedding: Optional[Any],
+    schema: Optional[Dict[str, Dict[str, Any]]] = None,
+    debug: bool = False,
+    schema_version: Optional[str] = None,
+) -> Dict[str, Any]:
+
+    def on_stage_done(name: str, value: Any) -> None:
+        if name in _STAGE_EVENTS and value:
+            event, build = _STAGE_EVENTS[name]
+            on_event(event, build(value))
+
+    graph = _build_workflow_graph(user_question, on_event, query_embedding, schema, debug, schema_version)
+    run = await graph.run(
+        outputs=["rule_sql_fast", "rule_sql", "sql_check"],
+        on_stage_done=on_stage_done if on_event is not None else None,
+    )
+    results = run["results"]
+
+    if results.get("rule_sql_fast"):
+        result = _build_result(results["heuristic_intent"], results["heuristic_rules"], results["rule_sql_fast"], "rule", debug)
+    elif results.get("rule_sql"):
+        result = _build_result(results["parsed_intent"], results["rules"], results["rule_sql"], "rule", debug)
+    else:
+        result = _build_result(results["parsed_intent"], results["rules"], results["sql_check"], "llm", debug)
+
+    result["stage_timings"] = run["timings"]
+    return result
+
+
+def _current_versions() -> Optional[Dict[str, str]]:
+    try:
+        # 答案里可能带有从数据中链接到的取值，数据快照切换后即使表结构不变也不再复用。
+        return {"schema": get_schema_version(), "snapshot": current_snapshot().id, "knowledge": get_knowledge_version()}
+    except Exception as exc:
+        logger.warning("获取 schema/知识库版本失败，本次跳过答案缓存：%s", exc)
+        return None
+
+
+def _encode_question(user_question: str) -> Optional[Any]:
+    embeddings = encode_texts([user_question])
+    return embeddings[0] if embeddings is not None else None
+
+
+def _cached_result(cached: Dict[str, Any], started: float) -> Dict[str, Any]:
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    cached["stage_timings"] = {"total_ms": elapsed_ms, "stages": {}, "critical_path": []}
+    logger.info("NL2SQL 答案缓存命中（%s），耗时 %.2f ms", cached["cache"]["match"], elapsed_ms)
+    return cached
+
+
+async def _answer_question(
+    user_question: str,
+    on_event: Optional[EventCallback],
+    versions: Optional[Dict[str, str]],
+    started: float,
+    snapshot: Optional[Dict[str, Any]] = None,
+    debug: bool = False,
+) -> Dict[str, Any]:
+    cache = get_answer_cache()
+    slots = await asyncio.to_thread(extract_query_slots, user_question)
+    if snapshot is not None:
+        query_embedding = snapshot["embeddings"].get(user_question)
+    else:
+        query_embedding = await asyncio.to_thread(_encode_question, user_question)
+    if versions and not debug:
+        cached = cache.lookup_semantic(slots, query_embedding, versions)
+        if cached is not None:
+            return _cached_result(cached, started)
+
+    schema = snapshot["schema"] if snapshot is not None else None
+    result = await _run_workflow_graph(user_question, on_event, query_embedding, schema, debug, (versions or {}).get("schema"))
+    result["cache"] = {"hit": False}
+    if versions and is_cacheable(result) and not debug:
+        cache.store(user_question, slots, query_embedding, versions, result)
+    return result
+
+
+async def _resolve_question(
+    user_question: str,
+    on_event: Optional[EventCallback],
+    snapshot: Optional[Dict[str, Any]] = None,
+    debug: bool = False,
+) -> Dict[str, Any]:
+    started = time.perf_counter()
+    versions = snapshot["versions"] if snapshot is not None else await asyncio.to_thread(_current_versions)
+    # 缓存里只有标准结果，debug 请求需要重新生成调试产物，不查也不写答案缓存。
+    cached = get_answer_cache().lookup_exact(user_question, versions) if versions and not debug else None
+    if cached is not None:
+        return _cached_result(cached, started)
+
+    # 流式请求需要自己的阶段事件，不参与合并。
+    if on_event is not None:
+        return await _answer_question(user_question, on_event, versions, started, debug=debug)
+
+    key = (current_catalog().name, normalize_question(user_question), (versions or {}).get("schema"), (versions or {}).get("knowledge"), debug)
+    result, shared = await _inflight_requests.do(
+        key, lambda: _answer_question(user_question, None, versions, started, snapshot, debug)
+    )
+    if shared:
+        result["coalesced"] = True
+    return result
+
+
+# 会话状态中的规则类别 -> 工作流 rules 字典中的键
+_RULE_KEYS = {
+    "metrics": "metric_rules",
+    "business_terms": "business_term_rules",
+    "join_rules": "join_rules",
+    "time_rules": "time_rules",
+}
+
+
+def _session_state(result: Dict[str, Any], question: str, turn: int) -> Dict[str, Any]:
+    """从一轮的结果中提取追问需要的状态；debug 结果里的规则是完整对象，统一只保留名称。"""
+    knowledge = result.get("retrieved_knowledge") or {}
+    return {
+        "question": question,
+        "parsed_intent": result.get("parsed_intent") or {},
+        "rule_names": {
+            category: [rule if isinstance(rule, str) else rule.get("name", "") for rule in knowledge.get(category, [])]
+            for category in _RULE_KEYS
+        },
+        "tables": (result.get("sql_analysis") or {}).get("tables", []),
+        "sql": result["sql"],
+        "turn": turn,
+    }
+
+
+def _session_rules(question: str, intent: Dict[str, Any], delta: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """按名称还原规则；只有追问新增了指标或术语时才重新检索关联规则。"""
+    join_rules = find_exact_matches("join_rules", state["rule_names"].get("join_rules", []))
+    if delta["added"].get("metrics") or delta["added"].get("business_terms"):
+        seen = {rule.get("id") for rule in join_rules}
+        join_rules += [rule for rule in retrieve_knowledge("join_rules", question, top_k=3) if rule.get("id") not in seen]
+    time_range = intent.get("time_range") or {}
+    return {
+        "metric_rules": find_exact_matches("metrics", intent.get("metrics", [])),
+        "business_term_rules": find_exact_matches("business_terms", intent.get("business_terms", [])),
+        "join_rules": join_rules,
+        "time_rules": get_time_rules(time_range["grain"]) if time_range.get("grain") else [],
+    }
+
+
+def _literal_replacements(previous: Dict[str, Any], intent: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, str]:
+    """只改了时间或实体值时，返回 {旧字面量: 新字面量}；其他变化返回空字典。"""
+    if delta["structural"] or not delta["changed"]:
+        return {}
+
+    replacements: Dict[str, str] = {}
+    if "time_range" in delta["changed"]:
+        old, new = previous.get("time_range") or {}, intent["time_range"]
+        if old.get("grain") != new.get("grain") or not old.get("normalized_value"):
+            return {}
+        replacements[str(old["normalized_value"])] = str(new["normalized_value"])
+    if "entities" in delta["changed"]:
+        old_entities, new_entities = previous.get("entities") or [], intent["entities"]
+        if [item.get("type") for item in old_entities] != [item.get("type") for item in new_entities]:
+            return {}
+        for old, new in zip(old_entities, new_entities):
+            replacements[str(old.get("value", ""))] = str(new.get("value", ""))
+    return {old: new for old, new in replacements.items() if old and old != new}
+
+
+def _rewrite_question(state: Dict[str, Any], replacements: Dict[str, str], intent: Dict[str, Any]) -> Optional[str]:
+    """把追问改写成完整问题（上一轮问题中的时间、实体替换为新值），用于尝试规则编译与后续追问。"""
+    question = state["question"]
+    previous_time = state["parsed_intent"].get("time_range") or {}
+    time_range = intent.get("time_range") or {}
+    if previous_time.get("raw_text") and time_range.get("raw_text"):
+        question = question.replace(previous_time["raw_text"], time_range["raw_text"])
+    for old, new in replacements.items():
+        if old != previous_time.get("normalized_value"):
+            question = question.replace(old, new)
+    return question if question != state["question"] else None
+
+
+def _patch_previous_sql(state: Dict[str, Any], replacements: Dict[str, str], schema: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """直接在 AST 上替换上一轮 SQL 中对应的过滤字面量，不调用 LLM；字面量不在过滤条件里时返回空字典。"""
+    sql = replace_filter_literals(state["sql"], replacements)
+    if sql is None:
+        return {}
+    return {
+        "sql": sql,
+        "llm_output": "",
+        "prompt": "",
+        "schema_context": {"schema_text": None, "available_table_names": list(schema.keys()), "missing_tables": []},
+    }
+
+
+def _build_follow_up_graph(
+    question: str,
+    state: Dict[str, Any],
+    intent: Dict[str, Any],
+    delta: Dict[str, Any],
+    standalone: Optional[str],
+    replacements: Dict[str, str],
+    on_event: Optional[EventCallback] = None,
+    debug: bool = False,
+    schema_version: Optional[str] = None,
+) -> StageGraph:
+    """
+    追问的阶段图：只改时间/实体值时直接替换上一轮 SQL 的字面量（试绑定通过即返回）；
+    否则先尝试对改写后的完整问题做规则编译，最后才用精简修改 prompt 调用 LLM。
+    上一轮 SQL 引用的表直接复用，只有新增指标、术语或维度时才重新检索表与关联规则。
+    """
+
+    async def session_patch(session_rules, schema):
+        patched = _patch_previous_sql(state, replacements, schema)
+        if not patched:
+            return {}
+        report = await check_and_repair_sql(patched["sql"], schema, schema_version)
+        if report["status"] == "failed":
+            return {}
+        return {**patched, "sql": report["sql"], "dry_run": report}
+
+    def rule_sql(session_rules, schema, session_patch):
+        if session_patch or not standalone:
+            return {}
+        return _try_rule_sql(standalone, intent, session_rules, schema, debug)
+
+    def schema_context(session_rules, schema, session_patch, rule_sql):
+        tables = [schema[name] for name in state["tables"] if name in schema]
+        if any(delta["added"].get(key) for key in ["metrics", "business_terms", "dimensions"]):
+            tables += get_relevant_tables(question, top_k=5)
+        hints = _collect_table_hints(session_rules["metric_rules"], session_rules["business_term_rules"], session_rules["join_rules"])
+        return _merge_schema_context(tables, hints, schema)
+
+    async def llm_generation(session_rules, schema_context, schema):
+        previous = {name for names in state["rule_names"].values() for name in names}
+        new_rules = [rule for rules in session_rules.values() for rule in rules if rule.get("name") not in previous]
+        with span("prompt_build", edit=True) as prompt_span:
+            assembled = build_sql_edit_prompt(
+                follow_up=question,
+                parsed_intent=intent,
+                previous_question=state["question"],
+                previous_sql=state["sql"],
+                schema_tables=schema_context["schema_tables"],
+                new_rules=new_rules,
+                missing_tables=schema_context["missing_tables"],
+                full_schema=schema,
+                include_debug=debug,
+            )
+            prompt_span.set(prompt_tokens=assembled["prompt_tokens"], new_rules=len(new_rules))
+        return await _generate_with_llm(assembled, schema_context, on_event)
+
+    async def sql_check(llm_generation, schema):
+        return await _check_generation(llm_generation, schema, on_event, schema_version)
+
+    graph = StageGraph()
+    graph.add("schema", _schema_snapshot, describe=lambda value: {"tables": len(value)})
+    graph.add("session_rules", lambda: _session_rules(question, intent, delta, state), describe=_describe_rules)
+    graph.add(
+        "session_patch",
+        session_patch,
+        deps=["session_rules", "schema"],
+        describe=lambda patched: {"hit": bool(patched), "replacements": len(replacements)},
+    )
+    graph.add(
+        "rule_sql",
+        rule_sql,
+        deps=["session_rules", "schema", "session_patch"],
+        describe=lambda compiled: {"hit": bool(compiled)},
+    )
+    graph.add(
+        "schema_context",
+        schema_context,
+        deps=["session_rules", "schema", "session_patch", "rule_sql"],
+        when=lambda session_rules, schema, session_patch, rule_sql: not session_patch and not rule_sql,
+        describe=lambda context: {"schema_tables": len(context["schema_tables"]), "missing_tables": len(context["missing_tables"])},
+    )
+    graph.add("llm_generation", llm_generation, deps=["session_rules", "schema_context", "schema"])
+    graph.add(
+        "sql_check",
+        sql_check,
+        deps=["llm_generation", "schema"],
+        describe=lambda checked: {"dry_run": checked["dry_run"]["status"], "repair_llm_calls": checked["dry_run"]["llm_calls"]},
+    )
+    return graph
+
+
+async def _answer_follow_up(
+    question: str,
+    state: Dict[str, Any],
+    on_event: Optional[EventCallback],
+    debug: bool,
+) -> Dict[str, Any]:
+    merged = merge_follow_up_intent(question, state["parsed_intent"])
+    intent, delta = merged["parsed_intent"], merged["delta"]
+    replacements = _literal_replacements(state["parsed_intent"], intent, delta)
+    standalone = _rewrite_question(state, replacements, intent) if not delta["structural"] else None
+    logger.info("会话追问：changed=%s, added=%s, structural=%s", delta["changed"], delta["added"], delta["structural"])
+    if on_event is not None:
+        on_event("intent", {"source": "session", "parsed_intent": intent, "delta": delta})
+
+    versions = await asyncio.to_thread(_current_versions)
+    graph = _build_follow_up_graph(
+        question, state, intent, delta, standalone, replacements, on_event, debug, (versions or {}).get("schema")
+    )
+    run = await graph.run(outputs=["session_patch", "rule_sql", "sql_check"])
+    results = run["results"]
+    rules = results["session_rules"]
+    if results.get("session_patch"):
+        result = _build_result(intent, rules, results["session_patch"], "session_patch", debug)
+    elif results.get("rule_sql"):
+        result = _build_result(intent, rules, results["rule_sql"], "rule", debug)
+    else:
+        result = _build_result(intent, rules, results["sql_check"], "session_edit", debug)
+
+    result["stage_timings"] = run["timings"]
+    result["cache"] = {"hit": False}
+    result["session"] = {"delta": delta, "question": standalone or f"{state['question']}；{question}"}
+    return result
+
+
+async def _resolve_session_turn(
+    user_question: str,
+    session_id: str,
+    on_event: Optional[EventCallback],
+    debug: bool,
+) -> Dict[str, Any]:
+    """会话内的一轮：有上一轮状态且问题像追问时走增量路径，否则按完整问题处理并重置会话状态。"""
+    store = get_session_store()
+    state = store.get(session_id)
+    turn = state["turn"] + 1 if state else 1
+    if state is not None and is_follow_up(user_question):
+        result = await _answer_follow_up(user_question, state, on_event, debug)
+        mode, question, delta = "follow_up", result["session"]["question"], result["session"]["delta"]
+    else:
+        result = await _resolve_question(user_question, on_event, debug=debug)
+        mode, question, delta = "new", user_question, None
+
+    if result.get("sql") and (result.get("validation") or {}).get("is_valid"):
+        store.put(session_id, _session_state(result, question, turn))
+    result["session"] = {"session_id": session_id, "turn": turn, "mode": mode, "question": question, "delta": delta}
+    return result
+
+
+def shape_result(result: Dict[str, Any], verbosity: str) -> Dict[str, Any]:
+    """按详细程度裁剪结果；debug 独有的字段只有在 debug 模式下才会被生成。"""
+    if verbosity != "minimal":
+        return result
+    keys = ("sql", "generation_mode", "validation", "cache", "coalesced", "trace_id", "session")
+    return {key: result[key] for key in keys if key in result}
+
+
+async def run_nl2sql_workflow(
+    user_question: str,
+    on_event: Optional[EventCallback] = None,
+    snapshot: Optional[Dict[str, Any]] = None,
+    verbosity: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    执行 NL2SQL 工作流。传入 on_event 时按阶段推送进度事件，并以流式模式调用 LLM 逐段推送 SQL。
+    先查答案缓存：精确命中或语义命中时直接返回，不调用 LLM；
+    未命中时，问题、schema 版本、知识库版本都相同的并发请求共享同一次工作流执行。
+    每次产出的 SQL 按指纹计入查询统计，用于观察答案缓存对各类查询形状的命中率。
+    snapshot 由 prepare_batch_snapshot 生成，批量请求中的问题共用其中的 schema、版本号和问题向量。
+    verbosity 取 VERBOSITY_LEVELS 之一，默认 NL2SQL_DEFAULT_VERBOSITY。
+    传入 session_id 时按会话处理：追问只计算相对上一轮的变化（见 _resolve_session_turn）。
+    """
+    verbosity = verbosity or NL2SQL_DEFAULT_VERBOSITY
+    if verbosity not in VERBOSITY_LEVELS:
+        raise ValueError(f"不支持的 verbosity：{verbosity}")
+
+    with start_trace(
+        "nl2sql",
+        streaming=on_event is not None,
+        batch=snapshot is not None,
+        verbosity=verbosity,
+        session=session_id is not None,
+    ) as trace:
+        if session_id:
+            result = await _resolve_session_turn(user_question, session_id, on_event, verbosity == "debug")
+        else:
+            result = await _resolve_question(user_question, on_event, snapshot, verbosity == "debug")
+        set_span_attributes(
+            generation_mode=result.get("generation_mode"),
+            cache=(result.get("cache") or {}).get("match") or "miss",
+            coalesced=bool(result.get("coalesced")),
+            is_valid=bool((result.get("validation") or {}).get("is_valid")),
+        )
+    result["trace_id"] = trace.trace_id
+    if result.get("sql"):
+        await asyncio.to_thread(get_query_stats().record_generation, result["sql"], bool((result.get("cache") or {}).get("hit")))
+    return shape_result(result, verbosity)
+
+
+def _prepare_batch_snapshot(questions: List[str]) -> Dict[str, Any]:
+    versions = _current_versions()
+    schema = _schema_snapshot()
+    load_knowledge_base()
+    embeddings = encode_texts(questions)
+    return {
+        "versions": versions,
+        "schema": schema,
+        "embeddings": dict(zip(questions, embeddings)) if embeddings is not None else {},
     }
+
+
+async def prepare_batch_snapshot(questions: List[str]) -> Dict[str, Any]:
+    """批量请求的共享快照：schema 与知识库只读取一次，所有问题一次性批量编码。"""
+    with span("batch_snapshot", questions=len(questions)):
+        return await asyncio.to_thread(_prepare_batch_snapshot, questions)
+
+
+def dedupe_questions(questions: List[str]) -> Dict[str, List[int]]:
+    """按规范化后的问题去重，返回 {首次出现的原问题: [所有出现位置]}，保持原顺序。"""
+    first_seen: Dict[str, str] = {}
+    groups: Dict[str, List[int]] = {}
+    for index, question in enumerate(questions):
+        question = (question or "").strip()
+        if not question:
+            continue
+        key = normalize_question(question)
+        original = first_seen.setdefault(key, question)
+        groups.setdefault(original, []).append(index)
+    return groups
+
+
+async def run_nl2sql_batch(
+    questions: List[str],
+    concurrency: Optional[int] = None,
+    verbosity: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    批量执行 NL2SQL：问题去重后共享一份快照，以有限并发执行，谁先完成先产出谁。
+    每个结果带上 indices（该问题在原列表中的所有位置），最后产出一条 summary。
+    生成器被提前关闭（客户端断开）时取消尚未完成的问题。
+    """
+    started = time.perf_counter()
+    groups = dedupe_questions(questions)
+    limit = max(1, min(concurrency or NL2SQL_BATCH_CONCURRENCY, NL2SQL_BATCH_MAX_CONCURRENCY))
+    snapshot = await prepare_batch_snapshot(list(groups))
+    logger.info("NL2SQL 批量请求：%d 个问题，去重后 %d 个，并发 %d", len(questions), len(groups), limit)
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def answer(question: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                result = await run_nl2sql_workflow(question, snapshot=snapshot, verbosity=verbosity)
+            except Exception as exc:
+                logger.error("批量请求中的问题执行失败：%s，%s", question, exc)
+                return {"question": question, "indices": groups[question], "status": "error", "detail": "NL2SQL 工作流执行失败"}
+        if not result.get("sql"):
+            return {"question": question, "indices": groups[question], "status": "error", "detail": "未能从模型输出中解析出 SQL"}
+        return {"question": question, "indices": groups[question], "status": "ok", "result": result}
+
+    tasks = [asyncio.create_task(answer(question)) for question in groups]
+    counts = {"ok": 0, "error": 0}
+    try:
+        for finished in asyncio.as_completed(tasks):
+            item = await finished
+            counts[item["status"]] += 1
+            yield {"type": "result", **item}
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    yield {
+        "type": "summary",
+        "questions": len(questions),
+        "unique_questions": len(groups),
+        "concurrency": limit,
+        **counts,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def get_coalescing_stats() -> Dict[str, int]:
+    return _inflight_requests.stats()
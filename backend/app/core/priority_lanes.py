@@ -0,0 +1,249 @@
+"""
+接口优先级通道（priority lanes）与过载保护。
+
+元数据接口（/schema、/rag、/catalogs、/stats）、LLM 接口（/nl2sql）、批量接口（/nl2sql/batch）和执行 SQL 的 /query
+共用同一个 worker 的事件循环、线程池和 DuckDB；不加隔离时，一波导出查询就能把交互界面的元数据请求拖住。
+每类接口一个通道，各自限制并发数和排队长度：
+- 通道有空位时直接执行；满了进入本通道的 FIFO 队列，不占其他通道的名额；
+- 队列也满时立即返回 429，Retry-After 按本通道最近的平均处理时长和排队深度估算；
+- 客户端可用 X-Request-Timeout-Ms 头声明愿意等待的总时长。到达时已过期、或排到截止时间仍未轮到的请求直接丢弃并返回 504，
+  不再为客户端已经放弃的请求干活；未声明时最多排队 LANE_<通道>_MAX_WAIT_SECONDS，超时返回 503；
+- 流式响应（SSE / NDJSON）在整个响应发送完之前一直占用名额。
+
+/metrics、/、/docs 等不经过通道，过载时仍可访问。
+配置：LANE_<通道>_CONCURRENCY、LANE_<通道>_QUEUE、LANE_<通道>_MAX_WAIT_SECONDS（通道名大写），PRIORITY_LANES_ENABLED=false 关闭。
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.core.telemetry import LANE_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LANES_ENABLED = os.getenv("PRIORITY_LANES_ENABLED", "true").lower() in ("1", "true", "yes")
+REQUEST_TIMEOUT_HEADER = b"x-request-timeout-ms"
+
+# 通道名 -> (并发数, 排队上限, 默认最长排队秒数)
+_LANE_DEFAULTS: Dict[str, Tuple[int, int, float]] = {
+    "metadata": (16, 64, 5),
+    "llm": (16, 64, 30),
+    "query": (4, 16, 30),
+    "batch": (2, 4, 60),
+}
+
+# (HTTP 方法或 None, 路径前缀, 通道名)，按顺序取第一条匹配的规则。
+_ROUTES: List[Tuple[Optional[str], str, str]] = [
+    ("DELETE", "/nl2sql/session", "metadata"),
+    (None, "/nl2sql/batch", "batch"),
+    (None, "/nl2sql", "llm"),
+    (None, "/query", "query"),
+    (None, "/schema", "metadata"),
+    (None, "/rag", "metadata"),
+    (None, "/catalogs", "metadata"),
+    (None, "/stats", "metadata"),
+]
+
+# 处理时长的指数滑动平均系数，用于估算 Retry-After。
+_SERVICE_TIME_ALPHA = 0.2
+
+
+class LaneRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Lane:
+    """一个通道：最多 concurrency 个请求同时执行，最多 queue_limit 个排队；名额释放时直接转交给队首请求。"""
+
+    def __init__(self, name: str, concurrency: int, queue_limit: int, max_wait: float) -> None:
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(0, queue_limit)
+        self.max_wait = max_wait
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_time = 0.0
+        self._stats: Dict[str, float] = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "expired": 0,
+            "timed_out": 0,
+            "completed": 0,
+            "wait_ms_total": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    def retry_after(self) -> int:
+        """排在队尾的请求大约还要等多久：平均处理时长 × 前面的排队数 / 并发数，至少 1 秒。"""
+        service_time = self._service_time or 1.0
+        return max(1, math.ceil(service_time * (len(self._waiters) + 1) / self.concurrency))
+
+    async def acquire(self, deadline: Optional[float] = None) -> float:
+        """占用一个名额，返回排队秒数；无法执行时抛 LaneRejected。deadline 为 time.monotonic() 时间点。"""
+        started = time.monotonic()
+        if deadline is not None and deadline <= started:
+            self._stats["expired"] += 1
+            LANE_QUEUE_WAIT.observe(0, lane=self.name, outcome="expired")
+            raise LaneRejected(504, "请求到达时已超过客户端截止时间，已丢弃")
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            self._admitted(0.0)
+            return 0.0
+        if len(self._waiters) >= self.queue_limit:
+            self._stats["rejected"] += 1
+            raise LaneRejected(429, f"{self.name} 通道繁忙，请稍后重试", self.retry_after())
+
+        timeout = self.max_wait if deadline is None else min(self.max_wait, deadline - started)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        # 不用 wait_for：名额刚转交过来时请求被取消，wait_for 会吞掉取消并返回，被取消的请求反而占着名额。
+        try:
+            await asyncio.wait({waiter}, timeout=max(0.0, timeout))
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已转交过来，但本请求不再执行（客户端断开等），转交给下一个。
+                self._release_slot()
+            else:
+                waiter.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            raise
+
+        if not waiter.done():
+            waiter.cancel()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            waited = time.monotonic() - started
+            if deadline is not None and time.monotonic() >= deadline:
+                self._stats["expired"] += 1
+                LANE_QUEUE_WAIT.observe(waited, lane=self.name, outcome="expired")
+                raise LaneRejected(504, "排队期间超过客户端截止时间，已丢弃")
+            self._stats["timed_out"] += 1
+            LANE_QUEUE_WAIT.observe(waited, lane=self.name, outcome="timed_out")
+            raise LaneRejected(503, f"{self.name} 通道排队超时，请稍后重试", self.retry_after())
+
+        waited = time.monotonic() - started
+        self._admitted(waited)
+        return waited
+
+    def _admitted(self, waited: float) -> None:
+        self._stats["admitted"] += 1
+        self._stats["wait_ms_total"] += waited * 1000
+        self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], round(waited * 1000, 2))
+        LANE_QUEUE_WAIT.observe(waited, lane=self.name, outcome="admitted")
+
+    def release(self, service_time: float) -> None:
+        self._stats["completed"] += 1
+        self._service_time = (
+            service_time if not self._service_time else (1 - _SERVICE_TIME_ALPHA) * self._service_time + _SERVICE_TIME_ALPHA * service_time
+        )
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            **self._stats,
+            "in_flight": self._active,
+            "waiting": len(self._waiters),
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "service_ms_avg": round(self._service_time * 1000, 2),
+        }
+
+
+class LaneRegistry:
+    def __init__(self, routes: List[Tuple[Optional[str], str, str]] = _ROUTES) -> None:
+        self.lanes: Dict[str, Lane] = {}
+        for name, (concurrency, queue_limit, max_wait) in _LANE_DEFAULTS.items():
+            prefix = f"LANE_{name.upper()}_"
+            self.lanes[name] = Lane(
+                name,
+                int(os.getenv(prefix + "CONCURRENCY", str(concurrency))),
+                int(os.getenv(prefix + "QUEUE", str(queue_limit))),
+                float(os.getenv(prefix + "MAX_WAIT_SECONDS", str(max_wait))),
+            )
+        self.routes = routes
+
+    def route(self, method: str, path: str) -> Optional[Lane]:
+        for route_method, prefix, lane in self.routes:
+            if route_method is not None and route_method != method:
+                continue
+            if path == prefix or path.startswith(prefix + "/"):
+                return self.lanes[lane]
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+_registry: Optional[LaneRegistry] = None
+
+
+def get_lane_registry() -> LaneRegistry:
+    global _registry
+    if _registry is None:
+        _registry = LaneRegistry()
+    return _registry
+
+
+def get_lane_stats() -> Dict[str, Dict[str, float]]:
+    return get_lane_registry().stats()
+
+
+def _request_deadline(scope: Dict[str, Any]) -> Optional[float]:
+    for name, value in scope.get("headers", []):
+        if name == REQUEST_TIMEOUT_HEADER:
+            try:
+                return time.monotonic() + float(value) / 1000
+            except ValueError:
+                return None
+    return None
+
+
+class PriorityLaneMiddleware:
+    """ASGI 中间件：按路径把请求分到通道，拿到名额后才交给应用，响应（含流式响应）发送完毕后归还。"""
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        lane = get_lane_registry().route(scope["method"], scope["path"]) if scope["type"] == "http" and PRIORITY_LANES_ENABLED else None
+        if lane is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await lane.acquire(_request_deadline(scope))
+        except LaneRejected as exc:
+            if exc.status_code == 429:
+                logger.warning("%s 通道已满（并发 %d，排队 %d），拒绝 %s", lane.name, lane.concurrency, lane.queue_limit, scope["path"])
+            headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+            response = JSONResponse(status_code=exc.status_code, content={"detail": exc.detail, "lane": lane.name}, headers=headers)
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release(time.monotonic() - started)
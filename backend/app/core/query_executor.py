@@ -1,22 +1,38 @@
+import asyncio
 import logging
 import os
+import threading
 import time
-from typing import Dict, List
+from contextlib import ExitStack, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 import duckdb
 
+from app.core.catalogs import current_catalog, get_catalog_registry
+from app.core.db_snapshots import Snapshot, connect_read_only, current_snapshot
+from app.core.query_stats import get_query_stats
+from app.core.sql_analysis import analyze_sql, fingerprint_sql, inject_limit
+from app.core.telemetry import QUERY_ROWS, span, start_trace
+
 logger = logging.getLogger(__name__)
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DB_PATH = os.path.join(BASE_DIR, "app/example.duckdb")
+# 单次查询最多返回的行数，顶层没有 LIMIT 的查询会被追加 LIMIT；0 表示不限制。
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+# 连接池最多保留的空闲连接数；0 表示每次查询新建连接。
+QUERY_POOL_SIZE = int(os.getenv("QUERY_POOL_SIZE", "4"))
+# 分批返回结果时，首批行数尽量小以便前端尽早渲染，其余按 QUERY_BATCH_ROWS 分批。
+QUERY_FIRST_BATCH_ROWS = int(os.getenv("QUERY_FIRST_BATCH_ROWS", "200"))
+QUERY_BATCH_ROWS = int(os.getenv("QUERY_BATCH_ROWS", "2000"))
 
 
-def get_db_connection(max_retries: int = 3, retry_delay: int = 1) -> duckdb.DuckDBPyConnection:
-    """获取 DuckDB 连接，失败时进行有限重试。"""
+def get_db_connection(
+    max_retries: int = 3, retry_delay: int = 1, db_path: Optional[str] = None, memory_limit: Optional[str] = None
+) -> duckdb.DuckDBPyConnection:
+    """获取 DuckDB 连接（默认连当前数据目录的当前快照），失败时进行有限重试。"""
     last_error = None
     for attempt in range(max_retries):
         try:
-            return duckdb.connect(DB_PATH, read_only=True)
+            return connect_read_only(db_path, memory_limit)
         except Exception as exc:
             last_error = exc
             logger.warning("第 %d 次连接失败：%s", attempt + 1, exc)
@@ -26,23 +42,225 @@ def get_db_connection(max_retries: int = 3, retry_delay: int = 1) -> duckdb.Duck
     raise last_error
 
 
-async def run_sql(sql: str) -> List[Dict]:
+class _SnapshotReaders:
+    """一个数据快照上的数据库连接及其借出中的 cursor 数（读者引用计数）。"""
+
+    def __init__(self, snapshot: Snapshot, memory_limit: Optional[str] = None) -> None:
+        self.snapshot = snapshot
+        self.conn = get_db_connection(db_path=snapshot.path, memory_limit=memory_limit)
+        self.readers = 0
+
+
+class ConnectionPool:
     """
-    执行 SQL 并返回查询结果（list[dict] 格式，前端最容易解析）。
+    只读 DuckDB 连接池：为当前数据快照持有一个数据库连接，按需派生 cursor（同一数据库实例上的独立连接）并在用完后归还复用。
+    快照切换后新请求改用新快照；旧快照的连接转为退役状态，仍在执行的查询照常跑完，最后一个读者归还时关闭旧连接、释放旧文件。
+    每个数据目录一个连接池，db_path 为该目录的库文件。
     """
+
+    def __init__(self, db_path: str, size: int = QUERY_POOL_SIZE, memory_limit: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self.size = size
+        self.memory_limit = memory_limit
+        self._lock = threading.Lock()
+        self._current: Optional[_SnapshotReaders] = None
+        self._retired: List[_SnapshotReaders] = []
+        self._idle: List[duckdb.DuckDBPyConnection] = []
+        self._stats = {"created": 0, "reused": 0, "rebuilds": 0, "released": 0, "in_use": 0}
+
+    def _retire_locked(self) -> None:
+        for cursor in self._idle:
+            cursor.close()
+        self._idle.clear()
+        if self._current is None:
+            return
+        if self._current.readers:
+            self._retired.append(self._current)
+        else:
+            self._current.conn.close()
+            self._stats["released"] += 1
+        self._current = None
+
+    @contextmanager
+    def connection(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        snapshot = current_snapshot(self.db_path)
+        with self._lock:
+            if self._current is None or self._current.snapshot.id != snapshot.id:
+                if self._current is not None:
+                    logger.info("数据快照已切换（%s → %s），新请求改用新快照。", self._current.snapshot.id, snapshot.id)
+                    self._stats["rebuilds"] += 1
+                self._retire_locked()
+                self._current = _SnapshotReaders(snapshot, self.memory_limit)
+            owner = self._current
+            if self._idle:
+                cursor = self._idle.pop()
+                self._stats["reused"] += 1
+            else:
+                cursor = owner.conn.cursor()
+                self._stats["created"] += 1
+            owner.readers += 1
+            self._stats["in_use"] += 1
+
+        try:
+            yield cursor
+        finally:
+            release = None
+            with self._lock:
+                owner.readers -= 1
+                self._stats["in_use"] -= 1
+                if owner is self._current and len(self._idle) < self.size:
+                    self._idle.append(cursor)
+                    cursor = None
+                elif owner is not self._current and owner.readers == 0 and owner in self._retired:
+                    self._retired.remove(owner)
+                    release = owner
+            if cursor is not None:
+                cursor.close()
+            if release is not None:
+                release.conn.close()
+                self._stats["released"] += 1
+                logger.info("旧数据快照 %s 的最后一个查询已结束，连接已关闭。", release.snapshot.id)
+
+    def close(self) -> None:
+        with self._lock:
+            self._retire_locked()
+            for owner in self._retired:
+                owner.conn.close()
+            self._retired.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "idle": len(self._idle),
+                "size": self.size,
+                "retired_snapshots": len(self._retired),
+                "retired_readers": sum(owner.readers for owner in self._retired),
+                "snapshot": self._current.snapshot.id if self._current else "",
+            }
+
+
+def get_connection_pool() -> ConnectionPool:
+    """当前数据目录的连接池；目录被空闲回收时连接池随之关闭，下次使用重新创建。"""
+    catalog = current_catalog()
+    return catalog.get_state("connection_pool", lambda: ConnectionPool(catalog.duckdb_path, memory_limit=catalog.memory_limit))
+
+
+def close_connection_pool() -> None:
+    for catalog in get_catalog_registry().catalogs():
+        pool = catalog.state.get("connection_pool")
+        if pool is not None:
+            pool.close()
+
+
+@contextmanager
+def pooled_connection() -> Iterator[duckdb.DuckDBPyConnection]:
+    """从连接池借一个只读连接；QUERY_POOL_SIZE=0 时退化为每次新建连接。"""
+    if QUERY_POOL_SIZE <= 0:
+        with get_db_connection() as conn:
+            yield conn
+        return
+    with get_connection_pool().connection() as conn:
+        yield conn
+
+
+def _execute(sql: str) -> List[Dict]:
+    with pooled_connection() as conn:
+        result = conn.execute(sql)
+        rows = result.fetchall()
+        columns = [col[0] for col in result.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _prepare_sql(sql: str) -> Tuple[str, str, Dict[str, str]]:
+    """返回 (原 SQL, 实际执行的 SQL, 指纹)；要解析 SQL，在线程池里调用。"""
     normalized_sql = sql.strip() if sql else ""
     if not normalized_sql:
         raise ValueError("SQL 不能为空。")
 
-    logger.info("开始执行 SQL：%s", normalized_sql)
-    try:
-        with get_db_connection() as conn:
-            result = conn.execute(normalized_sql)
-            rows = result.fetchall()
-            columns = [col[0] for col in result.description]
-        data = [dict(zip(columns, row)) for row in rows]
-        logger.info("SQL 执行成功，共返回 %d 行。", len(data))
-        return data
-    except Exception as exc:
-        logger.error("执行 SQL 失败：%s", exc)
-        raise
+    analysis = analyze_sql(normalized_sql)
+    executed_sql = inject_limit(normalized_sql, QUERY_MAX_ROWS, analysis)
+    if executed_sql != normalized_sql:
+        logger.info("SQL 未指定 LIMIT，追加 LIMIT %d。", QUERY_MAX_ROWS)
+    return normalized_sql, executed_sql, fingerprint_sql(normalized_sql, analysis)
+
+
+def injected_row_limit(sql: str) -> Optional[int]:
+    """执行该 SQL 时会追加的 LIMIT 行数；SQL 自带 LIMIT、无法解析或不限制行数时返回 None。"""
+    normalized_sql = sql.strip() if sql else ""
+    if not normalized_sql or inject_limit(normalized_sql, QUERY_MAX_ROWS) == normalized_sql:
+        return None
+    return QUERY_MAX_ROWS
+
+
+async def run_sql(sql: str) -> List[Dict]:
+    """
+    执行 SQL 并返回查询结果（list[dict] 格式，前端最容易解析）。
+    """
+    normalized_sql, executed_sql, fingerprint = await asyncio.to_thread(_prepare_sql, sql)
+
+    logger.info("开始执行 SQL：%s", executed_sql)
+    with start_trace("query"), span("execute", limit_injected=executed_sql != normalized_sql) as execute_span:
+        started = time.perf_counter()
+        try:
+            # DuckDB 查询是阻塞调用，放到线程池执行，避免冻结事件循环。
+            data = await asyncio.to_thread(_execute, executed_sql)
+        except Exception as exc:
+            logger.error("执行 SQL 失败：%s", exc)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            get_query_stats().record_execution(normalized_sql, elapsed_ms, error=True, fingerprint=fingerprint)
+            raise
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        get_query_stats().record_execution(normalized_sql, elapsed_ms, rows=len(data), fingerprint=fingerprint)
+        execute_span.set(rows=len(data), fingerprint_id=fingerprint["id"])
+    QUERY_ROWS.observe(len(data))
+    logger.info("SQL 执行成功，共返回 %d 行。", len(data))
+    return data
+
+
+async def stream_sql(
+    sql: str,
+    first_batch_rows: int = QUERY_FIRST_BATCH_ROWS,
+    batch_rows: int = QUERY_BATCH_ROWS,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    执行 SQL 并分批产出 {"columns", "rows", "offset"}：首批只取 first_batch_rows 行，拿到就返回，
+    其余结果在消费方读取时再按 batch_rows 分批拉取。即使结果为空也会产出一批（带列名）。
+    """
+    normalized_sql, executed_sql, fingerprint = await asyncio.to_thread(_prepare_sql, sql)
+
+    logger.info("开始分批执行 SQL：%s", executed_sql)
+    started = time.perf_counter()
+    total = 0
+    error = False
+    with ExitStack() as stack:
+        try:
+            with start_trace("query", streaming=True), span("execute", limit_injected=executed_sql != normalized_sql) as execute_span:
+                # 打开库文件、连接失败时的重试等待都是阻塞操作，借连接也放到线程池。
+                conn = await asyncio.to_thread(stack.enter_context, pooled_connection())
+                result = await asyncio.to_thread(conn.execute, executed_sql)
+                columns = [col[0] for col in result.description]
+                batch = await asyncio.to_thread(result.fetchmany, first_batch_rows)
+                execute_span.set(first_batch_rows=len(batch), fingerprint_id=fingerprint["id"])
+
+            size = first_batch_rows
+            while True:
+                total += len(batch)
+                yield {"columns": columns, "rows": [dict(zip(columns, row)) for row in batch], "offset": total - len(batch)}
+                if len(batch) < size:
+                    break
+                size = batch_rows
+                batch = await asyncio.to_thread(result.fetchmany, batch_rows)
+                if not batch:
+                    break
+        except Exception as exc:
+            error = True
+            logger.error("执行 SQL 失败：%s", exc)
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            get_query_stats().record_execution(normalized_sql, elapsed_ms, rows=total, error=error, fingerprint=fingerprint)
+
+    QUERY_ROWS.observe(total)
+    logger.info("SQL 分批执行完成，共返回 %d 行。", total)
@@ -1,3 +1,4 @@
+import copy
 import json
 import logging
 import re
@@ -5,6 +6,7 @@ from typing import Any, Dict, List, Optional
 
 from app.core.knowledge_base import list_knowledge_names, retrieve_knowledge
 from app.core.llm_client import call_llm
+from app.core.value_index import link_values
 
 logger = logging.getLogger(__name__)
 
@@ -77,37 +79,45 @@ def _extract_employee_id(query: str) -> List[Dict[str, Any]]:
     return matches
 
 
+_QUERY_TYPE_KEYWORDS = {
+    "ranking": ["排名", "前10", "前5", "top"],
+    "trend": ["趋势", "每月", "按月", "走势"],
+    "compare": ["对比", "比较", "同比", "环比"],
+    "detail": ["明细", "列表", "逐笔"],
+}
+
+_DIMENSION_KEYWORDS = {
+    "员工": ["员工", "人员", "姓名"],
+    "营业部": ["营业部", "部门", "机构"],
+    "月份": ["月", "月份"],
+    "客户": ["按客户", "客户维度", "客户号"],
+}
+
+_AGGREGATION_KEYWORDS = {
+    "avg": ["平均", "人均"],
+    "count": ["数量", "多少个", "人数", "户数"],
+}
+
+
 def _detect_query_type(query: str) -> str:
-    if any(keyword in query for keyword in ["排名", "前10", "前5", "top"]):
-        return "ranking"
-    if any(keyword in query for keyword in ["趋势", "每月", "按月", "走势"]):
-        return "trend"
-    if any(keyword in query for keyword in ["对比", "比较", "同比", "环比"]):
-        return "compare"
-    if any(keyword in query for keyword in ["明细", "列表", "逐笔"]):
-        return "detail"
+    for query_type, keywords in _QUERY_TYPE_KEYWORDS.items():
+        if any(keyword in query for keyword in keywords):
+            return query_type
     return "aggregate"
 
 
 def _detect_dimensions(query: str) -> List[str]:
-    dimension_map = {
-        "员工": ["员工", "人员", "姓名"],
-        "营业部": ["营业部", "部门", "机构"],
-        "月份": ["月", "月份"],
-        "客户": ["按客户", "客户维度", "客户号"],
-    }
     dimensions = []
-    for name, keywords in dimension_map.items():
+    for name, keywords in _DIMENSION_KEYWORDS.items():
         if any(keyword in query for keyword in keywords):
             dimensions.append(name)
     return dimensions
 
 
 def _detect_aggregation(query: str) -> str:
-    if any(keyword in query for keyword in ["平均", "人均"]):
-        return "avg"
-    if any(keyword in query for keyword in ["数量", "多少个", "人数", "户数"]):
-        return "count"
+    for aggregation, keywords in _AGGREGATION_KEYWORDS.items():
+        if any(keyword in query for keyword in keywords):
+            return aggregation
     return "sum"
 
 
@@ -121,39 +131,95 @@ def _match_terms(query: str, category: str) -> List[str]:
     return matched
 
 
-def _heuristic_parse(query: str) -> Dict[str, Any]:
+def _link_entities(query: str, metrics: List[str], business_terms: List[str], time_range: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """正则识别的员工号在前，其余实体来自列值索引；指标、术语和时间片段不参与值链接。"""
+    entities = _extract_employee_id(query)
+    exclude = [*metrics, *business_terms, (time_range or {}).get("raw_text", "")]
+    seen = {entity["value"] for entity in entities}
+    for entity in link_values(query, exclude):
+        if entity["value"] not in seen:
+            entities.append(entity)
+            seen.add(entity["value"])
+    return entities
+
+
+def _strip_entity_text(query: str, entities: List[Dict[str, Any]]) -> str:
+    """去掉实体取值本身，例如“北京营业部”里的“营业部”不算按营业部拆分。"""
+    for entity in entities:
+        if entity.get("type") == "column_value":
+            query = query.replace(entity.get("raw_text") or entity["value"], " ")
+    return query
+
+
+def heuristic_parse(query: str) -> Dict[str, Any]:
+    """只用正则、知识库名称和列值索引做的规则解析，不调用 LLM。"""
     time_range = _extract_month(query) or _extract_year(query)
+    metrics = _match_terms(query, "metrics")
+    business_terms = _match_terms(query, "business_terms")
+    entities = _link_entities(query, metrics, business_terms, time_range)
     return {
         "query_type": _detect_query_type(query),
-        "metrics": _match_terms(query, "metrics"),
-        "business_terms": _match_terms(query, "business_terms"),
-        "entities": _extract_employee_id(query),
+        "metrics": metrics,
+        "business_terms": business_terms,
+        "entities": entities,
         "time_range": time_range,
-        "dimensions": _detect_dimensions(query),
+        "dimensions": _detect_dimensions(_strip_entity_text(query, entities)),
         "aggregation": _detect_aggregation(query),
         "needs_clarification": False,
         "clarification_questions": [],
     }
 
 
-def _llm_parse(query: str, heuristic_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    metric_candidates = [item.get("name") for item in retrieve_knowledge("metrics", query, top_k=8)]
-    term_candidates = [item.get("name") for item in retrieve_knowledge("business_terms", query, top_k=8)]
-
-    prompt = f"""
-你是证券业务查询解析器。你的任务是把用户问题解析成结构化查询意图，不要生成 SQL。
+# 问句里常见的措辞，不构成 SQL 字面量；去掉它们和已识别的词之后仍剩下的中文片段视为未识别的实体（如人名）。
+_PHRASING_WORDS = [
+    *(keyword for keywords in _QUERY_TYPE_KEYWORDS.values() for keyword in keywords),
+    *(keyword for keywords in _DIMENSION_KEYWORDS.values() for keyword in keywords),
+    *(keyword for keywords in _AGGREGATION_KEYWORDS.values() for keyword in keywords),
+    "请问", "帮我", "查询", "查看", "查一下", "查", "看看", "看一下", "统计", "计算", "列出", "显示", "给出", "汇总",
+    "合计", "总共", "一共", "是多少", "有多少", "多少", "分别", "各个", "每个", "所有", "全部", "情况", "数据",
+    "一下", "按照", "按", "各", "每", "总", "的", "了", "吗", "呢", "是", "和", "与", "及", "在", "中", "里", "年", "月", "日",
+]
+_PHRASING_PATTERN = re.compile("|".join(re.escape(word) for word in sorted(set(_PHRASING_WORDS), key=len, reverse=True)))
+
+
+def _unresolved_cjk(query: str, known: List[str]) -> List[str]:
+    for text in sorted((item for item in known if item), key=len, reverse=True):
+        query = query.replace(text, " ")
+    return sorted(set(re.findall(r"[\u4e00-\u9fff]+", _PHRASING_PATTERN.sub(" ", query))))
+
+
+def extract_query_slots(query: str) -> Dict[str, List[str]]:
+    """
+    抽取问题中决定 SQL 字面量与口径的槽位：数字/编号字面量、识别出的实体（员工号、列值索引命中的取值）、
+    命中的指标与业务术语，以及去掉这些和常见措辞后仍剩下的中文片段（列值索引里没有的人名等）。
+    措辞不同但槽位一致的问题才可能共用同一条 SQL；宁可少命中，也不能把“张三”的 SQL 给“李四”。
+    """
+    parsed = heuristic_parse(query)
+    entities = sorted({str(entity["value"]) for entity in parsed["entities"]})
+    known = [
+        *parsed["metrics"],
+        *parsed["business_terms"],
+        *entities,
+        *(entity.get("raw_text", "") for entity in parsed["entities"]),
+        (parsed["time_range"] or {}).get("raw_text", ""),
+    ]
+    return {
+        "literals": sorted(set(re.findall(r"[A-Za-z0-9_]+", query))),
+        "values": entities,
+        "unresolved": _unresolved_cjk(query, known),
+        "metrics": sorted(parsed["metrics"]),
+        "business_terms": sorted(parsed["business_terms"]),
+    }
 
-用户问题：
-{query}
 
-规则预解析结果：
-{json.dumps(heuristic_result, ensure_ascii=False)}
+# 解析提示词的静态部分放在 system 消息里，逐请求变化的内容放在 user 消息末尾，便于服务商复用前缀缓存。
+# 修改 _PARSE_INSTRUCTIONS 时同步提升版本号。
+PARSE_PROMPT_REVISION = "parse-r2"
 
-指标候选：
-{json.dumps(metric_candidates, ensure_ascii=False)}
+_PARSE_INSTRUCTIONS = """
+你是证券业务查询解析器。你的任务是把用户问题解析成结构化查询意图，不要生成 SQL。
 
-业务术语候选：
-{json.dumps(term_candidates, ensure_ascii=False)}
+用户消息会依次给出：规则预解析结果、指标候选、业务术语候选，最后是用户问题。
 
 请输出一个 JSON 对象，包含以下字段：
 - query_type
@@ -169,16 +235,35 @@ def _llm_parse(query: str, heuristic_result: Dict[str, Any]) -> Optional[Dict[st
 要求：
 1. 只输出 JSON，不要输出解释。
 2. metrics 和 business_terms 使用最接近候选名称；如果没有把握，可以留空。
-3. entities 中每个元素形如 {{"type":"employee_id","value":"E001","field_hint":"emp_num"}}。
+3. entities 中每个元素形如 {"type":"employee_id","value":"E001","field_hint":"emp_num"}；
+   规则预解析结果中 type 为 column_value 的实体来自数据库中的真实取值，请原样保留。
 4. time_range 中如果识别到月份，请输出 raw_text/grain/normalized_value/storage_format。
 5. 不要编造数据库字段名，不要生成 SQL。
 """.strip()
 
+
+async def _llm_parse(query: str, heuristic_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    metric_candidates = [item.get("name") for item in retrieve_knowledge("metrics", query, top_k=8)]
+    term_candidates = [item.get("name") for item in retrieve_knowledge("business_terms", query, top_k=8)]
+
+    user_content = "\n\n".join(
+        [
+            f"规则预解析结果：\n{json.dumps(heuristic_result, ensure_ascii=False)}",
+            f"指标候选：\n{json.dumps(metric_candidates, ensure_ascii=False)}",
+            f"业务术语候选：\n{json.dumps(term_candidates, ensure_ascii=False)}",
+            f"用户问题：\n{query}",
+        ]
+    )
+
     try:
-        llm_output = call_llm(
-            messages=[{"role": "user", "content": prompt}],
+        llm_output = await call_llm(
+            messages=[
+                {"role": "system", "content": _PARSE_INSTRUCTIONS},
+                {"role": "user", "content": user_content},
+            ],
             max_tokens=512,
             temperature=0,
+            prompt_cache_key=PARSE_PROMPT_REVISION,
         )
     except Exception as exc:
         logger.warning("LLM 解析查询意图失败，回退到规则解析：%s", exc)
@@ -206,10 +291,17 @@ def _merge_results(base: Dict[str, Any], refined: Optional[Dict[str, Any]]) -> D
     return merged
 
 
-def parse_user_query(query: str) -> Dict[str, Any]:
-    heuristic_result = _heuristic_parse(query)
-    refined_result = _llm_parse(query, heuristic_result)
+async def parse_user_query(query: str, use_llm: bool = True, heuristic_result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """heuristic_result 为调用方已算好的 heuristic_parse 结果时直接复用（不会被修改），省掉一次规则解析。"""
+    heuristic_result = copy.deepcopy(heuristic_result) if heuristic_result is not None else heuristic_parse(query)
+    refined_result = await _llm_parse(query, heuristic_result) if use_llm else None
     parsed = _merge_results(heuristic_result, refined_result)
+    # 列值索引命中的是库里真实存在的取值，LLM 改写实体列表时不能丢掉。
+    refined_values = {str(entity.get("value")) for entity in parsed.get("entities", [])}
+    parsed["entities"] = [
+        *parsed.get("entities", []),
+        *[entity for entity in heuristic_result["entities"] if entity.get("type") == "column_value" and entity["value"] not in refined_values],
+    ]
 
     if not parsed.get("metrics"):
         parsed["metrics"] = [item.get("name") for item in retrieve_knowledge("metrics", query, top_k=3)]
@@ -217,3 +309,68 @@ def parse_user_query(query: str) -> Dict[str, Any]:
         parsed["business_terms"] = [item.get("name") for item in retrieve_knowledge("business_terms", query, top_k=3)]
 
     return parsed
+
+
+# 追问标记：出现这些词，或问题里没有点名任何指标时，视为在上一轮基础上修改。
+_FOLLOW_UP_MARKERS = ["再", "换成", "改成", "改为", "换为", "只看", "那", "同样", "加上", "去掉", "拆分", "呢"]
+# 出现这些词时，新点名的指标/术语替换上一轮的，否则追加。
+_REPLACE_MARKERS = ["换成", "改成", "改为", "换为", "替换为", "只看"]
+# 这些字段变化会改变 SQL 结构（选择列、分组、排序），只改时间或实体时可以直接替换字面量。
+_STRUCTURAL_FIELDS = ["metrics", "business_terms", "dimensions", "query_type", "aggregation"]
+
+
+def is_follow_up(query: str) -> bool:
+    return any(marker in query for marker in _FOLLOW_UP_MARKERS) or not _match_terms(query, "metrics")
+
+
+def merge_follow_up_intent(query: str, previous: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把追问合并到上一轮的解析意图上（只用规则解析，不调用 LLM），返回 {"parsed_intent", "delta"}。
+    delta 记录发生变化的字段和新增的指标/术语/维度；structural 为 True 表示需要改写 SQL 结构。
+    """
+    current = heuristic_parse(query)
+    merged = copy.deepcopy(previous)
+    changed: List[str] = []
+    added: Dict[str, List[str]] = {}
+    replace = any(marker in query for marker in _REPLACE_MARKERS)
+
+    if current["time_range"] and current["time_range"] != previous.get("time_range"):
+        merged["time_range"] = current["time_range"]
+        changed.append("time_range")
+    if current["entities"] and current["entities"] != previous.get("entities"):
+        merged["entities"] = current["entities"]
+        changed.append("entities")
+
+    for key in ["metrics", "business_terms"]:
+        new_names = [name for name in current[key] if name not in previous.get(key, [])]
+        if new_names:
+            merged[key] = current[key] if replace else [*previous.get(key, []), *new_names]
+            added[key] = new_names
+            changed.append(key)
+
+    # 时间表达式里的“月”不算按月份拆分。
+    dimension_text = query.replace(current["time_range"]["raw_text"], " ") if current["time_range"] else query
+    dimension_text = _strip_entity_text(dimension_text, current["entities"])
+    new_dimensions = [name for name in _detect_dimensions(dimension_text) if name not in previous.get("dimensions", [])]
+    if new_dimensions:
+        merged["dimensions"] = [*previous.get("dimensions", []), *new_dimensions]
+        added["dimensions"] = new_dimensions
+        changed.append("dimensions")
+
+    query_type = _detect_query_type(query)
+    if query_type != "aggregate" and query_type != previous.get("query_type"):
+        merged["query_type"] = query_type
+        changed.append("query_type")
+    aggregation = _detect_aggregation(query)
+    if aggregation != "sum" and aggregation != previous.get("aggregation"):
+        merged["aggregation"] = aggregation
+        changed.append("aggregation")
+
+    return {
+        "parsed_intent": merged,
+        "delta": {
+            "changed": changed,
+            "added": added,
+            "structural": any(field in changed for field in _STRUCTURAL_FIELDS),
+        },
+    }
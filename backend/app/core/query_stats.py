@@ -0,0 +1,264 @@
+"""
+按 SQL 指纹聚合的查询统计（类似 pg_stat_statements）。
+
+每个指纹记录执行次数、总/平均/p95 耗时、返回行数、报错次数，以及 NL2SQL 生成该形状 SQL 时命中答案缓存的比例。
+内存中最多保留 QUERY_STATS_MAX_ENTRIES 个指纹，超出时淘汰执行次数最少的一批。
+
+多个 uvicorn worker 共用同一个统计文件：每个进程内存里只记上次落盘以来的增量，后台任务每
+QUERY_STATS_FLUSH_SECONDS 秒在文件锁（<文件>.lock）内读出文件、合并本进程的增量再原子替换，
+所以文件里是所有 worker、跨重启的累计值。/stats/queries 读文件再叠加本进程未落盘的增量，
+其他 worker 最近一个落盘周期内的数据要等它们落盘后才可见。
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.sql_analysis import fingerprint_sql
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+QUERY_STATS_PATH = os.getenv("QUERY_STATS_PATH", os.path.join(BASE_DIR, "app", "query_stats.json"))
+QUERY_STATS_MAX_ENTRIES = int(os.getenv("QUERY_STATS_MAX_ENTRIES", "2000"))
+QUERY_STATS_FLUSH_SECONDS = float(os.getenv("QUERY_STATS_FLUSH_SECONDS", "60"))
+# 每个指纹保留最近若干次耗时用于估算 p95。
+QUERY_STATS_LATENCY_SAMPLES = int(os.getenv("QUERY_STATS_LATENCY_SAMPLES", "256"))
+
+_SORT_KEYS = {"total_time": "total_ms", "calls": "calls", "mean_time": "mean_ms", "p95_time": "p95_ms", "rows": "rows"}
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(percentile * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QueryStatsStore:
+    def __init__(
+        self,
+        path: str = QUERY_STATS_PATH,
+        max_entries: int = QUERY_STATS_MAX_ENTRIES,
+        latency_samples: int = QUERY_STATS_LATENCY_SAMPLES,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.latency_samples = latency_samples
+        # 本进程上次落盘以来的增量，落盘时合并进共享文件后清空。
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._file_entries = 0
+
+    def _entry(self, fingerprint: Dict[str, str]) -> Dict[str, Any]:
+        entry = self._entries.get(fingerprint["id"])
+        if entry is None:
+            if len(self._entries) >= self.max_entries:
+                self._evict()
+            entry = self._new_entry(fingerprint["id"], fingerprint["text"])
+            self._entries[fingerprint["id"]] = entry
+        entry["last_seen"] = time.time()
+        return entry
+
+    def _new_entry(self, fingerprint_id: str, query: str) -> Dict[str, Any]:
+        return {
+            "fingerprint_id": fingerprint_id,
+            "query": query,
+            "calls": 0,
+            "errors": 0,
+            "total_ms": 0.0,
+            "min_ms": None,
+            "max_ms": 0.0,
+            "rows": 0,
+            "generated": 0,
+            "cache_hits": 0,
+            "samples": deque(maxlen=self.latency_samples),
+            "first_seen": time.time(),
+            "last_seen": time.time(),
+        }
+
+    def _evict(self, entries: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        """与 pg_stat_statements 一样淘汰使用最少的条目，一次腾出约 5% 的空间。"""
+        entries = self._entries if entries is None else entries
+        count = max(1, self.max_entries // 20)
+        victims = sorted(entries.values(), key=lambda entry: (entry["calls"] + entry["generated"], entry["last_seen"]))[:count]
+        for victim in victims:
+            del entries[victim["fingerprint_id"]]
+        self._evictions += len(victims)
+
+    def _merge(self, entries: Dict[str, Dict[str, Any]], delta: Dict[str, Any]) -> None:
+        """把一个增量条目累加到 entries 中的同指纹条目上。"""
+        entry = entries.get(delta["fingerprint_id"])
+        if entry is None:
+            entry = self._new_entry(delta["fingerprint_id"], delta["query"])
+            entry["first_seen"] = delta["first_seen"]
+            entries[delta["fingerprint_id"]] = entry
+        for key in ("calls", "errors", "total_ms", "rows", "generated", "cache_hits"):
+            entry[key] += delta[key]
+        if delta["min_ms"] is not None:
+            entry["min_ms"] = delta["min_ms"] if entry["min_ms"] is None else min(entry["min_ms"], delta["min_ms"])
+        entry["max_ms"] = max(entry["max_ms"], delta["max_ms"])
+        entry["samples"].extend(delta["samples"])
+        entry["first_seen"] = min(entry["first_seen"], delta["first_seen"])
+        entry["last_seen"] = max(entry["last_seen"], delta["last_seen"])
+
+    def record_execution(
+        self, sql: str, elapsed_ms: float, rows: int = 0, error: bool = False, fingerprint: Optional[Dict[str, str]] = None
+    ) -> None:
+        """记录一次执行；fingerprint 为调用方已算好的 fingerprint_sql 结果，省去再解析一次。"""
+        # 解析 SQL 在锁外做，不让一次解析挡住其他线程的记录。
+        fingerprint = fingerprint or fingerprint_sql(sql)
+        with self._lock:
+            entry = self._entry(fingerprint)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["total_ms"] += elapsed_ms
+            entry["min_ms"] = elapsed_ms if entry["min_ms"] is None else min(entry["min_ms"], elapsed_ms)
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["rows"] += rows
+            entry["samples"].append(elapsed_ms)
+
+    def record_generation(self, sql: str, cache_hit: bool) -> None:
+        """NL2SQL 产出该形状 SQL 一次；cache_hit 表示来自答案缓存而非重新生成。需要解析 SQL，异步代码里放到线程池调用。"""
+        fingerprint = fingerprint_sql(sql)
+        with self._lock:
+            entry = self._entry(fingerprint)
+            entry["generated"] += 1
+            entry["cache_hits"] += int(cache_hit)
+
+    @staticmethod
+    def _summarize(entry: Dict[str, Any]) -> Dict[str, Any]:
+        calls = entry["calls"]
+        return {
+            "fingerprint_id": entry["fingerprint_id"],
+            "query": entry["query"],
+            "calls": calls,
+            "errors": entry["errors"],
+            "total_ms": round(entry["total_ms"], 2),
+            "mean_ms": round(entry["total_ms"] / calls, 2) if calls else 0.0,
+            "min_ms": round(entry["min_ms"] or 0.0, 2),
+            "max_ms": round(entry["max_ms"], 2),
+            "p95_ms": round(_percentile(list(entry["samples"]), 0.95), 2),
+            "rows": entry["rows"],
+            "mean_rows": round(entry["rows"] / calls, 2) if calls else 0.0,
+            "generated": entry["generated"],
+            "cache_hits": entry["cache_hits"],
+            "cache_hit_ratio": round(entry["cache_hits"] / entry["generated"], 4) if entry["generated"] else None,
+            "first_seen": entry["first_seen"],
+            "last_seen": entry["last_seen"],
+        }
+
+    def top(self, limit: int = 20, order_by: str = "total_time") -> List[Dict[str, Any]]:
+        """共享文件中的累计值叠加本进程尚未落盘的增量。"""
+        sort_key = _SORT_KEYS.get(order_by, "total_ms")
+        entries = self._read_file()
+        with self._lock:
+            for delta in self._entries.values():
+                self._merge(entries, delta)
+        summaries = [self._summarize(entry) for entry in entries.values()]
+        summaries.sort(key=lambda item: item[sort_key], reverse=True)
+        return summaries[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": self._file_entries,
+                "pending": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self._evictions,
+            }
+
+    def reset(self) -> None:
+        """清空本进程的增量和共享文件；其他 worker 未落盘的增量之后仍会写入。"""
+        with self._lock:
+            self._entries.clear()
+        with self._file_lock():
+            self._write_file({})
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        with open(f"{self.path}.lock", "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _read_file(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as handle:
+                payload = json.load(handle)
+        except (OSError, ValueError) as exc:
+            logger.warning("读取查询统计文件失败，忽略：%s", exc)
+            return {}
+        entries = {}
+        for item in payload.get("entries", []):
+            item["samples"] = deque(item.get("samples", []), maxlen=self.latency_samples)
+            entries[item["fingerprint_id"]] = item
+        self._file_entries = len(entries)
+        return entries
+
+    def _write_file(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        # 临时文件按进程区分，多个 worker 同时落盘也不会写进同一个临时文件。
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        payload = [{**entry, "samples": list(entry["samples"])} for entry in entries.values()]
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump({"saved_at": time.time(), "entries": payload}, handle, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._file_entries = len(entries)
+
+    def flush(self) -> bool:
+        """把本进程的增量合并进共享文件（文件锁内读-合并-原子替换），返回是否写入；失败时增量留到下次。"""
+        with self._lock:
+            if not self._entries:
+                return False
+            pending, self._entries = self._entries, {}
+
+        try:
+            with self._file_lock():
+                entries = self._read_file()
+                for delta in pending.values():
+                    self._merge(entries, delta)
+                while len(entries) > self.max_entries:
+                    self._evict(entries)
+                self._write_file(entries)
+        except OSError as exc:
+            logger.warning("写入查询统计文件失败：%s", exc)
+            with self._lock:
+                for delta in pending.values():
+                    self._merge(self._entries, delta)
+            return False
+        return True
+
+
+_query_stats: Optional[QueryStatsStore] = None
+
+
+def get_query_stats() -> QueryStatsStore:
+    global _query_stats
+    if _query_stats is None:
+        _query_stats = QueryStatsStore()
+    return _query_stats
+
+
+async def run_query_stats_flusher(interval: float = QUERY_STATS_FLUSH_SECONDS) -> None:
+    """后台定期落盘，取消时（应用退出）再落盘一次。"""
+    store = get_query_stats()
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(store.flush)
+    finally:
+        store.flush()
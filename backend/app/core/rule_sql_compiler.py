@@ -0,0 +1,235 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_AGGREGATIONS = {"sum", "avg", "count", "max", "min"}
+
+# 问题中除已识别的指标/时间/实体/术语外，允许残留的无业务含义的字词。
+_FILLER_WORDS = [
+    "请问", "帮我", "查一下", "查询", "统计", "计算", "看看", "一下",
+    "是多少", "有多少", "多少", "合计", "汇总", "以及", "和", "与", "及", "的", "是", "请",
+]
+_ENTITY_MARKERS = {
+    "employee_id": ["员工号", "工号", "员工"],
+}
+_DIMENSION_PINNED_BY = {
+    "员工": lambda intent: any(entity.get("type") == "employee_id" for entity in intent.get("entities", [])),
+    "月份": lambda intent: (intent.get("time_range") or {}).get("grain") == "month",
+}
+_SAFE_LITERAL = re.compile(r"^[A-Za-z0-9_\-\u4e00-\u9fff]+$")
+_STRING_TYPES = ("CHAR", "TEXT", "STRING", "UUID")
+
+
+def _rule_terms(rule: Dict[str, Any]) -> List[str]:
+    return [term for term in [rule.get("name", ""), *rule.get("aliases", [])] if term]
+
+
+def _mentioned_terms(user_question: str, rule: Dict[str, Any]) -> List[str]:
+    return [term for term in _rule_terms(rule) if term in user_question]
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _column_types(table: Dict[str, Any]) -> Dict[str, str]:
+    return {str(col.get("name", "")).lower(): str(col.get("type") or "").upper() for col in table.get("columns", [])}
+
+
+def _format_value(value: str, column_type: str) -> str:
+    if any(marker in column_type for marker in _STRING_TYPES) or not value.isdigit():
+        return _quote_literal(value)
+    return value
+
+
+def _resolve_metrics(user_question: str, parsed_intent: Dict[str, Any], metric_rules: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    metric_terms = [term for term in parsed_intent.get("metrics", []) if term]
+    if not metric_terms:
+        return None
+
+    resolved: List[Dict[str, Any]] = []
+    for term in metric_terms:
+        rule = next((item for item in metric_rules if term in _rule_terms(item)), None)
+        if rule is None or not _mentioned_terms(user_question, rule):
+            return None
+        if not all(rule.get(key) for key in ["source_table", "code_field", "code_value", "value_field"]):
+            return None
+        if rule not in resolved:
+            resolved.append(rule)
+
+    source_tables = {rule["source_table"] for rule in resolved}
+    code_fields = {rule["code_field"] for rule in resolved}
+    if len(source_tables) != 1 or len(code_fields) != 1:
+        return None
+    return resolved
+
+
+def _resolve_aggregation(parsed_intent: Dict[str, Any], metric_rules: List[Dict[str, Any]]) -> Optional[str]:
+    defaults = {(rule.get("default_aggregation") or "sum").lower() for rule in metric_rules}
+    if len(defaults) != 1:
+        return None
+    aggregation = defaults.pop()
+    requested = (parsed_intent.get("aggregation") or aggregation).lower()
+    if aggregation not in SUPPORTED_AGGREGATIONS or requested != aggregation:
+        return None
+    return aggregation
+
+
+def _resolve_time_filter(parsed_intent: Dict[str, Any], time_rules: List[Dict[str, Any]], column_types: Dict[str, str]) -> Optional[str]:
+    time_range = parsed_intent.get("time_range") or {}
+    if not time_range:
+        return ""
+
+    grain = time_range.get("grain")
+    value = str(time_range.get("normalized_value", ""))
+    rule = next((item for item in time_rules if item.get("grain") == grain and item.get("time_field")), None)
+    if rule is None or rule.get("storage_format") != "YYYYMM":
+        return None
+
+    time_field = rule["time_field"]
+    column_type = column_types.get(time_field.lower())
+    if column_type is None:
+        return None
+
+    if grain == "month" and re.fullmatch(r"\d{6}", value):
+        return f"{time_field} = {_format_value(value, column_type)}"
+    if grain == "year" and re.fullmatch(r"\d{4}", value):
+        start = _format_value(f"{value}01", column_type)
+        end = _format_value(f"{value}12", column_type)
+        return f"{time_field} BETWEEN {start} AND {end}"
+    return None
+
+
+def _resolve_entity_column(source_table: str, field_hint: str, join_rules: List[Dict[str, Any]], column_types: Dict[str, str]) -> Optional[str]:
+    """把实体字段提示映射到来源表上的过滤字段，必要时借助 join_keys 换算。"""
+    if field_hint.lower() in column_types:
+        return field_hint
+
+    for rule in join_rules:
+        for join_key in rule.get("join_keys", []):
+            sides = [side.strip() for side in join_key.split("=")]
+            if len(sides) != 2 or not all("." in side for side in sides):
+                continue
+            (left_table, left_col), (right_table, right_col) = (side.split(".", 1) for side in sides)
+            if left_table == source_table and right_col == field_hint:
+                return left_col
+            if right_table == source_table and left_col == field_hint:
+                return right_col
+    return None
+
+
+def _resolve_entity_filters(
+    user_question: str,
+    parsed_intent: Dict[str, Any],
+    source_table: str,
+    join_rules: List[Dict[str, Any]],
+    column_types: Dict[str, str],
+) -> Optional[List[str]]:
+    filters = []
+    for entity in parsed_intent.get("entities", []):
+        value = str(entity.get("value", "")).strip()
+        field_hint = entity.get("field_hint") or ""
+        if not value or value not in user_question or not _SAFE_LITERAL.match(value) or not field_hint:
+            return None
+
+        column = _resolve_entity_column(source_table, field_hint, join_rules, column_types)
+        if column is None or column.lower() not in column_types:
+            return None
+        filters.append(f"{column} = {_format_value(value, column_types[column.lower()])}")
+    return filters
+
+
+def _has_uncovered_text(user_question: str, parsed_intent: Dict[str, Any], consumed_terms: List[str]) -> bool:
+    """剔除已识别片段后若仍有实义内容，说明问题没有被规则完整覆盖。"""
+    residual = user_question
+    time_range = parsed_intent.get("time_range") or {}
+    tokens = list(consumed_terms)
+    if time_range.get("raw_text"):
+        tokens.append(time_range["raw_text"])
+    for entity in parsed_intent.get("entities", []):
+        tokens.extend(_ENTITY_MARKERS.get(entity.get("type"), []))
+        tokens.append(str(entity.get("value", "")))
+
+    for token in sorted({token for token in tokens if token}, key=len, reverse=True):
+        residual = residual.replace(token, " ")
+    for word in _FILLER_WORDS:
+        residual = residual.replace(word, " ")
+
+    residual = re.sub(r"[\s,，。.?？!！:：]+", "", residual)
+    return bool(residual)
+
+
+def compile_sql_from_rules(
+    user_question: str,
+    parsed_intent: Dict[str, Any],
+    rules: Dict[str, List[Dict[str, Any]]],
+    full_schema: Dict[str, Dict[str, Any]],
+) -> Optional[Dict[str, Any]]:
+    """
+    当解析意图完全被知识库规则覆盖时，直接拼出确定性的 SQL。
+    任何一项无法确定都返回 None，由调用方回退到 LLM 生成。
+    """
+    if parsed_intent.get("needs_clarification") or parsed_intent.get("query_type") != "aggregate":
+        return None
+
+    metric_rules = _resolve_metrics(user_question, parsed_intent, rules.get("metric_rules", []))
+    if not metric_rules:
+        return None
+
+    for term_rule in rules.get("business_term_rules", []):
+        if (term_rule.get("sql_hint") or term_rule.get("logic_steps")) and _mentioned_terms(user_question, term_rule):
+            return None
+
+    for dimension in parsed_intent.get("dimensions", []):
+        pinned = _DIMENSION_PINNED_BY.get(dimension)
+        if pinned is None or not pinned(parsed_intent):
+            return None
+
+    source_table = metric_rules[0]["source_table"]
+    table = full_schema.get(source_table)
+    if not table:
+        return None
+    column_types = _column_types(table)
+
+    code_field = metric_rules[0]["code_field"]
+    value_fields = {rule["value_field"] for rule in metric_rules}
+    if any(column.lower() not in column_types for column in [code_field, *value_fields]):
+        return None
+
+    aggregation = _resolve_aggregation(parsed_intent, metric_rules)
+    time_filter = _resolve_time_filter(parsed_intent, rules.get("time_rules", []), column_types)
+    entity_filters = _resolve_entity_filters(user_question, parsed_intent, source_table, rules.get("join_rules", []), column_types)
+    if aggregation is None or time_filter is None or entity_filters is None:
+        return None
+
+    consumed_terms = [term for rule in metric_rules for term in _mentioned_terms(user_question, rule)]
+    consumed_terms += [term for rule in rules.get("business_term_rules", []) for term in _mentioned_terms(user_question, rule)]
+    if _has_uncovered_text(user_question, parsed_intent, consumed_terms):
+        return None
+
+    code_type = column_types[code_field.lower()]
+    if len(metric_rules) == 1:
+        rule = metric_rules[0]
+        select_items = [f'{aggregation.upper()}({rule["value_field"]}) AS "{rule["name"]}"']
+        conditions = [f"{code_field} = {_format_value(rule['code_value'], code_type)}"]
+    else:
+        select_items = [
+            f'{aggregation.upper()}({rule["value_field"]}) FILTER (WHERE {code_field} = {_format_value(rule["code_value"], code_type)}) AS "{rule["name"]}"'
+            for rule in metric_rules
+        ]
+        code_values = ", ".join(_format_value(rule["code_value"], code_type) for rule in metric_rules)
+        conditions = [f"{code_field} IN ({code_values})"]
+
+    if time_filter:
+        conditions.append(time_filter)
+    conditions.extend(entity_filters)
+
+    sql = "SELECT " + ", ".join(select_items) + f"\nFROM {source_table}\nWHERE " + "\n  AND ".join(conditions)
+    logger.info("规则编译 SQL 成功，跳过 LLM 生成：%r", sql[:80])
+    return {
+        "sql": sql,
+        "tables": [table],
+        "metric_rules": metric_rules,
+    }
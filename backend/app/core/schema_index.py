@@ -1,44 +1,126 @@
 # app/core/schema_index.py
 
 """
-RAG 检索模块（使用 text2vec + FAISS）
+RAG 检索模块（Embedding 后端 + FAISS）
+
+Embedding 模型由可插拔后端提供（EMBEDDING_BACKEND，见 app.core.embedding_backends）。
+faiss 与模型后端（text2vec 会连带导入 torch）导入耗时以秒计，只在首次建索引或编码时导入，
+进程启动时不加载；服务启动后由后台预热触发（见 app.core.warmup）。
+
+配置 EMBEDDING_SIDECAR_SOCKET 时，本进程不加载模型和向量索引，编码与检索都交给
+同机的 embedding sidecar（见 app.core.embedding_sidecar），多个 uvicorn worker 共用一份；
+sidecar 不可用时检索退化为关键词匹配。
+
+表元数据与向量索引按数据目录（见 app.core.catalogs）各自构建，Embedding 模型所有目录共用。
+数据快照切换（见 app.core.db_snapshots）后，表结构未变只记下新快照号；表结构变了则立即换上新表元数据，
+向量索引在后台重建，期间检索走关键词匹配。
 """
 
+import importlib
 import logging
+import os
 import re
-from typing import Any, Dict, List
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-try:
-    import faiss
-except ImportError:  # pragma: no cover - 运行环境缺依赖时走降级逻辑
-    faiss = None
+from app.core.catalogs import current_catalog
+from app.core.embedding_backends import EmbeddingBackend, create_embedding_backend
+from app.core.db_snapshots import current_snapshot
+from app.core.schema_service import get_schema_snapshot, get_schema_version
 
-try:
-    from text2vec import SentenceModel
-except ImportError:  # pragma: no cover - 运行环境缺依赖时走降级逻辑
-    SentenceModel = None
+logger = logging.getLogger(__name__)
 
-from app.core.schema_service import get_full_schema
+EMBEDDING_SIDECAR_SOCKET = os.getenv("EMBEDDING_SIDECAR_SOCKET", "")
+
+_embedding_backend: Optional[EmbeddingBackend] = None
+_embedding_model: Optional[EmbeddingBackend] = None
+_optional_modules: Dict[str, Any] = {}
+_import_lock = threading.Lock()
+_model_lock = threading.Lock()
+
+
+def _optional_import(name: str) -> Any:
+    """按需导入可选依赖，结果（包括导入失败的 None）只计算一次。"""
+    if name not in _optional_modules:
+        with _import_lock:
+            if name not in _optional_modules:
+                try:
+                    _optional_modules[name] = importlib.import_module(name)
+                except ImportError:  # pragma: no cover - 运行环境缺依赖时走降级逻辑
+                    _optional_modules[name] = None
+    return _optional_modules[name]
+
+
+def _get_embedding_backend() -> EmbeddingBackend:
+    global _embedding_backend
+    if _embedding_backend is None:
+        _embedding_backend = create_embedding_backend()
+    return _embedding_backend
+
+
+def _vector_search_available() -> bool:
+    return _optional_import("faiss") is not None and _get_embedding_backend().available()
 
-logger = logging.getLogger(__name__)
 
-_faiss_index = None
-_id_to_table_meta: List[Dict[str, Any]] = []
-_embedding_model: SentenceModel = None
+def _sidecar_client() -> Any:
+    if not EMBEDDING_SIDECAR_SOCKET:
+        return None
+    from app.core.embedding_sidecar import get_sidecar_client
 
+    return get_sidecar_client(EMBEDDING_SIDECAR_SOCKET)
 
-def _get_embedding_model() -> SentenceModel:
-    if SentenceModel is None:
-        raise RuntimeError("text2vec is not installed")
+
+def _get_embedding_model(wait: bool = True) -> Optional[EmbeddingBackend]:
+    """wait=False 时，若另一线程正在加载模型则直接返回 None，不等待。"""
+    backend = _get_embedding_backend()
+    if not backend.available():
+        raise RuntimeError(f"Embedding 后端 {backend.name} 不可用")
 
     global _embedding_model
     if _embedding_model is None:
-        logger.info("正在加载 text2vec 本地 Embedding 模型 ...")
-        _embedding_model = SentenceModel("BAAI/bge-large-zh")
-        logger.info("Embedding 模型加载完成。")
+        if not _model_lock.acquire(blocking=wait):
+            return None
+        try:
+            if _embedding_model is None:
+                logger.info("正在加载本地 Embedding 模型 %s ...", backend.describe())
+                backend.load()
+                _embedding_model = backend
+                logger.info("Embedding 模型加载完成。")
+        finally:
+            _model_lock.release()
     return _embedding_model
 
 
+def _normalize(embeddings: Any) -> Any:
+    norms = (embeddings ** 2).sum(axis=1, keepdims=True) ** 0.5
+    norms[norms == 0] = 1
+    return (embeddings / norms).astype("float32", copy=False)
+
+
+def encode_texts(texts: Sequence[str]) -> Optional[Any]:
+    """
+    用 schema 检索同一个 Embedding 模型编码文本，返回 L2 归一化后的向量矩阵；
+    模型不可用或正在后台加载时返回 None，调用方应退化为非向量逻辑。
+    """
+    if not texts:
+        return None
+    client = _sidecar_client()
+    if client is not None:
+        return client.encode(texts)
+    return encode_texts_local(texts)
+
+
+def encode_texts_local(texts: Sequence[str]) -> Optional[Any]:
+    """在本进程内编码；sidecar 进程直接调用它。"""
+    if not texts or not _get_embedding_backend().available():
+        return None
+
+    model = _get_embedding_model(wait=False)
+    if model is None:
+        return None
+    return _normalize(model.encode(list(texts)))
+
+
 def _parse_table_key(raw_name: str) -> Dict[str, str]:
     """
     兼容 schema 接口中 `table_name:xxx;comment:yyy` 的历史格式。
@@ -88,79 +170,200 @@ def _table_meta_to_text(table_meta: Dict[str, Any]) -> str:
     return f"表 {table} ({table_comment}): {columns_text}"
 
 
+class _SchemaIndexState:
+    """一个数据目录的 schema 索引：表元数据、向量索引及其对应的数据快照号与 schema 版本。"""
+
+    def __init__(self) -> None:
+        self.faiss_index = None
+        self.table_metas: List[Dict[str, Any]] = []
+        self.snapshot_id: Optional[str] = None
+        self.schema_version: Optional[str] = None
+        # 向量索引与表元数据总是成对替换，检索时在锁内一起取出，避免拿到旧索引配新表元数据。
+        self.swap_lock = threading.Lock()
+        self.init_lock = threading.Lock()
+        # 表元数据发布后置位；此后检索不再等待向量索引构建完成。
+        self.tables_published = threading.Event()
+
+    def current(self) -> Tuple[Any, List[Dict[str, Any]]]:
+        with self.swap_lock:
+            return self.faiss_index, self.table_metas
+
+
+def _index_state() -> _SchemaIndexState:
+    """当前数据目录的 schema 索引状态；Embedding 模型在各目录间共用，索引各自构建。"""
+    return current_catalog().get_state("schema_index", _SchemaIndexState)
+
+
 def init_schema_index() -> None:
-    global _faiss_index, _id_to_table_meta
+    state = _index_state()
+    if state.faiss_index is not None or state.table_metas:
+        return
+    with state.init_lock:
+        try:
+            _init_schema_index_locked(state)
+        finally:
+            state.tables_published.set()
 
-    if _faiss_index is not None or _id_to_table_meta:
+
+def _ensure_tables(state: _SchemaIndexState) -> None:
+    """检索前保证表元数据可用：另一线程（如启动预热）正在初始化时只等到表元数据发布，不等模型加载。"""
+    if state.table_metas or state.faiss_index is not None:
+        _refresh_on_snapshot_change(state)
         return
+    if state.init_lock.acquire(blocking=False):
+        try:
+            _init_schema_index_locked(state)
+        finally:
+            state.tables_published.set()
+            state.init_lock.release()
+    else:
+        state.tables_published.wait()
+
+
+def _publish_tables(state: _SchemaIndexState, snapshot: Any) -> List[Dict[str, Any]]:
+    tables = _normalize_full_schema(get_schema_snapshot(snapshot))
+    with state.swap_lock:
+        state.faiss_index, state.table_metas = None, tables
+    state.snapshot_id, state.schema_version = snapshot.id, get_schema_version(snapshot)
+    return tables
 
-    logger.info("[RAG] 开始初始化 schema 索引 ...")
-    full_schema = get_full_schema()
-    tables = _normalize_full_schema(full_schema)
 
-    if not tables:
-        logger.warning("[RAG] 没有数据表。")
+def _init_schema_index_locked(state: _SchemaIndexState) -> None:
+    if state.faiss_index is not None or state.table_metas:
         return
 
-    texts = [_table_meta_to_text(t) for t in tables]
-    _id_to_table_meta = tables
+    catalog = current_catalog().name
+    logger.info("[RAG] 开始初始化 schema 索引（目录 %s）...", catalog)
+    # 先发布表元数据：模型加载、向量索引构建期间到达的请求走关键词匹配，不必等待。
+    tables = _publish_tables(state, current_snapshot())
+    state.tables_published.set()
 
-    if faiss is None or SentenceModel is None:
-        logger.warning("[RAG] faiss/text2vec 不可用，schema 检索退化为关键词匹配。")
+    if not tables:
+        logger.warning("[RAG] 目录 %s 没有数据表。", catalog)
+        return
+    if EMBEDDING_SIDECAR_SOCKET:
+        logger.info("[RAG] 向量检索由 embedding sidecar（%s）提供，本进程只保留表元数据。", EMBEDDING_SIDECAR_SOCKET)
+        return
+    if not _vector_search_available():
+        logger.warning("[RAG] faiss 或 Embedding 后端 %s 不可用，schema 检索退化为关键词匹配。", _get_embedding_backend().name)
         return
+    _build_vector_index(state, tables)
 
+
+def _build_vector_index(state: _SchemaIndexState, tables: List[Dict[str, Any]]) -> None:
     model = _get_embedding_model()
-    embeddings = model.encode(texts)
+    embeddings = _normalize(model.encode([_table_meta_to_text(t) for t in tables]))
 
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)  # 内积 = cosine 相似度（向量已归一化）
+    index = _optional_import("faiss").IndexFlatIP(dim)  # 内积 = cosine 相似度（向量已归一化）
     index.add(embeddings)
 
-    _faiss_index = index
-    logger.info("[RAG] schema 索引初始化完成，共 %d 张表。", len(_id_to_table_meta))
+    with state.swap_lock:
+        if state.table_metas is not tables:
+            logger.info("[RAG] 构建期间数据快照再次切换，丢弃本次 schema 索引。")
+            return
+        state.faiss_index = index
+    logger.info("[RAG] schema 索引初始化完成，共 %d 张表。", len(tables))
 
 
-def get_relevant_tables(query: str, top_k: int = 10):
-    """基于用户问题做 RAG 检索。"""
+def _refresh_on_snapshot_change(state: _SchemaIndexState) -> None:
+    """数据快照切换后：表结构未变只记下新快照号；变了则换上新表元数据并在后台重建向量索引。"""
+    try:
+        snapshot = current_snapshot()
+    except OSError:
+        return
+    if state.snapshot_id is None or snapshot.id == state.snapshot_id:
+        return
+    # 另一线程正在初始化或切换时不等待，本次沿用当前索引。
+    if not state.init_lock.acquire(blocking=False):
+        return
+    try:
+        if snapshot.id == state.snapshot_id:
+            return
+        if get_schema_version(snapshot) == state.schema_version:
+            logger.info("[RAG] 数据快照切换为 %s，表结构未变，沿用 schema 索引。", snapshot.id)
+            state.snapshot_id = snapshot.id
+            return
+        logger.info("[RAG] 数据快照切换为 %s，表结构已变化，重建 schema 索引。", snapshot.id)
+        tables = _publish_tables(state, snapshot)
+    finally:
+        state.init_lock.release()
+
+    if tables and not EMBEDDING_SIDECAR_SOCKET and _vector_search_available():
+        threading.Thread(target=_build_vector_index, args=(state, tables), name="schema-index-rebuild", daemon=True).start()
+
+
+def get_relevant_tables(query: str, top_k: int = 10, query_embedding: Optional[Any] = None):
+    """基于用户问题做 RAG 检索。已有问题向量时可通过 query_embedding 传入，避免重复编码。"""
     if not query.strip():
         return []
 
-    if _faiss_index is None and not _id_to_table_meta:
-        init_schema_index()
-    if not _id_to_table_meta:
+    state = _index_state()
+    _ensure_tables(state)
+    index, table_metas = state.current()
+    if not table_metas:
         return []
 
-    if _faiss_index is None:
-        scored = []
-        lowered_query = query.lower()
-        for table_meta in _id_to_table_meta:
-            corpus = _table_meta_to_text(table_meta).lower()
-            score = 0
-            if table_meta["table_name"].lower() in lowered_query:
-                score += 100
-            for char in set(lowered_query):
-                if char.strip() and char in corpus:
-                    score += 1
-            if score > 0:
-                scored.append((score, table_meta))
-        scored.sort(key=lambda item: item[0], reverse=True)
-        results = [{**table_meta, "score": float(score)} for score, table_meta in scored[:top_k]]
-        logger.info("[RAG] query='%s' → 表: %s（关键词降级）", query, [r["table_name"] for r in results])
+    client = _sidecar_client()
+    if client is not None:
+        hits = client.search(query, top_k, query_embedding, catalog=current_catalog().name)
+        if hits is not None:
+            by_name = {table_meta["table_name"]: table_meta for table_meta in table_metas}
+            results = [{**by_name[name], "score": score} for name, score in hits if name in by_name]
+            logger.info("[RAG] query='%s' → 表: %s（sidecar）", query, [r["table_name"] for r in results])
+            return results
+    elif index is not None:
+        q = query_embedding.reshape(1, -1) if query_embedding is not None else _normalize(_get_embedding_model().encode([query]))
+        results = [{**table_meta, "score": score} for table_meta, score in _search(index, table_metas, q, top_k)[0]]
+        logger.info("[RAG] query='%s' → 表: %s", query, [r["table_name"] for r in results])
         return results
 
-    model = _get_embedding_model()
-    q = model.encode([query])
-    scores, indices = _faiss_index.search(q, top_k)
+    scored = []
+    lowered_query = query.lower()
+    for table_meta in table_metas:
+        corpus = _table_meta_to_text(table_meta).lower()
+        score = 0
+        if table_meta["table_name"].lower() in lowered_query:
+            score += 100
+        for char in set(lowered_query):
+            if char.strip() and char in corpus:
+                score += 1
+        if score > 0:
+            scored.append((score, table_meta))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    results = [{**table_meta, "score": float(score)} for score, table_meta in scored[:top_k]]
+    logger.info("[RAG] query='%s' → 表: %s（关键词降级）", query, [r["table_name"] for r in results])
+    return results
 
-    results = []
-    for idx, score in zip(indices[0], scores[0]):
-        if idx == -1:
-            continue
-        table_meta = _id_to_table_meta[idx]
-        results.append({**table_meta, "score": float(score)})
 
-    logger.info("[RAG] query='%s' → 表: %s", query, [r["table_name"] for r in results])
-    return results
+def _search(index: Any, table_metas: List[Dict[str, Any]], query_embeddings: Any, top_k: int) -> List[List[Tuple[Dict[str, Any], float]]]:
+    scores, indices = index.search(query_embeddings, top_k)
+    return [
+        [(table_metas[idx], float(score)) for idx, score in zip(row_indices, row_scores) if idx != -1]
+        for row_indices, row_scores in zip(indices, scores)
+    ]
+
+
+def search_local(query_embeddings: Any, top_k: int) -> Optional[List[List[Tuple[Dict[str, Any], float]]]]:
+    """
+    在本进程当前数据目录的向量索引上批量检索，每个查询返回 [(表元数据, 分数)]；
+    索引缺失或正在重建时返回 None，与“检索了但没有命中”区分开，调用方据此退化为关键词匹配。
+    """
+    state = _index_state()
+    _ensure_tables(state)
+    index, table_metas = state.current()
+    if index is None:
+        return None
+    return _search(index, table_metas, query_embeddings, top_k)
+
+
+def get_schema_index_stats() -> Dict[str, int]:
+    """当前数据目录 schema 索引的规模；未构建时不触发构建。"""
+    state = current_catalog().state.get("schema_index")
+    if state is None:
+        return {"tables": 0, "vector_index": 0}
+    index, table_metas = state.current()
+    return {"tables": len(table_metas), "vector_index": int(index is not None)}
 
 
 def format_tables_for_prompt(tables: List[Dict[str, Any]]) -> str:
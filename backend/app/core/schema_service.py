@@ -1,22 +1,17 @@
+import hashlib
+import json
 import logging
-import os
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-try:
-    import duckdb
-except ImportError:  # pragma: no cover - 运行环境缺依赖时仅在调用时失败
-    duckdb = None
+from app.core.catalogs import current_catalog
+from app.core.db_snapshots import Snapshot, connect_read_only, current_snapshot
 
 logger = logging.getLogger(__name__)
 
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DB_PATH = os.path.join(BASE_DIR, "app", "example.duckdb")
 
-
-def _connect_db() -> Any:
-    if duckdb is None:
-        raise RuntimeError("duckdb is not installed")
-    return duckdb.connect(DB_PATH, read_only=True)
+def _connect_db(db_path: Optional[str] = None) -> Any:
+    return connect_read_only(db_path)
 
 
 def get_tables() -> List[str]:
@@ -47,9 +42,60 @@ def get_table_comment(table_name: str) -> str:
     return result[0] if result else ""
 
 
-def get_full_schema() -> Dict:
-    tables = get_tables()
+def get_full_schema(db_path: Optional[str] = None) -> Dict:
+    """一个连接、三条元数据查询取回全部表结构；逐表查询在表多时要建几百上千次连接，拖慢冷启动。"""
+    with _connect_db(db_path) as conn:
+        tables = [row[0] for row in conn.execute("SHOW TABLES;").fetchall()]
+        comments = dict(conn.execute("SELECT table_name, comment FROM duckdb_tables;").fetchall())
+        result = conn.execute(
+            """
+            SELECT table_name, column_name AS name, data_type AS type, comment AS comment, column_index AS cid
+            FROM duckdb_columns
+            ORDER BY table_name, column_index;
+            """
+        )
+        rows = result.fetchall()
+        columns = [col[0] for col in result.description][1:]
+    logger.info("检测到数据表：%s", tables)
+
+    table_columns: Dict[str, List[Dict]] = {table: [] for table in tables}
+    for row in rows:
+        if row[0] in table_columns:
+            table_columns[row[0]].append(dict(zip(columns, row[1:])))
     return {
-        f"table_name:{table};comment:{get_table_comment(table)}": get_table_schema(table)
+        f"table_name:{table};comment:{comments[table] if table in comments else ''}": table_columns[table]
         for table in tables
     }
+
+
+def _create_schema_caches() -> Tuple[Callable[[str, str], Dict], Callable[[str, str], str]]:
+    @lru_cache(maxsize=2)
+    def snapshot_for(db_path: str, snapshot_id: str) -> Dict:
+        return get_full_schema(db_path)
+
+    @lru_cache(maxsize=2)
+    def version_for(db_path: str, snapshot_id: str) -> str:
+        payload = json.dumps(snapshot_for(db_path, snapshot_id), sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    return snapshot_for, version_for
+
+
+def _schema_caches() -> Tuple[Callable[[str, str], Dict], Callable[[str, str], str]]:
+    """当前数据目录的 schema 缓存，以 (库文件, 快照号) 为键，保留最近两个快照（切换期间新旧请求并存）。"""
+    return current_catalog().get_state("schema", _create_schema_caches)
+
+
+def get_schema_snapshot(snapshot: Optional[Snapshot] = None) -> Dict:
+    """
+    与 get_full_schema 结构相同，但数据快照未切换时复用上次读取的结果，避免每个请求逐表查询元数据。
+    返回的字典在多个请求间共享，调用方不能修改。
+    """
+    snapshot = snapshot or current_snapshot()
+    return _schema_caches()[0](snapshot.path, snapshot.id)
+
+
+def get_schema_version(snapshot: Optional[Snapshot] = None) -> str:
+    """schema 版本号：数据快照未切换时直接复用上次计算的 schema 摘要；只换数据不改表结构时版本号不变。"""
+    snapshot = snapshot or current_snapshot()
+    return _schema_caches()[1](snapshot.path, snapshot.id)
@@ -0,0 +1,73 @@
+"""
+NL2SQL 会话状态。
+
+每个会话保存上一轮的解析意图、命中的规则名称、SQL 引用的表和 SQL 本身，追问时只计算变化部分。
+会话超过 NL2SQL_SESSION_TTL_SECONDS 未访问即过期；数量超过 NL2SQL_SESSION_MAX_ENTRIES 时淘汰最久未使用的会话。
+"""
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.catalogs import current_catalog
+
+NL2SQL_SESSION_TTL_SECONDS = float(os.getenv("NL2SQL_SESSION_TTL_SECONDS", "1800"))
+NL2SQL_SESSION_MAX_ENTRIES = int(os.getenv("NL2SQL_SESSION_MAX_ENTRIES", "1000"))
+
+
+class SessionStore:
+    def __init__(self, ttl_seconds: float = NL2SQL_SESSION_TTL_SECONDS, max_entries: int = NL2SQL_SESSION_MAX_ENTRIES) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "lru_evictions": 0}
+
+    def _drop_expired(self, now: float) -> None:
+        # 按最近访问排序，最旧的在前，遇到未过期的即可停止。
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if now - entry["touched_at"] <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self._stats["expired"] += 1
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            self._drop_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            entry["touched_at"] = now
+            self._sessions.move_to_end(session_id)
+            self._stats["hits"] += 1
+            return copy.deepcopy(entry["state"])
+
+    def put(self, session_id: str, state: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = {"state": copy.deepcopy(state), "touched_at": now}
+            self._sessions.move_to_end(session_id)
+            self._drop_expired(now)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self._stats["lru_evictions"] += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._drop_expired(time.time())
+            return {**self._stats, "entries": len(self._sessions), "max_entries": self.max_entries}
+
+
+def get_session_store() -> SessionStore:
+    """当前数据目录的会话：追问沿用的表和条件只在同一个库上有意义。"""
+    return current_catalog().get_state("sessions", SessionStore)
@@ -0,0 +1,45 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    合并同一时刻的相同请求：相同 key 的并发调用共享一次在途执行，每个调用方（包括发起者）拿到结果的独立深拷贝，
+    各自写入会话、trace_id 等逐请求字段时互不影响。
+    只有当所有等待者都取消时才会取消底层执行，单个客户端断开不会影响其他人。
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, Dict[str, Any]] = {}
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """返回 (结果, 是否复用了他人的在途执行)。"""
+        call = self._inflight.get(key)
+        shared = call is not None
+        if shared:
+            self._stats["coalesced"] += 1
+            logger.info("合并在途请求：key=%s，当前等待者 %d", key, call["waiters"] + 1)
+        else:
+            self._stats["executions"] += 1
+            task = asyncio.create_task(func())
+            call = {"task": task, "waiters": 0}
+            self._inflight[key] = call
+            task.add_done_callback(lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is call else None)
+
+        call["waiters"] += 1
+        try:
+            return copy.deepcopy(await asyncio.shield(call["task"])), shared
+        except asyncio.CancelledError:
+            if call["waiters"] == 1 and not call["task"].done():
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "inflight": len(self._inflight)}
@@ -0,0 +1,270 @@
+"""
+SQL 语法分析：用 DuckDB 自带的解析器把 SQL 解析成 AST，一次解析供校验、试绑定、缓存键规范化、LIMIT 注入等复用。
+
+- 语句切分与语句类型来自 extract_statements，注释和字符串里的分号不会被误判；
+- SELECT 语句经 json_serialize_sql 序列化成 JSON AST，从中提取引用的表、列、过滤条件里的字面量；
+- normalized 为 json_deserialize_sql 还原出的规范 SQL，已去掉注释、统一了空白和大小写；
+- fingerprint 把 AST 中的常量统一替换为占位符后还原，mon = 202601 与 mon = 202602 得到同一个指纹。
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - 运行环境缺依赖时分析结果标记为不可用
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# AST 中属于过滤条件的子树：其中的常量视为过滤字面量。
+_FILTER_KEYS = {"where_clause", "having", "qualify", "condition"}
+
+_PLACEHOLDER_CONSTANT = {"type": {"id": "VARCHAR", "type_info": None}, "is_null": False, "value": "?"}
+_PLACEHOLDER_IN_LIST = re.compile(r"\bIN \(\?(?:, \?)*\)")
+_INTEGER_TYPES = {"TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT"}
+
+_local = threading.local()
+
+
+def _get_parser_connection() -> Any:
+    """每个线程一个只用于解析的内存连接，不访问业务库。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = duckdb.connect(":memory:")
+        _local.conn = conn
+    return conn
+
+
+def _split_statements(conn: Any, sql: str) -> List[Dict[str, str]]:
+    extract = getattr(conn, "extract_statements", None)
+    if extract is None:
+        # 旧版 DuckDB 没有 extract_statements，整体交给 json_serialize_sql 判断。
+        return [{"type": "SELECT", "query": sql}]
+    return [{"type": statement.type.name, "query": statement.query} for statement in extract(sql)]
+
+
+def _collect(node: Any, found: Dict[str, Any], in_filter: bool = False) -> None:
+    """遍历 JSON AST，收集表、CTE、列引用、字面量。"""
+    if isinstance(node, list):
+        for item in node:
+            _collect(item, found, in_filter)
+        return
+    if not isinstance(node, dict):
+        return
+
+    node_type = node.get("type")
+    if node_type == "BASE_TABLE" and node.get("table_name"):
+        found["tables"].add(node["table_name"])
+    elif node.get("class") == "COLUMN_REF" and node.get("column_names"):
+        found["columns"].add(node["column_names"][-1])
+    elif node.get("class") == "CONSTANT":
+        value = node.get("value") or {}
+        if not value.get("is_null") and value.get("value") is not None:
+            literal = str(value["value"])
+            found["literals"].add(literal)
+            if in_filter:
+                found["filter_literals"].add(literal)
+
+    cte_map = node.get("cte_map") or {}
+    for entry in cte_map.get("map", []) if isinstance(cte_map, dict) else []:
+        if entry.get("key"):
+            found["ctes"].add(entry["key"])
+
+    for key, child in node.items():
+        if isinstance(child, (dict, list)):
+            _collect(child, found, in_filter or key in _FILTER_KEYS)
+
+
+def _mask_constants(node: Any) -> None:
+    if isinstance(node, list):
+        for item in node:
+            _mask_constants(item)
+    elif isinstance(node, dict):
+        if node.get("class") == "CONSTANT":
+            node["value"] = dict(_PLACEHOLDER_CONSTANT)
+        for child in node.values():
+            _mask_constants(child)
+
+
+def _fingerprint(conn: Any, ast: Dict[str, Any]) -> str:
+    """常量替换为占位符、IN 列表折叠为一个占位符后的规范 SQL。"""
+    masked = copy.deepcopy(ast)
+    _mask_constants(masked)
+    text = conn.execute("SELECT json_deserialize_sql(?::JSON)", [json.dumps(masked)]).fetchone()[0]
+    text = text.strip().rstrip(";").replace("'?'", "?")
+    return _PLACEHOLDER_IN_LIST.sub("IN (?...)", text)
+
+
+def _replace_filter_constants(node: Any, replacements: Dict[str, str], replaced: Set[str], in_filter: bool = False) -> bool:
+    """就地改写过滤条件子树中取值等于 old 的字符串/整数常量；整数常量要换成非整数时返回 False。"""
+    if isinstance(node, list):
+        return all(_replace_filter_constants(item, replacements, replaced, in_filter) for item in node)
+    if not isinstance(node, dict):
+        return True
+
+    value = node.get("value") if node.get("class") == "CONSTANT" else None
+    if in_filter and isinstance(value, dict) and not value.get("is_null") and str(value.get("value")) in replacements:
+        type_id = (value.get("type") or {}).get("id")
+        old = str(value["value"])
+        new = replacements[old]
+        if type_id == "VARCHAR":
+            node["value"] = {**value, "value": new}
+        elif type_id in _INTEGER_TYPES:
+            if not re.fullmatch(r"-?\d+", new):
+                return False
+            node["value"] = {**value, "value": int(new)}
+        else:
+            return True
+        replaced.add(old)
+        return True
+
+    return all(
+        _replace_filter_constants(child, replacements, replaced, in_filter or key in _FILTER_KEYS)
+        for key, child in node.items()
+        if isinstance(child, (dict, list))
+    )
+
+
+def _has_top_level_limit(ast_node: Dict[str, Any]) -> bool:
+    modifiers = ast_node.get("modifiers") or []
+    return any(modifier.get("type") == "LIMIT_MODIFIER" for modifier in modifiers)
+
+
+def _empty_analysis(sql: str) -> Dict[str, Any]:
+    return {
+        "sql": sql,
+        "available": duckdb is not None,
+        "parsed": False,
+        "error": None,
+        "statement_count": 0,
+        "statement_types": [],
+        "is_select": False,
+        "tables": [],
+        "columns": [],
+        "literals": [],
+        "filter_literals": [],
+        "has_limit": False,
+        "normalized": None,
+        "fingerprint": None,
+        "fingerprint_id": None,
+        "ast": None,
+    }
+
+
+@lru_cache(maxsize=512)
+def _analyze(sql: str) -> Dict[str, Any]:
+    analysis = _empty_analysis(sql)
+    if duckdb is None or not sql:
+        return analysis
+
+    conn = _get_parser_connection()
+    try:
+        statements = _split_statements(conn, sql)
+    except duckdb.Error as exc:
+        analysis["error"] = str(exc)
+        return analysis
+
+    analysis["statement_count"] = len(statements)
+    analysis["statement_types"] = [statement["type"] for statement in statements]
+    if len(statements) != 1 or statements[0]["type"] != "SELECT":
+        # 多语句或非查询语句无需再做 AST 分析，校验会直接拒绝。
+        return analysis
+
+    try:
+        serialized = conn.execute("SELECT json_serialize_sql(?)", [statements[0]["query"]]).fetchone()[0]
+        ast = json.loads(serialized)
+        if ast.get("error"):
+            analysis["error"] = ast.get("error_message") or "SQL 解析失败"
+            analysis["statement_types"] = ["UNKNOWN"]
+            return analysis
+        normalized = conn.execute("SELECT json_deserialize_sql(?::JSON)", [serialized]).fetchone()[0]
+        fingerprint = _fingerprint(conn, ast)
+    except duckdb.Error as exc:
+        analysis["error"] = str(exc)
+        return analysis
+
+    statement_nodes = [statement.get("node") or {} for statement in ast.get("statements", [])]
+    if len(statement_nodes) > 1:
+        analysis["statement_count"] = len(statement_nodes)
+        analysis["statement_types"] = ["SELECT"] * len(statement_nodes)
+        return analysis
+    found: Dict[str, Set[str]] = {"tables": set(), "ctes": set(), "columns": set(), "literals": set(), "filter_literals": set()}
+    _collect(statement_nodes, found)
+
+    analysis.update(
+        parsed=True,
+        is_select=True,
+        tables=sorted(found["tables"] - found["ctes"]),
+        columns=sorted(found["columns"]),
+        literals=sorted(found["literals"]),
+        filter_literals=sorted(found["filter_literals"]),
+        has_limit=bool(statement_nodes) and _has_top_level_limit(statement_nodes[0]),
+        normalized=normalized.strip().rstrip(";"),
+        fingerprint=fingerprint,
+        fingerprint_id=hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16],
+        ast=statement_nodes[0] if statement_nodes else None,
+    )
+    return analysis
+
+
+def analyze_sql(sql: str) -> Dict[str, Any]:
+    """
+    解析 SQL 并返回分析结果（相同 SQL 只解析一次）：
+    available / parsed / error / statement_count / statement_types / is_select / tables / columns /
+    literals / filter_literals / has_limit / normalized / fingerprint / fingerprint_id / ast。
+    """
+    return copy.deepcopy(_analyze((sql or "").strip()))
+
+
+def normalize_sql(sql: str, analysis: Optional[Dict[str, Any]] = None) -> str:
+    """规范化 SQL 文本作为缓存键：能解析时用 AST 还原的规范 SQL，否则退化为压缩空白。"""
+    analysis = analysis or analyze_sql(sql)
+    if analysis.get("normalized"):
+        return analysis["normalized"]
+    return " ".join((sql or "").split()).rstrip(";")
+
+
+def inject_limit(sql: str, max_rows: int, analysis: Optional[Dict[str, Any]] = None) -> str:
+    """单条 SELECT 且顶层没有 LIMIT 时追加 LIMIT；无法解析或已有 LIMIT 的 SQL 原样返回。"""
+    analysis = analysis or analyze_sql(sql)
+    if max_rows <= 0 or not analysis["is_select"] or analysis["has_limit"] or not analysis["normalized"]:
+        return sql
+    return f"{analysis['normalized']} LIMIT {int(max_rows)}"
+
+
+def replace_filter_literals(sql: str, replacements: Dict[str, str]) -> Optional[str]:
+    """
+    在 AST 上把过滤条件里取值恰好等于 old 的字符串/整数常量替换为 new，返回还原后的规范 SQL。
+    列名、别名、其他常量和字面量的一部分（如日期 2025-12-01 里的 12）都不会被改到；
+    不是单条 SELECT、某个 old 不在过滤条件中或类型不兼容时返回 None。
+    """
+    analysis = analyze_sql(sql)
+    if not analysis["parsed"] or not replacements:
+        return None
+    ast = analysis["ast"]
+    replaced: Set[str] = set()
+    if not _replace_filter_constants(ast, replacements, replaced) or replaced != set(replacements):
+        return None
+    serialized = json.dumps({"error": False, "statements": [{"node": ast}]})
+    try:
+        text = _get_parser_connection().execute("SELECT json_deserialize_sql(?::JSON)", [serialized]).fetchone()[0]
+    except duckdb.Error as exc:
+        logger.warning("还原替换字面量后的 SQL 失败：%s", exc)
+        return None
+    return text.strip().rstrip(";")
+
+
+def fingerprint_sql(sql: str, analysis: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """返回 {"id", "text"}；无法解析时以压缩空白后的原文作为指纹。"""
+    analysis = analysis or analyze_sql(sql)
+    if analysis.get("fingerprint"):
+        return {"id": analysis["fingerprint_id"], "text": analysis["fingerprint"]}
+    text = normalize_sql(sql, analysis)
+    return {"id": hashlib.sha1(text.encode("utf-8")).hexdigest()[:16], "text": text}
@@ -0,0 +1,292 @@
+"""
+生成 SQL 的本地试绑定（dry-run）与有限修复。
+
+在内存 DuckDB 中按缓存的 schema 建同名空表，对生成的 SQL 执行 EXPLAIN：只做解析与绑定，不读真实数据。
+空表目录按数据目录（见 app.core.catalogs）各自缓存，以 schema 版本号为键，随数据目录回收一起释放。
+绑定失败时先做确定性修复（按目录纠正列名/表名），仍失败再发一次简短的 LLM 修复提示，
+全部修复次数有上限，修不好就把绑定错误原样带回给调用方。
+"""
+
+import asyncio
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - 运行环境缺依赖时跳过试绑定
+    duckdb = None
+
+from app.core.catalogs import current_catalog
+from app.core.llm_client import call_llm
+from app.core.sql_analysis import analyze_sql
+from app.utils.sql_parser import extract_sql
+
+logger = logging.getLogger(__name__)
+
+SQL_DRY_RUN_ENABLED = os.getenv("SQL_DRY_RUN_ENABLED", "true").lower() in ("1", "true", "yes")
+SQL_REPAIR_MAX_FIXES = int(os.getenv("SQL_REPAIR_MAX_FIXES", "3"))
+SQL_REPAIR_MAX_LLM_CALLS = int(os.getenv("SQL_REPAIR_MAX_LLM_CALLS", "1"))
+SQL_REPAIR_NAME_CUTOFF = float(os.getenv("SQL_REPAIR_NAME_CUTOFF", "0.6"))
+
+_MISSING_COLUMN_PATTERNS = [
+    re.compile(r'column "([^"]+)" not found', re.IGNORECASE),
+    re.compile(r'does not have a column named "([^"]+)"', re.IGNORECASE),
+]
+_MISSING_TABLE_PATTERN = re.compile(r'Table with name "?([\w.]+)"? does not exist', re.IGNORECASE)
+_CANDIDATE_PATTERN = re.compile(r'(?:Candidate bindings|Did you mean)[:\s]*((?:"[^"]+"[,\s]*)+)', re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+_REPAIR_INSTRUCTIONS = """
+你是 DuckDB SQL 修复助手。给定一条无法通过绑定的 SQL、数据库报错和相关表结构，
+只修正报错涉及的表名/列名/语法问题，不要改变查询口径、过滤条件和字面量。
+只输出修正后的 SQL，不要输出解释。
+""".strip()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checked": 0,
+    "passed_first_try": 0,
+    "repaired_deterministic": 0,
+    "repaired_llm": 0,
+    "failed": 0,
+    "skipped": 0,
+    "deterministic_fixes": 0,
+    "llm_repair_calls": 0,
+}
+
+
+def _record(**increments: int) -> None:
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+
+def get_dry_run_stats() -> Dict[str, Any]:
+    """试绑定统计：首轮通过率、各类修复次数、额外 LLM 调用次数、最终失败率。"""
+    with _stats_lock:
+        stats = dict(_stats)
+    checked = stats["checked"] or 1
+    stats["first_try_failure_rate"] = round(1 - stats["passed_first_try"] / checked, 4)
+    stats["final_failure_rate"] = round(stats["failed"] / checked, 4)
+    return stats
+
+
+def _schema_signature(full_schema: Dict[str, Dict[str, Any]]) -> str:
+    payload = sorted(
+        (table_name, [(column.get("name"), column.get("type")) for column in table.get("columns", [])])
+        for table_name, table in full_schema.items()
+    )
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def _quote(identifier: str) -> str:
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def _create_empty_table(conn: Any, table_name: str, columns: List[Dict[str, Any]]) -> None:
+    typed = ", ".join(f"{_quote(column['name'])} {column.get('type') or 'VARCHAR'}" for column in columns)
+    try:
+        conn.execute(f"CREATE TABLE {_quote(table_name)} ({typed})")
+    except Exception:
+        # 个别复杂类型无法直接复用时退化为 VARCHAR，只要列名在就足以发现绑定错误。
+        untyped = ", ".join(f"{_quote(column['name'])} VARCHAR" for column in columns)
+        conn.execute(f"CREATE TABLE {_quote(table_name)} ({untyped})")
+
+
+class _EmptyTableCatalog:
+    """一个数据目录的空表内存库，按 schema 版本号缓存。"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.signature: Optional[str] = None
+        self.conn: Any = None
+
+    def cursor(self, full_schema: Dict[str, Dict[str, Any]], schema_version: Optional[str] = None) -> Any:
+        """
+        取一个 cursor；schema 版本号变化时重建内存库。旧库不主动关闭：仍在使用的 cursor 持有它，用完后随之释放。
+        schema_version 为 get_schema_version() 的结果，同版本的请求不再逐个序列化整个 schema；
+        只有调用方给不出版本号（临时拼的 schema）时才退化为按内容计算签名。
+        """
+        signature = f"version:{schema_version}" if schema_version else _schema_signature(full_schema)
+        with self.lock:
+            if self.signature != signature:
+                conn = duckdb.connect(":memory:")
+                for table_name, table in full_schema.items():
+                    columns = [column for column in table.get("columns", []) if column.get("name")]
+                    if columns:
+                        _create_empty_table(conn, table_name, columns)
+                self.signature, self.conn = signature, conn
+                logger.info("试绑定目录已重建，共 %d 张空表。", len(full_schema))
+            return self.conn.cursor()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.signature, self.conn = None, None
+
+
+def dry_run_sql(sql: str, full_schema: Dict[str, Dict[str, Any]], schema_version: Optional[str] = None) -> Optional[str]:
+    """
+    在空表目录上 EXPLAIN 该 SQL，返回绑定错误信息；通过时返回 None。schema_version 是 full_schema 对应的 schema 版本号。
+    只 EXPLAIN 解析确认过的单条 SELECT：多语句里分号后面的部分会被真正执行，可能删改共享的空表目录。
+    """
+    analysis = analyze_sql(sql)
+    if analysis["error"]:
+        return analysis["error"]
+    if analysis["statement_count"] != 1 or not analysis["is_select"]:
+        return f"只能试绑定单条 SELECT 语句，实际为 {analysis['statement_count']} 条：{', '.join(analysis['statement_types'])}"
+
+    cursor = current_catalog().get_state("dry_run", _EmptyTableCatalog).cursor(full_schema, schema_version)
+    try:
+        cursor.execute(f"EXPLAIN {sql.strip().rstrip(';')}")
+        return None
+    except duckdb.Error as exc:
+        return str(exc)
+    finally:
+        cursor.close()
+
+
+def _replace_identifier(sql: str, old: str, new: str) -> str:
+    """只替换字符串字面量之外的标识符，避免改到过滤值。"""
+    pattern = re.compile(rf'(?<!\w)"?{re.escape(old)}"?(?!\w)', re.IGNORECASE)
+    parts, last = [], 0
+    for literal in _STRING_LITERAL.finditer(sql):
+        parts.append(pattern.sub(new, sql[last:literal.start()]))
+        parts.append(literal.group(0))
+        last = literal.end()
+    parts.append(pattern.sub(new, sql[last:]))
+    return "".join(parts)
+
+
+def _referenced_tables(sql: str, full_schema: Dict[str, Dict[str, Any]]) -> List[str]:
+    referenced = [name for name in analyze_sql(sql)["tables"] if name in full_schema]
+    return referenced or list(full_schema.keys())
+
+
+def _closest(name: str, candidates: List[str]) -> Optional[str]:
+    lowered = {candidate.lower(): candidate for candidate in candidates}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    matches = difflib.get_close_matches(name.lower(), list(lowered), n=1, cutoff=SQL_REPAIR_NAME_CUTOFF)
+    return lowered[matches[0]] if matches else None
+
+
+def _deterministic_fix(sql: str, error: str, full_schema: Dict[str, Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+    """根据绑定错误纠正一个表名或列名，返回 (新 SQL, 修复说明)；无法确定时返回 None。"""
+    suggested = []
+    candidate_match = _CANDIDATE_PATTERN.search(error)
+    if candidate_match:
+        suggested = [item.split(".")[-1] for item in re.findall(r'"([^"]+)"', candidate_match.group(1))]
+
+    table_match = _MISSING_TABLE_PATTERN.search(error)
+    if table_match:
+        bad_table = table_match.group(1).split(".")[-1]
+        fixed = _closest(bad_table, suggested or list(full_schema.keys()))
+        if fixed and fixed != bad_table:
+            return _replace_identifier(sql, bad_table, fixed), f"表名 {bad_table} -> {fixed}"
+        return None
+
+    for pattern in _MISSING_COLUMN_PATTERNS:
+        column_match = pattern.search(error)
+        if not column_match:
+            continue
+        bad_column = column_match.group(1).split(".")[-1]
+        columns = [
+            column["name"]
+            for table_name in _referenced_tables(sql, full_schema)
+            for column in full_schema[table_name].get("columns", [])
+        ]
+        fixed = _closest(bad_column, suggested or columns) or _closest(bad_column, columns)
+        if fixed and fixed != bad_column:
+            return _replace_identifier(sql, bad_column, fixed), f"列名 {bad_column} -> {fixed}"
+        return None
+    return None
+
+
+def _repair_context(sql: str, full_schema: Dict[str, Dict[str, Any]]) -> str:
+    lines = []
+    for table_name in _referenced_tables(sql, full_schema)[:5]:
+        columns = ", ".join(column["name"] for column in full_schema[table_name].get("columns", []))
+        lines.append(f"{table_name}({columns})")
+    return "\n".join(lines)
+
+
+async def _llm_repair(sql: str, error: str, full_schema: Dict[str, Dict[str, Any]]) -> str:
+    user_content = f"相关表结构：\n{_repair_context(sql, full_schema)}\n\n报错：\n{error}\n\nSQL：\n{sql}"
+    llm_output = await call_llm(
+        messages=[
+            {"role": "system", "content": _REPAIR_INSTRUCTIONS},
+            {"role": "user", "content": user_content},
+        ],
+        max_tokens=512,
+        temperature=0,
+    )
+    return extract_sql(llm_output)
+
+
+async def check_and_repair_sql(sql: str, full_schema: Dict[str, Dict[str, Any]], schema_version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    试绑定并在上限内修复（schema_version 见 dry_run_sql），返回：
+    {"sql": 最终 SQL, "status": passed/repaired/failed/skipped, "errors": 每轮绑定错误,
+     "fixes": 修复记录, "llm_calls": 额外 LLM 调用次数}
+    """
+    report: Dict[str, Any] = {"sql": sql, "status": "skipped", "errors": [], "fixes": [], "llm_calls": 0}
+    if not SQL_DRY_RUN_ENABLED or duckdb is None or not sql or not full_schema:
+        _record(skipped=1)
+        return report
+
+    _record(checked=1)
+    error = await asyncio.to_thread(dry_run_sql, sql, full_schema, schema_version)
+    if error is None:
+        _record(passed_first_try=1)
+        report["status"] = "passed"
+        return report
+
+    current = sql
+    fixes = 0
+    while error is not None and fixes < SQL_REPAIR_MAX_FIXES:
+        report["errors"].append(error)
+        fixed = _deterministic_fix(current, error, full_schema)
+        if fixed is None:
+            break
+        current, note = fixed
+        fixes += 1
+        report["fixes"].append({"type": "deterministic", "detail": note})
+        error = await asyncio.to_thread(dry_run_sql, current, full_schema, schema_version)
+    _record(deterministic_fixes=fixes)
+
+    while error is not None and report["llm_calls"] < SQL_REPAIR_MAX_LLM_CALLS:
+        if not report["errors"] or report["errors"][-1] != error:
+            report["errors"].append(error)
+        report["llm_calls"] += 1
+        _record(llm_repair_calls=1)
+        try:
+            repaired = await _llm_repair(current, error, full_schema)
+        except Exception as exc:
+            logger.warning("LLM 修复 SQL 失败：%s", exc)
+            break
+        if not repaired:
+            break
+        current = repaired
+        report["fixes"].append({"type": "llm", "detail": error.splitlines()[0][:200]})
+        error = await asyncio.to_thread(dry_run_sql, current, full_schema, schema_version)
+
+    report["sql"] = current
+    if error is None:
+        report["status"] = "repaired"
+        _record(**{"repaired_llm" if report["llm_calls"] else "repaired_deterministic": 1})
+        logger.info("SQL 试绑定失败后修复成功：%s", report["fixes"])
+    else:
+        if not report["errors"] or report["errors"][-1] != error:
+            report["errors"].append(error)
+        report["status"] = "failed"
+        _record(failed=1)
+        logger.warning("SQL 试绑定失败且未能修复：%s", error.splitlines()[0])
+    return report
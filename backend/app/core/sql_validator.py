@@ -1,5 +1,7 @@
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+from app.core.sql_analysis import analyze_sql
 
 
 def validate_generated_sql(
@@ -7,23 +9,44 @@ def validate_generated_sql(
     parsed_intent: Dict[str, Any],
     metric_rules: List[Dict[str, Any]],
     available_table_names: List[str],
+    analysis: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
+    """
+    基于 SQL 的 AST 做校验：语句条数与类型、引用的表、过滤字面量。
+    注释里出现的编码或月份不算数；DuckDB 不可用导致无法解析时退化为文本包含检查。
+    """
     errors: List[str] = []
     warnings: List[str] = []
 
     normalized_sql = (sql or "").strip()
-    upper_sql = normalized_sql.upper()
+    analysis = analysis or analyze_sql(normalized_sql)
 
     if not normalized_sql:
         errors.append("SQL 为空。")
-    if normalized_sql and not (upper_sql.startswith("SELECT") or upper_sql.startswith("WITH")):
+    elif not analysis["available"]:
+        if not re.match(r"(SELECT|WITH)\b", normalized_sql, re.IGNORECASE):
+            errors.append("仅允许 SELECT/WITH 查询。")
+    elif analysis["error"]:
+        errors.append(f"SQL 解析失败：{analysis['error']}")
+    elif analysis["statement_count"] > 1:
+        errors.append(f"仅允许单条 SQL 语句，检测到 {analysis['statement_count']} 条：{', '.join(analysis['statement_types'])}。")
+    elif not analysis["is_select"]:
         errors.append("仅允许 SELECT/WITH 查询。")
 
+    literals = set(analysis["literals"]) if analysis["parsed"] else None
+
+    def mentions(value: str) -> bool:
+        return value in literals if literals is not None else value in normalized_sql
+
+    for table_name in analysis["tables"]:
+        if table_name not in available_table_names:
+            warnings.append(f"SQL 引用了 schema 中不存在的表 {table_name}。")
+
     for metric_rule in metric_rules:
         code_field = metric_rule.get("code_field")
         code_value = metric_rule.get("code_value")
         source_table = metric_rule.get("source_table")
-        if code_field and code_value and code_value not in normalized_sql:
+        if code_field and code_value and not mentions(str(code_value)):
             warnings.append(f"SQL 中未显式包含指标编码 {code_field} = '{code_value}'。")
         if source_table and source_table not in available_table_names:
             warnings.append(f"指标规则依赖表 {source_table}，但 schema 未提供该表。")
@@ -31,14 +54,15 @@ def validate_generated_sql(
     time_range = parsed_intent.get("time_range") or {}
     if time_range.get("grain") == "month":
         expected_value = str(time_range.get("normalized_value", ""))
-        if expected_value and expected_value not in normalized_sql:
+        if expected_value and not mentions(expected_value):
             warnings.append(f"SQL 中未显式使用标准化月份值 {expected_value}。")
-        if re.search(r"\d{4}-\d{2}-\d{2}", normalized_sql):
+        date_texts = literals if literals is not None else [normalized_sql]
+        if any(re.search(r"\d{4}-\d{2}-\d{2}", text) for text in date_texts):
             warnings.append("检测到日期格式字面量，月份字段应优先使用 YYYYMM。")
 
     for entity in parsed_intent.get("entities", []):
         value = str(entity.get("value", "")).strip()
-        if value and value not in normalized_sql:
+        if value and not mentions(value):
             warnings.append(f"SQL 中未显式包含实体过滤值 {value}。")
 
     return {
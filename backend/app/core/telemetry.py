@@ -0,0 +1,273 @@
+"""
+请求级追踪与 Prometheus 指标。
+
+- `start_trace(name)` 为一次请求开启追踪，`span(name, **attrs)` 记录其中一个阶段的耗时、属性与状态；
+  当前追踪与当前 span 保存在 contextvars 中，asyncio 任务和 asyncio.to_thread 会自动继承。
+- 每个 span 结束时计入 `datainsight_span_duration_seconds{span,status}` 直方图，便于按阶段告警 p99。
+- 追踪结束时以一行 JSON 写日志（TELEMETRY_TRACE_LOG=false 可关闭）。
+- `render_prometheus()` 输出 Prometheus 文本格式，外部统计可通过 `register_collector` 以 gauge 形式挂进来。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_TRACE_LOG = os.getenv("TELEMETRY_TRACE_LOG", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+SPAN_DURATION = Histogram(
+    "datainsight_span_duration_seconds",
+    "Duration of traced request stages.",
+    labelnames=("span", "status"),
+)
+REQUESTS = Counter("datainsight_requests_total", "Traced requests by entry point and outcome.", labelnames=("name", "status"))
+PROMPT_TOKENS = Histogram(
+    "datainsight_prompt_tokens",
+    "Estimated prompt tokens of SQL generation requests.",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000),
+)
+QUERY_ROWS = Histogram(
+    "datainsight_query_rows",
+    "Rows returned by executed SQL.",
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000),
+)
+
+LANE_QUEUE_WAIT = Histogram(
+    "datainsight_lane_queue_wait_seconds",
+    "Time requests spent queued in a priority lane, by outcome (admitted, expired, timed_out).",
+    labelnames=("lane", "outcome"),
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+_METRICS: List[Any] = [SPAN_DURATION, REQUESTS, PROMPT_TOKENS, QUERY_ROWS, LANE_QUEUE_WAIT]
+
+# 采集器返回 [(指标名, 说明, [(标签字典, 数值), ...]), ...]，在 /metrics 时以 gauge 输出。
+Collector = Callable[[], List[Tuple[str, str, List[Tuple[Dict[str, str], float]]]]]
+_collectors: List[Collector] = []
+
+
+def register_collector(collector: Collector) -> None:
+    _collectors.append(collector)
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception as exc:
+            logger.warning("指标采集器 %s 失败：%s", getattr(collector, "__name__", collector), exc)
+            continue
+        for name, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class Span:
+    def __init__(self, name: str, trace: Optional["Trace"], parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return round(((self.end or time.perf_counter()) - self.start) * 1000, 2)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.root = Span(name, self, None, attributes)
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_dict(self.start) for span in self.spans]
+        return {"trace_id": self.trace_id, **self.root.to_dict(self.start), "spans": spans}
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("datainsight_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("datainsight_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def set_span_attributes(**attributes: Any) -> None:
+    """给当前 span 补充属性；不在追踪中时忽略。"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """记录一个阶段；没有活动追踪时仍计入耗时直方图。"""
+    trace = _current_trace.get()
+    current = Span(name, trace, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except asyncio.CancelledError:
+        current.status = "cancelled"
+        raise
+    except Exception as exc:
+        current.status = "error"
+        current.set(error=str(exc)[:200])
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+        SPAN_DURATION.observe(current.end - current.start, span=name, status=current.status)
+        if trace is not None:
+            trace.add(current)
+
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Trace]:
+    """开启一次请求追踪；已在追踪中时复用外层追踪，只新建一个 span。"""
+    outer = _current_trace.get()
+    if outer is not None:
+        with span(name, **attributes):
+            yield outer
+        return
+
+    trace = Trace(name, attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except asyncio.CancelledError:
+        trace.root.status = "cancelled"
+        raise
+    except Exception:
+        trace.root.status = "error"
+        raise
+    finally:
+        trace.root.end = time.perf_counter()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        SPAN_DURATION.observe(trace.root.end - trace.root.start, span=name, status=trace.root.status)
+        REQUESTS.inc(name=name, status=trace.root.status)
+        if TELEMETRY_TRACE_LOG:
+            logger.info("trace %s", json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
@@ -0,0 +1,398 @@
+"""
+列值索引（value linking）：把问题中提到的营业部名称、员工号、客户号等具体取值直接映射成 `列 = 值` 过滤条件，不依赖 LLM。
+
+离线从 DuckDB 构建：对每个字符串列先用 approx_count_distinct 估算基数，
+低基数列（取值不超过 VALUE_INDEX_MAX_DISTINCT）和编号类列（取值不超过 VALUE_INDEX_MAX_ID_VALUES）才收录。
+索引是按字典序排好的取值数组，配合取值 → 下标字典：
+- 在问题中扫描子串做精确匹配（只需按已收录的取值长度逐个查字典）；
+- 前缀查找用二分；
+- 模糊查找（编辑距离 1）：一处编辑必然保留前半段或后半段，
+  因此只比较与查询词前半段同前缀（正序数组）或后半段同后缀（逆序数组）的候选，用于编号类取值的笔误。
+
+索引写入 VALUE_INDEX_PATH，记录构建时的数据快照号（见 app.core.db_snapshots）；快照号不一致时视为过期，
+VALUE_INDEX_AUTO_BUILD 开启时在后台线程加载或重建，否则不做值链接。请求路径从不等待加载或构建：
+索引还没就绪时本次请求直接跳过值链接。
+多个数据目录（见 app.core.catalogs）各有一份索引：目录配置了 value_index_path 时用它，
+否则默认目录用 VALUE_INDEX_PATH，其余目录用同目录下的 value_index.<目录名>.json。
+离线构建：python -m app.core.value_index [--catalog 目录名]
+"""
+
+import argparse
+import bisect
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - 运行环境缺依赖时仅在调用时失败
+    duckdb = None
+
+from app.core.catalogs import current_catalog, use_catalog
+from app.core.db_snapshots import Snapshot, connect_read_only, current_snapshot
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+VALUE_INDEX_PATH = os.getenv("VALUE_INDEX_PATH", os.path.join(BASE_DIR, "app", "value_index.json"))
+VALUE_INDEX_AUTO_BUILD = os.getenv("VALUE_INDEX_AUTO_BUILD", "true").lower() in ("1", "true", "yes")
+# 低基数列的取值上限，例如营业部、岗位序列、在职状态。
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", "5000"))
+# 编号类列（员工号、客户号等）允许收录更多取值。
+VALUE_INDEX_MAX_ID_VALUES = int(os.getenv("VALUE_INDEX_MAX_ID_VALUES", "200000"))
+VALUE_INDEX_MIN_LENGTH = int(os.getenv("VALUE_INDEX_MIN_LENGTH", "2"))
+VALUE_INDEX_MAX_LENGTH = int(os.getenv("VALUE_INDEX_MAX_LENGTH", "32"))
+
+INDEX_FORMAT_VERSION = 1
+_STRING_TYPES = ("VARCHAR", "CHAR", "TEXT", "STRING")
+_ID_COLUMN_PATTERN = re.compile(r"(^|_)(id|num|no|code|dm|bh)$|id$", re.IGNORECASE)
+_ID_COMMENT_KEYWORDS = ["编号", "编码", "代码", "工号", "账号", "客户号", "号码"]
+_ALNUM_TOKEN = re.compile(r"[A-Za-z0-9_]{4,}")
+_ASCII_WORD = re.compile(r"[A-Za-z0-9_]")
+
+
+def _is_identifier_column(column: str, comment: str) -> bool:
+    return bool(_ID_COLUMN_PATTERN.search(column)) or any(keyword in (comment or "") for keyword in _ID_COMMENT_KEYWORDS)
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _within_one_edit(left: str, right: str) -> bool:
+    """编辑距离是否不超过 1（替换、插入或删除一个字符）。"""
+    if left == right:
+        return True
+    if abs(len(left) - len(right)) > 1:
+        return False
+    if len(left) > len(right):
+        left, right = right, left
+    i = 0
+    while i < len(left) and left[i] == right[i]:
+        i += 1
+    if len(left) == len(right):
+        return left[i + 1:] == right[i + 1:]
+    return left[i:] == right[i + 1:]
+
+
+class ValueIndex:
+    """已排序的取值数组；postings[i] 是取值 values[i] 所在列在 columns 中的下标。"""
+
+    def __init__(self, values: List[str], postings: List[List[int]], columns: List[Dict[str, Any]], db_version: Optional[str] = None) -> None:
+        self.values = values
+        self.postings = postings
+        self.columns = columns
+        self.db_version = db_version
+        self._positions = {value: position for position, value in enumerate(values)}
+        self._lengths = sorted({len(value) for value in values}, reverse=True)
+        # 逆序字符串数组，用于按后缀二分。
+        self._reversed = sorted((value[::-1], position) for position, value in enumerate(values))
+
+    def _entry(self, position: int) -> Dict[str, Any]:
+        return {"value": self.values[position], "columns": [self.columns[index] for index in self.postings[position]]}
+
+    def exact(self, value: str) -> Optional[Dict[str, Any]]:
+        position = self._positions.get(value)
+        return self._entry(position) if position is not None else None
+
+    def prefix(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        start = bisect.bisect_left(self.values, prefix)
+        matches = []
+        for position in range(start, min(start + limit, len(self.values))):
+            if not self.values[position].startswith(prefix):
+                break
+            matches.append(self._entry(position))
+        return matches
+
+    def _prefix_positions(self, prefix: str) -> List[int]:
+        start = bisect.bisect_left(self.values, prefix)
+        end = bisect.bisect_left(self.values, prefix + "\U0010ffff")
+        return list(range(start, end))
+
+    def _suffix_positions(self, suffix: str) -> List[int]:
+        reversed_suffix = suffix[::-1]
+        start = bisect.bisect_left(self._reversed, (reversed_suffix,))
+        end = bisect.bisect_left(self._reversed, (reversed_suffix + "\U0010ffff",))
+        return [position for _, position in self._reversed[start:end]]
+
+    def fuzzy(self, term: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """编辑距离 1 以内的取值（不含精确相等）；查询词至少 2 个字符。"""
+        if len(term) < 2:
+            return []
+        half = len(term) // 2
+        candidates = set(self._prefix_positions(term[:half])) | set(self._suffix_positions(term[half:]))
+        matches = []
+        for position in sorted(candidates):
+            value = self.values[position]
+            if value != term and _within_one_edit(term, value):
+                matches.append(self._entry(position))
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def link(self, query: str) -> List[Dict[str, Any]]:
+        """
+        在问题中找出收录的取值：从左到右取最长的精确匹配，互不重叠；
+        以字母数字开头/结尾的取值必须落在字母数字边界上，避免把 100234 里的 1002 当成工号。
+        未精确命中的编号类片段（4 位以上字母数字，纯数字除外）再做一次模糊匹配，唯一候选才采用。
+        """
+        mentions: List[Dict[str, Any]] = []
+        covered = [False] * len(query)
+        i = 0
+        while i < len(query):
+            for length in self._lengths:
+                if i + length > len(query):
+                    continue
+                position = self._positions.get(query[i:i + length])
+                if position is not None and self._on_boundary(query, i, i + length):
+                    mentions.append({**self._entry(position), "start": i, "end": i + length, "match": "exact"})
+                    covered[i:i + length] = [True] * length
+                    i += length
+                    break
+            else:
+                i += 1
+
+        for token in _ALNUM_TOKEN.finditer(query):
+            if any(covered[token.start():token.end()]) or token.group(0).isdigit():
+                continue
+            candidates = self.fuzzy(token.group(0), limit=2)
+            if len(candidates) == 1:
+                mentions.append({**candidates[0], "start": token.start(), "end": token.end(), "match": "fuzzy", "text": token.group(0)})
+        return sorted(mentions, key=lambda item: item["start"])
+
+    @staticmethod
+    def _on_boundary(query: str, start: int, end: int) -> bool:
+        if _ASCII_WORD.match(query[start]) and start > 0 and _ASCII_WORD.match(query[start - 1]):
+            return False
+        return not (_ASCII_WORD.match(query[end - 1]) and end < len(query) and _ASCII_WORD.match(query[end]))
+
+    def stats(self) -> Dict[str, int]:
+        return {"values": len(self.values), "columns": len(self.columns), "postings": sum(len(item) for item in self.postings)}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format_version": INDEX_FORMAT_VERSION,
+            "db_version": self.db_version,
+            "columns": self.columns,
+            "values": self.values,
+            "postings": self.postings,
+        }
+
+
+def _eligible_columns(conn: Any) -> List[Dict[str, Any]]:
+    """按表估算各字符串列的基数，返回可收录的列。"""
+    rows = conn.execute(
+        """
+        SELECT table_name, column_name, data_type, comment
+        FROM duckdb_columns
+        WHERE NOT internal
+        ORDER BY table_name, column_index
+        """
+    ).fetchall()
+    by_table: Dict[str, List[Tuple[str, str]]] = {}
+    for table, column, data_type, comment in rows:
+        if any(marker in str(data_type).upper() for marker in _STRING_TYPES):
+            by_table.setdefault(table, []).append((column, comment or ""))
+
+    eligible = []
+    for table, columns in by_table.items():
+        estimates = conn.execute(
+            "SELECT " + ", ".join(f"approx_count_distinct({_quote_identifier(column)})" for column, _ in columns)
+            + f" FROM {_quote_identifier(table)}"
+        ).fetchone()
+        for (column, comment), distinct in zip(columns, estimates):
+            identifier = _is_identifier_column(column, comment)
+            limit = VALUE_INDEX_MAX_ID_VALUES if identifier else VALUE_INDEX_MAX_DISTINCT
+            if distinct and distinct <= limit:
+                eligible.append({"table": table, "column": column, "comment": comment, "identifier": identifier, "approx_distinct": int(distinct)})
+    return eligible
+
+
+def build_value_index(snapshot: Optional[Snapshot] = None) -> ValueIndex:
+    if duckdb is None:
+        raise RuntimeError("duckdb is not installed")
+
+    started = time.perf_counter()
+    snapshot = snapshot or current_snapshot()
+    db_version = snapshot.id
+    postings: Dict[str, List[int]] = {}
+    with connect_read_only(snapshot.path) as conn:
+        columns = _eligible_columns(conn)
+        for index, column in enumerate(columns):
+            values = conn.execute(
+                f"SELECT DISTINCT {_quote_identifier(column['column'])} FROM {_quote_identifier(column['table'])} "
+                f"WHERE {_quote_identifier(column['column'])} IS NOT NULL"
+            ).fetchall()
+            for (value,) in values:
+                value = str(value).strip()
+                # 纯数字取值只在编号类列收录（如数字工号），金额、数量之类的数字不做值链接。
+                if VALUE_INDEX_MIN_LENGTH <= len(value) <= VALUE_INDEX_MAX_LENGTH and (column["identifier"] or not value.isdigit()):
+                    postings.setdefault(value, []).append(index)
+
+    values = sorted(postings)
+    index = ValueIndex(values, [postings[value] for value in values], columns, db_version)
+    logger.info("列值索引构建完成：%d 列，%d 个取值，耗时 %.2fs", len(columns), len(values), time.perf_counter() - started)
+    return index
+
+
+def value_index_path() -> str:
+    """当前数据目录的索引文件路径。"""
+    catalog = current_catalog()
+    if catalog.value_index_path:
+        return catalog.value_index_path
+    if catalog.is_default:
+        return VALUE_INDEX_PATH
+    stem, ext = os.path.splitext(VALUE_INDEX_PATH)
+    return f"{stem}.{catalog.name}{ext}"
+
+
+def save_value_index(index: ValueIndex, path: Optional[str] = None) -> None:
+    path = path or value_index_path()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(index.to_dict(), file, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_value_index(path: Optional[str] = None) -> Optional[ValueIndex]:
+    path = path or value_index_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            payload = json.load(file)
+    except (OSError, json.JSONDecodeError) as exc:
+        logger.warning("读取列值索引失败：%s", exc)
+        return None
+    if payload.get("format_version") != INDEX_FORMAT_VERSION:
+        return None
+    return ValueIndex(payload["values"], payload["postings"], payload["columns"], payload.get("db_version"))
+
+
+class _ValueIndexHolder:
+    """一个数据目录已加载的列值索引；refreshing 表示后台加载/构建正在进行。"""
+
+    def __init__(self) -> None:
+        self.index: Optional[ValueIndex] = None
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+
+def _holder() -> _ValueIndexHolder:
+    return current_catalog().get_state("value_index", _ValueIndexHolder)
+
+
+def refresh_value_index() -> Optional[ValueIndex]:
+    """加载（必要时构建）与当前数据快照匹配的索引，阻塞直到完成；供预热、后台刷新使用，不要在请求路径上调用。"""
+    try:
+        snapshot = current_snapshot()
+    except OSError:
+        return None
+    holder = _holder()
+    with holder.lock:
+        if holder.index is not None and holder.index.db_version == snapshot.id:
+            return holder.index
+        index = load_value_index()
+        if index is None or index.db_version != snapshot.id:
+            if not VALUE_INDEX_AUTO_BUILD:
+                logger.warning("列值索引缺失或已过期，跳过值链接（可运行 python -m app.core.value_index 重建）。")
+                return None
+            try:
+                index = build_value_index(snapshot)
+                save_value_index(index)
+            except Exception as exc:
+                logger.warning("构建列值索引失败，跳过值链接：%s", exc)
+                return None
+        holder.index = index
+        return index
+
+
+def _background_refresh(holder: _ValueIndexHolder) -> None:
+    try:
+        refresh_value_index()
+    finally:
+        holder.refreshing = False
+
+
+def get_value_index() -> Optional[ValueIndex]:
+    """
+    返回与当前数据目录、当前数据快照匹配的索引，不阻塞：索引缺失或过期时在后台线程加载/构建，
+    本次返回 None（调用方跳过值链接）；已有刷新在进行时也直接返回 None。
+    """
+    try:
+        snapshot = current_snapshot()
+    except OSError:
+        return None
+
+    holder = _holder()
+    index = holder.index
+    if index is not None and index.db_version == snapshot.id:
+        return index
+
+    if not holder.lock.acquire(blocking=False):
+        return None
+    try:
+        if holder.refreshing:
+            return None
+        holder.refreshing = True
+    finally:
+        holder.lock.release()
+    # 后台线程继承当前上下文，刷新的是本请求所在数据目录的索引。
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(_background_refresh, holder), name="value-index-refresh", daemon=True
+    ).start()
+    return None
+
+
+def link_values(query: str, exclude_spans: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """
+    把问题中提到的列值转成实体：{"type": "column_value", "value", "field_hint", "table", "candidates"}。
+    exclude_spans 中的片段（已识别的指标、术语、时间）不参与匹配，避免把指标名里的字当成取值。
+    同一取值出现在多列时，field_hint 取基数最小的列，其余列放在 candidates 里。
+    """
+    index = get_value_index()
+    if index is None or not query:
+        return []
+
+    masked = query
+    for span_text in sorted({text for text in exclude_spans if text}, key=len, reverse=True):
+        masked = masked.replace(span_text, "\0" * len(span_text))
+
+    entities = []
+    for mention in index.link(masked):
+        columns = sorted(mention["columns"], key=lambda column: column["approx_distinct"])
+        entities.append(
+            {
+                "type": "column_value",
+                "value": mention["value"],
+                "field_hint": columns[0]["column"],
+                "table": columns[0]["table"],
+                "candidates": [f"{column['table']}.{column['column']}" for column in columns],
+                "match": mention["match"],
+                "raw_text": query[mention["start"]:mention["end"]],
+            }
+        )
+    return entities
+
+
+def get_value_index_stats() -> Dict[str, int]:
+    """当前数据目录已加载的索引规模；未加载时不触发加载。"""
+    holder = current_catalog().state.get("value_index")
+    index = holder.index if holder is not None else None
+    return index.stats() if index is not None else {"values": 0, "columns": 0, "postings": 0}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="离线构建列值索引")
+    parser.add_argument("--catalog", default=None, help="数据目录名，默认为 DEFAULT_CATALOG")
+    args = parser.parse_args()
+    with use_catalog(args.catalog, touch=False):
+        built = build_value_index()
+        save_value_index(built)
+        print(json.dumps({"path": value_index_path(), **built.stats()}, ensure_ascii=False))
@@ -0,0 +1,66 @@
+"""
+启动预热：服务开始接收请求后，在后台线程里依次加载较重的依赖和索引，让首批请求不必承担这些开销。
+
+预热期间请求照常处理，用到的部分按需加载；schema 向量索引尚未建好时检索退化为关键词匹配。
+WARMUP_ON_STARTUP=false 时不预热，全部在首次使用时加载。只预热默认数据目录，其余目录（见 app.core.catalogs）首次使用时加载。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.knowledge_base import load_knowledge_base
+from app.core.llm_gateway import preload_openai
+from app.core.schema_index import init_schema_index
+from app.core.schema_service import get_schema_snapshot
+from app.core.value_index import refresh_value_index
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# 先做便宜且首个请求一定用到的步骤，最慢的 Embedding 模型放在最后。
+_WARM_UP_STEPS: List[Tuple[str, Callable[[], Any]]] = [
+    ("schema_snapshot", get_schema_snapshot),
+    ("knowledge_base", load_knowledge_base),
+    ("value_index", refresh_value_index),
+    ("openai", preload_openai),
+    ("schema_index", init_schema_index),
+]
+
+_status: Dict[str, Any] = {"state": "pending", "steps": {}}
+
+
+def run_warm_up() -> Dict[str, Any]:
+    """依次执行预热步骤并记录各步耗时；单步失败只记录日志，不影响后续步骤。"""
+    _status["state"] = "running"
+    started = time.perf_counter()
+    for name, step in _WARM_UP_STEPS:
+        step_started = time.perf_counter()
+        try:
+            step()
+            ok = True
+        except Exception as exc:
+            logger.warning("预热步骤 %s 失败（之后按需加载）：%s", name, exc)
+            ok = False
+        _status["steps"][name] = {"ok": ok, "duration_ms": round((time.perf_counter() - step_started) * 1000, 2)}
+    _status["state"] = "done"
+    _status["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info("预热完成，耗时 %.0f ms：%s", _status["duration_ms"], {name: step["duration_ms"] for name, step in _status["steps"].items()})
+    return _status
+
+
+def start_warm_up() -> Optional[asyncio.Task]:
+    if not WARMUP_ON_STARTUP:
+        _status["state"] = "disabled"
+        return None
+    return asyncio.create_task(asyncio.to_thread(run_warm_up))
+
+
+def get_warm_up_stats() -> Dict[str, float]:
+    stats: Dict[str, float] = {"done": 1 if _status["state"] == "done" else 0, "duration_ms": _status.get("duration_ms", 0)}
+    for name, step in _status["steps"].items():
+        stats[f"{name}_ms"] = step["duration_ms"]
+    return stats
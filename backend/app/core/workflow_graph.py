@@ -0,0 +1,148 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.core.telemetry import span
+
+logger = logging.getLogger(__name__)
+
+_SKIPPED = object()
+
+
+class StageGraph:
+    """
+    轻量的阶段依赖图：互不依赖的阶段并发执行，只在真正需要数据的地方汇合。
+
+    - 阶段函数以依赖阶段的名称作为关键字参数接收其结果；同步函数放到线程池执行。
+    - `when` 返回 False 时该阶段被跳过，跳过会立即传递给所有下游阶段。
+    - 所有输出阶段完成（或被跳过）后，仍在运行的阶段会被取消。
+    - `on_stage_done(name, value)` 在每个阶段完成时回调，可用于流式推送阶段进度。
+    - 每个执行的阶段记录为一个同名追踪 span，`describe(value)` 返回的字典作为 span 属性。
+    """
+
+    def __init__(self) -> None:
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        deps: Iterable[str] = (),
+        when: Optional[Callable[..., bool]] = None,
+        describe: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    ) -> None:
+        deps = list(deps)
+        unknown = [dep for dep in deps if dep not in self._stages]
+        if unknown:
+            raise ValueError(f"阶段 {name} 依赖未注册的阶段：{unknown}")
+        self._stages[name] = {"func": func, "deps": deps, "when": when, "describe": describe}
+
+    async def run(
+        self,
+        outputs: Iterable[str],
+        on_stage_done: Optional[Callable[[str, Any], None]] = None,
+    ) -> Dict[str, Any]:
+        outputs = list(outputs)
+        loop = asyncio.get_running_loop()
+        origin = time.perf_counter()
+        futures = {name: loop.create_future() for name in self._stages}
+        timings: Dict[str, Dict[str, Any]] = {}
+
+        def _elapsed_ms() -> float:
+            return round((time.perf_counter() - origin) * 1000, 2)
+
+        async def _run_stage(name: str) -> None:
+            stage = self._stages[name]
+            future = futures[name]
+            try:
+                pending = {futures[dep] for dep in stage["deps"]}
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if any(item.result() is _SKIPPED for item in done):
+                        timings[name] = {"status": "skipped"}
+                        future.set_result(_SKIPPED)
+                        return
+
+                kwargs = {dep: futures[dep].result() for dep in stage["deps"]}
+                if stage["when"] is not None and not stage["when"](**kwargs):
+                    timings[name] = {"status": "skipped"}
+                    future.set_result(_SKIPPED)
+                    return
+
+                start_ms = _elapsed_ms()
+                timings[name] = {"status": "running", "start_ms": start_ms}
+                with span(name) as stage_span:
+                    if inspect.iscoroutinefunction(stage["func"]):
+                        value = await stage["func"](**kwargs)
+                    else:
+                        value = await asyncio.to_thread(stage["func"], **kwargs)
+                    if stage["describe"] is not None:
+                        stage_span.set(**stage["describe"](value))
+                end_ms = _elapsed_ms()
+                timings[name] = {
+                    "status": "done",
+                    "start_ms": start_ms,
+                    "end_ms": end_ms,
+                    "duration_ms": round(end_ms - start_ms, 2),
+                }
+                future.set_result(value)
+                if on_stage_done is not None:
+                    try:
+                        on_stage_done(name, value)
+                    except Exception as exc:
+                        logger.warning("阶段 %s 完成回调失败：%s", name, exc)
+            except asyncio.CancelledError:
+                timings.setdefault(name, {})["status"] = "cancelled"
+                future.cancel()
+                raise
+            except Exception as exc:
+                timings.setdefault(name, {})["status"] = "failed"
+                future.set_exception(exc)
+
+        tasks = [asyncio.create_task(_run_stage(name)) for name in self._stages]
+        try:
+            await asyncio.gather(*(futures[name] for name in outputs))
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for future in futures.values():
+                if future.done() and not future.cancelled():
+                    future.exception()
+
+        results = {
+            name: future.result()
+            for name, future in futures.items()
+            if future.done() and not future.cancelled() and future.exception() is None and future.result() is not _SKIPPED
+        }
+        critical_path = self._critical_path(outputs, timings)
+        logger.info("工作流阶段耗时：%s，关键路径：%s", {k: v.get("duration_ms") for k, v in timings.items()}, critical_path)
+        return {
+            "results": results,
+            "timings": {
+                "total_ms": _elapsed_ms(),
+                "stages": timings,
+                "critical_path": critical_path,
+            },
+        }
+
+    def _critical_path(self, outputs: Iterable[str], timings: Dict[str, Dict[str, Any]]) -> List[str]:
+        """从最晚结束的输出阶段出发，沿最晚结束的依赖回溯。"""
+
+        def _end(name: str) -> float:
+            return timings.get(name, {}).get("end_ms", -1)
+
+        finished = [name for name in outputs if timings.get(name, {}).get("status") == "done"]
+        if not finished:
+            return []
+
+        path = [max(finished, key=_end)]
+        while True:
+            deps = [dep for dep in self._stages[path[-1]]["deps"] if timings.get(dep, {}).get("status") == "done"]
+            if not deps:
+                break
+            path.append(max(deps, key=_end))
+        return list(reversed(path))
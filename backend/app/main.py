@@ -1,26 +1,65 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+# 各模块在导入时读取配置，必须在导入应用模块之前加载 .env。
+load_dotenv()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import logging
 from app.api.v1.nl2sql import router as nl2sql_router
 from app.api.v1.query import router as query_router
 from app.api.v1.schema import router as schema_router
 from app.api.v1.rag import router as rag_router
+from app.api.v1.stats import router as stats_router
+from app.api.v1.metrics import router as metrics_router
+from app.api.v1.catalogs import router as catalogs_router
+from app.core.catalogs import UnknownCatalogError, run_catalog_evictor
+from app.core.llm_client import close_llm_client
+from app.core.priority_lanes import PriorityLaneMiddleware
+from app.core.query_executor import close_connection_pool
+from app.core.query_stats import run_query_stats_flusher
+from app.core.warmup import start_warm_up
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stats_flusher = asyncio.create_task(run_query_stats_flusher())
+    # 空闲或内存超限时释放不活跃数据目录的索引、缓存与连接。
+    catalog_evictor = asyncio.create_task(run_catalog_evictor())
+    # 重依赖与索引在后台预热，不阻塞开始服务。
+    warm_up = start_warm_up()
+    yield
+    stats_flusher.cancel()
+    catalog_evictor.cancel()
+    await asyncio.gather(stats_flusher, catalog_evictor, return_exceptions=True)
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+        await asyncio.gather(warm_up, return_exceptions=True)
+    await close_llm_client()
+    close_connection_pool()
+
 
 app = FastAPI(
     title="DataInsight AI API",
     description="自然语言转 SQL + SQL 执行 + Schema 返回",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 
+# 先注册的中间件在内层：CORS 包在通道外面，429 响应也带跨域头，前端能读到 Retry-After。
+app.add_middleware(PriorityLaneMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],      
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Row-Limit", "X-Result-Truncated"],
 )
 
 
@@ -36,6 +75,14 @@ app.include_router(nl2sql_router)   # 自然语言 → SQL
 app.include_router(query_router)    # 执行 SQL
 app.include_router(schema_router)   # 返回数据库结构
 app.include_router(rag_router) # RAG Schema 调试接口
+app.include_router(stats_router)    # 查询指纹统计
+app.include_router(metrics_router)  # Prometheus 指标
+app.include_router(catalogs_router) # 数据目录列表
+
+
+@app.exception_handler(UnknownCatalogError)
+async def unknown_catalog_handler(request: Request, exc: UnknownCatalogError):
+    return JSONResponse(status_code=404, content={"detail": f"数据目录不存在：{exc.args[0]}"})
 
 
 
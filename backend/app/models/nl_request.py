@@ -1,5 +1,22 @@
 # app/models/nl_request.py
+from typing import List, Literal, Optional
+
 from pydantic import BaseModel
 
+# minimal: 仅 SQL 与校验结果；standard: 另含意图、规则名称、试绑定与阶段耗时；debug: 另含 prompt、schema 文本、LLM 原始输出与规则全文
+Verbosity = Literal["minimal", "standard", "debug"]
+
 class NLRequest(BaseModel):
     text: str
+    verbosity: Optional[Verbosity] = None
+    # 同一会话内的追问复用上一轮的意图、规则与 SQL；不传时每个问题独立处理。
+    session_id: Optional[str] = None
+    # 目标数据目录（见 GET /catalogs），不传时使用默认目录。
+    catalog: Optional[str] = None
+
+
+class NLBatchRequest(BaseModel):
+    questions: List[str]
+    concurrency: Optional[int] = None
+    verbosity: Optional[Verbosity] = None
+    catalog: Optional[str] = None
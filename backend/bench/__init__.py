@@ -0,0 +1 @@
+"""NL2SQL 延迟基准测试：合成数据、回放式 LLM 桩服务与结果对比。"""
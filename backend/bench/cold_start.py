@@ -0,0 +1,200 @@
+"""
+冷启动基准测试：衡量新副本从启动进程到能处理请求要多久。
+
+- imports：在全新解释器里用 -X importtime 导入 app.main，按模块统计累计导入耗时（取多次运行的中位数）；
+- first_request：用 uvicorn 启动服务，记录进程启动到首个 GET / 成功、首个 /nl2sql/ 成功的耗时，
+  以及后台预热完成的时间（来自 /metrics 的 datainsight_warmup）。
+数据与 LLM 均为合成：synthetic 生成 schema / 知识库，LLM 由本地桩服务应答。
+
+用法（backend 目录下）：
+    python -m bench.cold_start --output bench/cold_start.json
+    python -m bench.compare bench/cold_start_baseline.json bench/cold_start.json --fail-over 20
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench import synthetic
+from bench.run_bench import _environment, _free_port, start_llm_stub
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _parse_importtime(stderr: str) -> Dict[str, float]:
+    """解析 -X importtime 输出，返回 {模块: 累计导入耗时 ms}。"""
+    cumulative: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2)) / 1000
+    return cumulative
+
+
+def measure_imports(env: Dict[str, str], repeat: int, top: int) -> Dict[str, Any]:
+    runs: List[Dict[str, float]] = []
+    wall: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app.main"],
+            cwd=synthetic.BACKEND_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        wall.append((time.perf_counter() - started) * 1000)
+        runs.append(_parse_importtime(completed.stderr))
+
+    modules = set().union(*runs)
+    median = {name: round(statistics.median(run.get(name, 0.0) for run in runs), 2) for name in modules}
+    ranked = sorted(median.items(), key=lambda item: item[1], reverse=True)
+    # 应用自身的模块全部列出，第三方模块只列最慢的 top 个。
+    shown = {name: value for name, value in ranked if name.startswith("app.")}
+    shown.update(dict(ranked[:top]))
+    return {
+        "app_main_ms": median.get("app.main", 0.0),
+        "interpreter_wall_ms": round(statistics.median(wall), 2),
+        "modules_ms": dict(sorted(shown.items(), key=lambda item: item[1], reverse=True)),
+        "heavy_modules_loaded": sorted(name for name in ("openai", "torch", "text2vec", "onnxruntime", "faiss") if name in modules),
+    }
+
+
+def _wait_for(check, deadline: float, interval: float = 0.02) -> Optional[float]:
+    while time.perf_counter() < deadline:
+        try:
+            if check():
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(interval)
+    return None
+
+
+def _warm_up_done(client: httpx.Client) -> bool:
+    return 'datainsight_warmup{stat="done"} 1' in client.get("/metrics").text
+
+
+def measure_first_request(env: Dict[str, str], question: str, timeout: float, warm_up: bool) -> Dict[str, Any]:
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=synthetic.BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = started + timeout
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+            ready = _wait_for(lambda: server.poll() is not None or client.get("/").status_code == 200, deadline)
+            if ready is None or server.poll() is not None:
+                raise RuntimeError("服务启动失败或超时")
+            response = client.post("/nl2sql/", json={"text": question, "verbosity": "minimal"})
+            first_nl2sql = time.perf_counter()
+            warmed = _wait_for(lambda: _warm_up_done(client), deadline, interval=0.1) if warm_up else None
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    def _ms(moment: Optional[float]) -> Optional[float]:
+        return round((moment - started) * 1000, 2) if moment is not None else None
+
+    return {
+        "first_response_ms": _ms(ready),
+        "first_nl2sql_ms": _ms(first_nl2sql),
+        "first_nl2sql_status": response.status_code,
+        "warm_up_done_ms": _ms(warmed),
+    }
+
+
+def run_cold_start(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    db_path = os.path.join(workdir, "bench.duckdb")
+    tables = synthetic.generate_database(db_path, args.tables, args.columns, args.rows, args.seed)
+    knowledge_dir = os.path.join(workdir, "knowledge")
+    rule_counts = synthetic.generate_knowledge(knowledge_dir, args.rules, tables, args.seed)
+    replay_path = os.path.join(workdir, "replay.jsonl")
+    synthetic.write_replay_file(replay_path, tables)
+    question = synthetic.generate_questions(1, rule_counts["metrics"], 0.0, args.seed)[0]["text"]
+
+    stub = start_llm_stub(args, replay_path)
+    env = {key: value for key, value in os.environ.items() if key != "LLM_PROVIDERS"}
+    env.update(
+        {
+            "DUCKDB_PATH": db_path,
+            "KNOWLEDGE_DIR": knowledge_dir,
+            "VALUE_INDEX_PATH": os.path.join(workdir, "value_index.json"),
+            "LLM_BASE_URL": stub["base_url"],
+            "LLM_API_KEY": "bench",
+            "LLM_MODEL": "bench-stub",
+            "QUERY_STATS_PATH": os.path.join(workdir, "query_stats.json"),
+            "TELEMETRY_TRACE_LOG": "false",
+            "NL2SQL_CACHE_MAX_ENTRIES": "0",
+            "WARMUP_ON_STARTUP": "false" if args.no_warm_up else "true",
+            "PYTHONPATH": synthetic.BACKEND_DIR,
+        }
+    )
+    try:
+        imports = measure_imports(env, args.repeat, args.top)
+        first_request = measure_first_request(env, question, args.timeout, not args.no_warm_up)
+    finally:
+        stub["process"].terminate()
+        stub["process"].wait(timeout=5)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output",)},
+        "environment": _environment(),
+        "cold_start": {"imports": imports, "first_request": first_request},
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="NL2SQL 服务冷启动基准测试")
+    parser.add_argument("--tables", type=int, default=100, help="合成表数量")
+    parser.add_argument("--columns", type=int, default=12, help="每张表额外的随机列数")
+    parser.add_argument("--rows", type=int, default=50, help="每张表的行数")
+    parser.add_argument("--rules", type=int, default=1000, help="知识库规则数量")
+    parser.add_argument("--repeat", type=int, default=3, help="导入耗时测量次数（取中位数）")
+    parser.add_argument("--top", type=int, default=15, help="列出最慢的第三方模块数量")
+    parser.add_argument("--timeout", type=float, default=120, help="等待服务就绪的最长秒数")
+    parser.add_argument("--no-warm-up", action="store_true", help="关闭启动预热，测量纯按需加载")
+    parser.add_argument("--llm-latency-dist", choices=["normal", "lognormal", "uniform", "fixed"], default="fixed")
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0)
+    parser.add_argument("--llm-token-interval-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=None, help="合成数据目录，默认使用临时目录")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认输出到标准输出")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = run_cold_start(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="nl2sql-cold-start-") as workdir:
+            report = run_cold_start(args, workdir)
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+对比两次基准测试结果。
+
+    python -m bench.compare baseline.json current.json --fail-over 10
+
+逐项输出延迟分位数、吞吐和峰值 RSS 的变化（冷启动结果则对比导入耗时与首个请求耗时，Embedding 后端结果对比 recall@k、查询延迟与模型内存）；指定 --fail-over 时，任一延迟/内存指标变差超过该百分比
+（或吞吐下降超过该百分比）即以非零状态退出，便于在 CI 中拦截回退。
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _metrics(report: Dict[str, Any]) -> Iterator[Tuple[str, float, bool]]:
+    """产出 (指标名, 数值, 是否越大越好)。"""
+    for section in ("nl2sql", "query"):
+        data = report.get(section)
+        if not data:
+            continue
+        yield f"{section}.throughput_rps", data.get("throughput_rps", 0.0), True
+        for key in ("p50", "p95", "p99"):
+            yield f"{section}.latency_ms.{key}", (data.get("latency_ms") or {}).get(key, 0.0), False
+        for stage, summary in (data.get("stages_ms") or {}).items():
+            for key in ("p50", "p95", "p99"):
+                yield f"{section}.stages_ms.{stage}.{key}", summary.get(key, 0.0), False
+    if "setup" in report:
+        yield "setup.first_request_ms", report["setup"].get("first_request_ms", 0.0), False
+    if "peak_rss_mb" in report:
+        yield "peak_rss_mb", report["peak_rss_mb"], False
+
+    cold_start = report.get("cold_start") or {}
+    for key, value in (cold_start.get("first_request") or {}).items():
+        if key.endswith("_ms") and value is not None:
+            yield f"cold_start.{key}", value, False
+    imports = cold_start.get("imports") or {}
+    if imports:
+        yield "cold_start.import_app_main_ms", imports.get("app_main_ms", 0.0), False
+        for module, value in (imports.get("modules_ms") or {}).items():
+            if module.startswith("app."):
+                yield f"cold_start.import_ms.{module}", value, False
+
+    for spec, data in (report.get("embedding") or {}).items():
+        if not data.get("available"):
+            continue
+        for k, value in (data.get("recall_at_k") or {}).items():
+            yield f"embedding.{spec}.recall_at_{k}", value, True
+        for key in ("p50", "p95"):
+            yield f"embedding.{spec}.query_ms.{key}", (data.get("query_ms") or {}).get(key, 0.0), False
+        yield f"embedding.{spec}.model_rss_mb", data.get("model_rss_mb", 0.0), False
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    before = {name: (value, higher_is_better) for name, value, higher_is_better in _metrics(baseline)}
+    rows = []
+    for name, value, higher_is_better in _metrics(current):
+        if name not in before:
+            continue
+        base = before[name][0]
+        change = (value - base) / base * 100 if base else 0.0
+        regression = -change if higher_is_better else change
+        rows.append({"metric": name, "baseline": base, "current": value, "change_pct": round(change, 2), "regression_pct": round(regression, 2)})
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="对比两次 NL2SQL 基准测试结果")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--fail-over", type=float, default=None, help="回退超过该百分比时返回非零状态")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出对比结果")
+    args = parser.parse_args(argv)
+
+    baseline, current = _load(args.baseline), _load(args.current)
+    if baseline.get("config", {}).get("tables") != current.get("config", {}).get("tables") or baseline.get("config", {}).get(
+        "rules"
+    ) != current.get("config", {}).get("rules"):
+        print("警告：两次运行的数据规模不同，结果不可直接比较。", file=sys.stderr)
+
+    rows = compare(baseline, current)
+    failed = [row for row in rows if args.fail_over is not None and row["regression_pct"] > args.fail_over]
+    if args.json:
+        print(json.dumps({"rows": rows, "failed": [row["metric"] for row in failed]}, ensure_ascii=False, indent=2))
+    else:
+        width = max((len(row["metric"]) for row in rows), default=10)
+        print(f"{'metric':<{width}}  {'baseline':>12}  {'current':>12}  {'change':>9}")
+        for row in rows:
+            flag = "  !" if row in failed else ""
+            print(f"{row['metric']:<{width}}  {row['baseline']:>12.2f}  {row['current']:>12.2f}  {row['change_pct']:>+8.2f}%{flag}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Embedding 后端基准测试：在同一份 schema 与问题集上对比各后端的表检索 recall@k、单次查询延迟和内存。
+
+每个后端在独立子进程中测量（互不影响内存统计），依次记录：
+- load_ms：导入依赖并加载模型；
+- index_build_ms：编码全部表描述并建 FAISS 索引；
+- query_ms：单个问题“编码 + 检索”的 p50/p95/p99（先跑一次预热，不计入）；
+- recall_at_k：期望表出现在前 k 个结果中的比例（按问题取平均）；
+- rss_mb：子进程峰值 RSS，model_rss_mb 为加载模型前后的增量。
+
+问题集为 JSONL，每行 {"text": "问题", "tables": ["期望表名", ...]}；不指定时按每张表的注释与列注释生成。
+不指定 --duckdb 时使用合成库。
+
+用法（backend 目录下）：
+    python -m bench.embedding_backends --duckdb app/example.duckdb --questions retrieval.jsonl \\
+        --backend text2vec:BAAI/bge-large-zh --backend text2vec:BAAI/bge-small-zh-v1.5 --backend onnx:app/models/minilm \\
+        --output embedding-bench.json
+    python -m bench.compare embedding-baseline.json embedding-bench.json --fail-over 10
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from bench import synthetic
+from bench.run_bench import _environment, peak_rss_mb, summarize
+
+DEFAULT_KS = (1, 3, 5, 10)
+
+
+def derive_questions(tables: List[Dict[str, Any]], limit: int, seed: int) -> List[Dict[str, Any]]:
+    """没有人工标注的问题集时，用表注释和列注释拼出问题，期望命中该表本身。"""
+    rng = random.Random(seed)
+    questions = []
+    for table in tables:
+        subject = (table.get("comment") or table["table_name"]).rstrip("表")
+        column_comments = [col.get("comment") for col in table["columns"] if col.get("comment")]
+        column = rng.choice(column_comments) if column_comments else rng.choice(table["columns"])["name"]
+        questions.append({"text": f"查询{subject}中每月的{column}", "tables": [table["table_name"]]})
+    rng.shuffle(questions)
+    return questions[:limit] if limit else questions
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def _current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as handle:
+            return round(int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except OSError:
+        return peak_rss_mb()
+
+
+def measure_backend(spec: str, questions_path: str, ks: List[int]) -> Dict[str, Any]:
+    """在当前进程中测量一个后端；由 --worker 子进程调用，DUCKDB_PATH 已指向待测库。"""
+    import faiss
+
+    from app.core.embedding_backends import create_embedding_backend
+    from app.core.schema_index import _normalize, _normalize_full_schema, _table_meta_to_text
+    from app.core.schema_service import get_full_schema
+
+    tables = _normalize_full_schema(get_full_schema())
+    questions = load_questions(questions_path)
+    rss_before = _current_rss_mb()
+
+    backend = create_embedding_backend(spec)
+    if not backend.available():
+        return {"available": False, "backend": backend.describe()}
+
+    started = time.perf_counter()
+    backend.load()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    embeddings = _normalize(backend.encode([_table_meta_to_text(table) for table in tables]))
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    index_build_ms = (time.perf_counter() - started) * 1000
+
+    names = [table["table_name"] for table in tables]
+    top_k = max(ks)
+    backend.encode([questions[0]["text"]])
+    latencies: List[float] = []
+    recall = {k: 0.0 for k in ks}
+    for question in questions:
+        started = time.perf_counter()
+        _, indices = index.search(_normalize(backend.encode([question["text"]])), top_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        ranked = [names[idx] for idx in indices[0] if idx != -1]
+        expected = set(question["tables"])
+        for k in ks:
+            recall[k] += len(expected & set(ranked[:k])) / len(expected)
+
+    return {
+        "available": True,
+        "backend": backend.describe(),
+        "dimension": int(embeddings.shape[1]),
+        "tables": len(tables),
+        "questions": len(questions),
+        "load_ms": round(load_ms, 2),
+        "index_build_ms": round(index_build_ms, 2),
+        "query_ms": summarize(latencies),
+        "recall_at_k": {str(k): round(recall[k] / len(questions), 4) for k in ks},
+        "rss_mb": peak_rss_mb(),
+        "model_rss_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+
+def run_backend(spec: str, db_path: str, questions_path: str, ks: List[int], timeout: float) -> Dict[str, Any]:
+    pythonpath = os.pathsep.join(filter(None, [synthetic.BACKEND_DIR, os.environ.get("PYTHONPATH")]))
+    env = dict(os.environ, DUCKDB_PATH=db_path, PYTHONPATH=pythonpath)
+    command = [sys.executable, "-m", "bench.embedding_backends", "--worker", spec, "--questions", questions_path]
+    command += ["--k", ",".join(str(k) for k in ks)]
+    completed = subprocess.run(command, cwd=synthetic.BACKEND_DIR, env=env, capture_output=True, text=True, timeout=timeout)
+    if completed.returncode != 0:
+        return {"available": False, "error": completed.stderr.strip().splitlines()[-1:] or ["子进程异常退出"]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run_embedding_bench(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    db_path = args.duckdb
+    if not db_path:
+        db_path = os.path.join(workdir, "bench.duckdb")
+        synthetic.generate_database(db_path, args.tables, args.columns, 0, args.seed)
+
+    questions_path = args.questions
+    if not questions_path:
+        os.environ["DUCKDB_PATH"] = db_path
+        from app.core.schema_index import _normalize_full_schema
+        from app.core.schema_service import get_full_schema
+
+        questions = derive_questions(_normalize_full_schema(get_full_schema()), args.max_questions, args.seed)
+        questions_path = os.path.join(workdir, "questions.jsonl")
+        with open(questions_path, "w", encoding="utf-8") as handle:
+            for question in questions:
+                handle.write(json.dumps(question, ensure_ascii=False) + "\n")
+
+    ks = [int(k) for k in args.k.split(",")]
+    results = {}
+    for spec in args.backend or ["text2vec"]:
+        results[spec] = run_backend(spec, db_path, questions_path, ks, args.timeout)
+        print(f"{spec}: {json.dumps(results[spec], ensure_ascii=False)}", file=sys.stderr)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "worker")},
+        "environment": _environment(),
+        "embedding": results,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Embedding 后端 recall / 延迟 / 内存基准测试")
+    parser.add_argument("--backend", action="append", help="后端，如 text2vec、text2vec:BAAI/bge-small-zh-v1.5、onnx:app/models/minilm，可重复")
+    parser.add_argument("--duckdb", default=None, help="待测 DuckDB 文件，默认生成合成库")
+    parser.add_argument("--questions", default=None, help="JSONL 问题集（text + 期望 tables），默认按 schema 生成")
+    parser.add_argument("--k", default=",".join(str(k) for k in DEFAULT_KS), help="逗号分隔的 recall@k")
+    parser.add_argument("--tables", type=int, default=200, help="合成表数量（未指定 --duckdb 时）")
+    parser.add_argument("--columns", type=int, default=12, help="合成表的额外列数")
+    parser.add_argument("--max-questions", type=int, default=200, help="自动生成问题的数量上限")
+    parser.add_argument("--timeout", type=float, default=1800, help="单个后端的最长测量秒数")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=None, help="合成数据目录，默认使用临时目录")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认输出到标准输出")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.worker:
+        print(json.dumps(measure_backend(args.worker, args.questions, [int(k) for k in args.k.split(",")]), ensure_ascii=False))
+        return
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = run_embedding_bench(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="nl2sql-embedding-") as workdir:
+            report = run_embedding_bench(args, workdir)
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+NL2SQL 延迟基准测试。
+
+在合成的 schema / 知识库上以固定并发运行 run_nl2sql_workflow 与 /query 背后的 run_sql，
+LLM 由本地桩服务按回放文件应答、按指定分布注入延迟；输出各阶段 p50/p95/p99、吞吐与峰值 RSS 的 JSON。
+
+用法（backend 目录下）：
+    python -m bench.run_bench --tables 100 --rules 1000 --requests 200 --concurrency 16 --output bench/result.json
+    python -m bench.compare bench/baseline.json bench/result.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bench import synthetic
+
+STUB_SERVER = os.path.join(synthetic.BACKEND_DIR, "tools", "llm_stub_server.py")
+
+
+def percentile(samples: List[float], value: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(value * len(ordered)) - 1))
+    return round(ordered[index], 2)
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples), 2) if samples else 0.0,
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "max": round(max(samples), 2) if samples else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位。
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_llm_stub(args: argparse.Namespace, replay_path: str) -> Dict[str, Any]:
+    port = _free_port()
+    command = [
+        sys.executable,
+        STUB_SERVER,
+        "--port", str(port),
+        "--replay", replay_path,
+        "--latency-dist", args.llm_latency_dist,
+        "--latency-ms", str(args.llm_latency_ms),
+        "--jitter-ms", str(args.llm_jitter_ms),
+        "--token-interval-ms", str(args.llm_token_interval_ms),
+        "--seed", str(args.seed),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return {"process": process, "base_url": f"http://127.0.0.1:{port}/v1"}
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("LLM 桩服务启动超时")
+
+
+async def run_fixed_concurrency(
+    items: List[Any],
+    concurrency: int,
+    func: Callable[[Any], Awaitable[Dict[str, Any]]],
+) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    records: List[Dict[str, Any]] = []
+
+    async def one(item: Any) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                record = await func(item)
+                record["ok"] = True
+            except Exception as exc:
+                record = {"ok": False, "error": type(exc).__name__}
+            record["latency_ms"] = (time.perf_counter() - started) * 1000
+            records.append(record)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(item) for item in items))
+    wall = time.perf_counter() - started
+    return {"records": records, "wall_seconds": wall}
+
+
+def _nl2sql_report(run: Dict[str, Any], concurrency: int) -> Dict[str, Any]:
+    records = run["records"]
+    ok = [record for record in records if record["ok"]]
+    stages: Dict[str, List[float]] = defaultdict(list)
+    for record in ok:
+        for name, timing in record["stages"].items():
+            if timing.get("status") == "done":
+                stages[name].append(timing["duration_ms"])
+    return {
+        "concurrency": concurrency,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "error_types": dict(Counter(record["error"] for record in records if not record["ok"])),
+        "throughput_rps": round(len(ok) / run["wall_seconds"], 2) if run["wall_seconds"] else 0.0,
+        "latency_ms": summarize([record["latency_ms"] for record in ok]),
+        "stages_ms": {name: summarize(samples) for name, samples in sorted(stages.items())},
+        "generation_modes": dict(Counter(record["mode"] for record in ok)),
+        "valid_ratio": round(sum(record["valid"] for record in ok) / len(ok), 4) if ok else 0.0,
+    }
+
+
+def _query_report(run: Dict[str, Any], concurrency: int) -> Dict[str, Any]:
+    records = run["records"]
+    ok = [record for record in records if record["ok"]]
+    return {
+        "concurrency": concurrency,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "throughput_rps": round(len(ok) / run["wall_seconds"], 2) if run["wall_seconds"] else 0.0,
+        "latency_ms": summarize([record["latency_ms"] for record in ok]),
+        "rows": summarize([record["rows"] for record in ok]),
+    }
+
+
+def _environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=synthetic.BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "duckdb": synthetic.duckdb.__version__,
+        "git_commit": commit,
+    }
+
+
+async def run_benchmark(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    setup: Dict[str, float] = {}
+
+    started = time.perf_counter()
+    db_path = os.path.join(workdir, "bench.duckdb")
+    tables = synthetic.generate_database(db_path, args.tables, args.columns, args.rows, args.seed)
+    setup["generate_database_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    started = time.perf_counter()
+    knowledge_dir = os.path.join(workdir, "knowledge")
+    rule_counts = synthetic.generate_knowledge(knowledge_dir, args.rules, tables, args.seed)
+    setup["generate_knowledge_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    replay_path = args.replay or os.path.join(workdir, "replay.jsonl")
+    if not args.replay:
+        synthetic.write_replay_file(replay_path, tables)
+    stub = start_llm_stub(args, replay_path)
+
+    # 应用模块在导入时读取配置，必须先设置环境变量再导入。
+    os.environ.pop("LLM_PROVIDERS", None)
+    os.environ.update(
+        {
+            "DUCKDB_PATH": db_path,
+            "KNOWLEDGE_DIR": knowledge_dir,
+            "LLM_BASE_URL": stub["base_url"],
+            "LLM_API_KEY": "bench",
+            "LLM_MODEL": "bench-stub",
+            "LLM_HEDGE_ENABLED": "false",
+            "QUERY_STATS_PATH": os.path.join(workdir, "query_stats.json"),
+            "TELEMETRY_TRACE_LOG": "false",
+            "NL2SQL_CACHE_MAX_ENTRIES": os.getenv("NL2SQL_CACHE_MAX_ENTRIES", "1000") if args.with_cache else "0",
+        }
+    )
+    from app.core.llm_client import close_llm_client
+    from app.core.nl2sql_workflow import run_nl2sql_workflow
+    from app.core.query_executor import run_sql
+
+    try:
+        questions = synthetic.generate_questions(args.questions, rule_counts["metrics"], args.rule_share, args.seed)
+        workload = [questions[index % len(questions)]["text"] for index in range(args.requests)]
+
+        async def ask(question: str) -> Dict[str, Any]:
+            result = await run_nl2sql_workflow(question)
+            return {
+                "stages": result["stage_timings"]["stages"],
+                "mode": result.get("generation_mode"),
+                "valid": bool((result.get("validation") or {}).get("is_valid")),
+            }
+
+        async def query(sql: str) -> Dict[str, Any]:
+            return {"rows": len(await run_sql(sql))}
+
+        started = time.perf_counter()
+        first = await run_fixed_concurrency(workload[:1], 1, ask)
+        setup["first_request_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if args.warmup > 1:
+            await run_fixed_concurrency(workload[: args.warmup], args.concurrency, ask)
+
+        nl2sql_run = await run_fixed_concurrency(workload, args.concurrency, ask)
+        queries = synthetic.generate_queries(args.query_requests, tables, args.seed)
+        query_run = await run_fixed_concurrency(queries, args.query_concurrency, query)
+    finally:
+        await close_llm_client()
+        stub["process"].terminate()
+        stub["process"].wait(timeout=5)
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output",)},
+        "environment": _environment(),
+        "dataset": {"tables": len(tables), "rules": rule_counts, "questions": len(questions)},
+        "setup": {**setup, "first_request_ok": first["records"][0]["ok"]},
+        "nl2sql": _nl2sql_report(nl2sql_run, args.concurrency),
+        "query": _query_report(query_run, args.query_concurrency),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="NL2SQL 延迟基准测试")
+    parser.add_argument("--tables", type=int, default=100, help="合成表数量（10 ~ 10000）")
+    parser.add_argument("--columns", type=int, default=12, help="每张表额外的随机列数")
+    parser.add_argument("--rows", type=int, default=50, help="每张表的行数")
+    parser.add_argument("--rules", type=int, default=1000, help="知识库规则数量（10 ~ 50000）")
+    parser.add_argument("--questions", type=int, default=50, help="不同问题的数量")
+    parser.add_argument("--rule-share", type=float, default=0.5, help="可由规则直接编译的问题占比")
+    parser.add_argument("--requests", type=int, default=200, help="NL2SQL 请求总数")
+    parser.add_argument("--concurrency", type=int, default=16, help="NL2SQL 固定并发数")
+    parser.add_argument("--warmup", type=int, default=1, help="预热请求数（不计入统计）")
+    parser.add_argument("--query-requests", type=int, default=200, help="/query 请求总数")
+    parser.add_argument("--query-concurrency", type=int, default=8, help="/query 固定并发数")
+    parser.add_argument("--with-cache", action="store_true", help="启用答案缓存（默认关闭以测量完整链路）")
+    parser.add_argument("--replay", default=None, help="LLM 回放文件，默认使用合成的匹配规则")
+    parser.add_argument("--llm-latency-dist", choices=["normal", "lognormal", "uniform", "fixed"], default="lognormal")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=400)
+    parser.add_argument("--llm-token-interval-ms", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=None, help="合成数据目录，默认使用临时目录")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认输出到标准输出")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        report = asyncio.run(run_benchmark(args, args.workdir))
+    else:
+        with tempfile.TemporaryDirectory(prefix="nl2sql-bench-") as workdir:
+            report = asyncio.run(run_benchmark(args, workdir))
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
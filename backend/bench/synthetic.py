@@ -0,0 +1,158 @@
+"""
+基准测试用的合成数据：指定规模的 DuckDB 库、知识库 JSON、问题集和 LLM 回放文件。
+同一个 seed 生成完全相同的数据，便于不同版本之间对比。
+"""
+
+import json
+import os
+import random
+import shutil
+from typing import Any, Dict, List
+
+import duckdb
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+SOURCE_KNOWLEDGE_DIR = os.path.join(BACKEND_DIR, "app", "knowledge")
+
+_EXTRA_COLUMN_TYPES = ["VARCHAR", "INTEGER", "DOUBLE", "DATE", "DECIMAL(18,2)"]
+_TABLE_TOPICS = ["收入", "客户", "交易", "员工", "营业部", "产品", "账户", "考核", "佣金", "资产"]
+
+
+def table_name(index: int) -> str:
+    return f"bench_t{index:05d}"
+
+
+def metric_name(index: int) -> str:
+    return f"合成指标{index:05d}"
+
+
+def term_name(index: int) -> str:
+    return f"合成口径{index:05d}"
+
+
+def generate_database(path: str, table_count: int, extra_columns: int = 12, rows_per_table: int = 50, seed: int = 7) -> List[str]:
+    """生成 table_count 张表；每张表都有 ryid/mon/zbdm/zbz 四个事实列，另加 extra_columns 个随机列。"""
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+
+    names = [table_name(index) for index in range(table_count)]
+    with duckdb.connect(path) as conn:
+        for index, name in enumerate(names):
+            extras = [(f"c{col:02d}", rng.choice(_EXTRA_COLUMN_TYPES)) for col in range(extra_columns)]
+            columns = ["ryid VARCHAR", "mon INTEGER", "zbdm VARCHAR", "zbz DOUBLE"] + [f"{col} {col_type}" for col, col_type in extras]
+            conn.execute(f"CREATE TABLE {name} ({', '.join(columns)})")
+            topic = _TABLE_TOPICS[index % len(_TABLE_TOPICS)]
+            conn.execute(f"COMMENT ON TABLE {name} IS '合成{topic}表{index:05d}'")
+            conn.execute(f"COMMENT ON COLUMN {name}.ryid IS '员工编号'")
+            conn.execute(f"COMMENT ON COLUMN {name}.mon IS '月份 YYYYMM'")
+            conn.execute(f"COMMENT ON COLUMN {name}.zbdm IS '指标编码'")
+            conn.execute(f"COMMENT ON COLUMN {name}.zbz IS '指标值'")
+            if rows_per_table:
+                conn.execute(
+                    f"""
+                    INSERT INTO {name} (ryid, mon, zbdm, zbz)
+                    SELECT 'E' || lpad(CAST(i % 200 AS VARCHAR), 4, '0'),
+                           202601 + (i % 12),
+                           'M' || lpad(CAST(i % 100 AS VARCHAR), 5, '0'),
+                           (i * 37 % 1000) / 10.0
+                    FROM range({rows_per_table}) t(i)
+                    """
+                )
+    return names
+
+
+def generate_knowledge(directory: str, rule_count: int, tables: List[str], seed: int = 7) -> Dict[str, int]:
+    """按 6:2:2 生成指标、业务术语、关联规则，时间规则沿用仓库里的版本。"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    metric_count = max(1, rule_count * 6 // 10)
+    term_count = max(1, rule_count * 2 // 10)
+    join_count = max(1, rule_count - metric_count - term_count)
+
+    metrics = [
+        {
+            "id": f"metric_{index:05d}",
+            "name": metric_name(index),
+            "aliases": [f"合成别名{index:05d}"],
+            "keywords": [_TABLE_TOPICS[index % len(_TABLE_TOPICS)], "指标"],
+            "description": f"合成指标 {index}，来自 {tables[index % len(tables)]}。",
+            "source_table": tables[index % len(tables)],
+            "code_field": "zbdm",
+            "code_value": f"M{index:05d}",
+            "value_field": "zbz",
+            "default_aggregation": "sum",
+        }
+        for index in range(metric_count)
+    ]
+    terms = []
+    for index in range(term_count):
+        required = rng.sample(tables, k=min(2, len(tables)))
+        terms.append(
+            {
+                "id": f"term_{index:05d}",
+                "name": term_name(index),
+                "keywords": [_TABLE_TOPICS[index % len(_TABLE_TOPICS)], "口径"],
+                "description": f"合成业务口径 {index}。",
+                "required_tables": required,
+                "join_keys": [f"{required[0]}.ryid = {required[-1]}.ryid"],
+                "logic_steps": ["按员工编号关联", "按月份过滤"],
+                "sql_hint": f"from {required[0]} a join {required[-1]} b on a.ryid = b.ryid",
+            }
+        )
+    joins = []
+    for index in range(join_count):
+        pair = rng.sample(tables, k=min(2, len(tables)))
+        joins.append(
+            {
+                "id": f"join_{index:05d}",
+                "name": f"合成关联{index:05d}",
+                "keywords": [_TABLE_TOPICS[index % len(_TABLE_TOPICS)], "关联"],
+                "description": "合成关联规则。",
+                "tables": pair,
+                "join_keys": [f"{pair[0]}.ryid = {pair[-1]}.ryid"],
+                "sql_hint": f"from {pair[0]} t join {pair[-1]} t1 on t.ryid = t1.ryid",
+            }
+        )
+
+    for filename, entries in [("metrics.json", metrics), ("business_terms.json", terms), ("join_rules.json", joins)]:
+        with open(os.path.join(directory, filename), "w", encoding="utf-8") as handle:
+            json.dump(entries, handle, ensure_ascii=False)
+    shutil.copy(os.path.join(SOURCE_KNOWLEDGE_DIR, "time_rules.json"), os.path.join(directory, "time_rules.json"))
+    return {"metrics": metric_count, "business_terms": term_count, "join_rules": join_count}
+
+
+def generate_questions(count: int, metric_count: int, rule_share: float = 0.5, seed: int = 7) -> List[Dict[str, Any]]:
+    """一部分问题可由规则直接编译（指标 + 月份），其余需要 LLM（排名、口径组合）。"""
+    rng = random.Random(seed)
+    questions = []
+    for index in range(count):
+        metric = metric_name(rng.randrange(metric_count))
+        month = rng.randint(1, 12)
+        if rng.random() < rule_share:
+            questions.append({"text": f"2026年{month}月{metric}", "expected_path": "rule"})
+        else:
+            questions.append({"text": f"查询2026年{month}月{metric}排名前10的员工", "expected_path": "llm"})
+    return questions
+
+
+def generate_queries(count: int, tables: List[str], seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        f"SELECT ryid, SUM(zbz) AS value FROM {rng.choice(tables)} WHERE mon = {202601 + rng.randrange(12)} "
+        f"GROUP BY ryid ORDER BY value DESC LIMIT 10"
+        for _ in range(count)
+    ]
+
+
+def write_replay_file(path: str, tables: List[str]) -> None:
+    """默认回放规则：意图解析返回空 JSON（沿用规则解析），SQL 生成返回一条能通过试绑定的查询。"""
+    sql = f"SELECT ryid, SUM(zbz) AS value FROM {tables[0]} WHERE mon = 202601 GROUP BY ryid ORDER BY value DESC LIMIT 10"
+    entries = [
+        {"match": "查询解析器", "response": "{}"},
+        {"match": "SQL 助手", "response": f"```sql\n{sql}\n```"},
+    ]
+    with open(path, "w", encoding="utf-8") as handle:
+        for entry in entries:
+            handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接 import app.*，与 uvicorn 从 backend 目录启动时的导入路径一致。
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.core.answer_cache import AnswerCache, is_cacheable  # noqa: E402
+
+VERSIONS = {"schema": "s1", "snapshot": "snap-1", "knowledge": "k1"}
+SLOTS = {"literals": ["202601"], "values": [], "unresolved": [], "metrics": ["新增客户收入"], "business_terms": []}
+RESULT = {"sql": "SELECT 1", "validation": {"is_valid": True, "warnings": []}}
+
+
+def _vector(*values):
+    vector = np.array(values, dtype="float32")
+    return vector / np.linalg.norm(vector)
+
+
+def test_exact_lookup_normalizes_question_and_copies_result():
+    cache = AnswerCache()
+    cache.store("2026年1月新增客户收入？", SLOTS, _vector(1, 0), VERSIONS, RESULT)
+    hit = cache.lookup_exact(" 2026年1月新增客户收入 ", VERSIONS)
+    assert hit["sql"] == "SELECT 1"
+    assert hit["cache"] == {"hit": True, "match": "exact", "similarity": 1.0, "cached_question": "2026年1月新增客户收入？"}
+    hit["sql"] = "changed"
+    assert cache.lookup_exact("2026年1月新增客户收入", VERSIONS)["sql"] == "SELECT 1"
+    assert cache.lookup_exact("2026年2月新增客户收入", VERSIONS) is None
+
+
+def test_semantic_lookup_respects_threshold_and_slots():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.store("2026年1月新增客户收入", SLOTS, _vector(1, 0), VERSIONS, RESULT)
+
+    hit = cache.lookup_semantic(SLOTS, _vector(1, 0.1), VERSIONS)
+    assert hit["cache"]["match"] == "semantic" and hit["cache"]["similarity"] >= 0.95
+    assert cache.lookup_semantic(SLOTS, _vector(1, 1), VERSIONS) is None, "相似度 0.71 低于阈值"
+    assert cache.lookup_semantic({**SLOTS, "literals": ["202602"]}, _vector(1, 0), VERSIONS) is None, "槽位不同不复用"
+    assert cache.lookup_semantic(SLOTS, None, VERSIONS) is None
+    assert cache.stats()["semantic_hits"] == 1 and cache.stats()["misses"] == 3
+
+
+@pytest.mark.parametrize("changed", ["schema", "snapshot", "knowledge"])
+def test_version_change_invalidates_entries(changed):
+    cache = AnswerCache()
+    cache.store("本月佣金", SLOTS, _vector(1, 0), VERSIONS, RESULT)
+    cache.store("本月收入", SLOTS, _vector(0, 1), VERSIONS, RESULT)
+    new_versions = {**VERSIONS, changed: "v2"}
+    assert cache.lookup_exact("本月佣金", new_versions) is None
+    assert cache.lookup_semantic(SLOTS, _vector(0, 1), new_versions) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["stale_evictions"] == 2
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = AnswerCache(max_entries=2)
+    cache.store("a", SLOTS, _vector(1, 0), VERSIONS, RESULT)
+    cache.store("b", SLOTS, _vector(0, 1), VERSIONS, RESULT)
+    assert cache.lookup_exact("a", VERSIONS) is not None
+    cache.store("c", SLOTS, _vector(1, 1), VERSIONS, RESULT)
+    assert cache.lookup_exact("b", VERSIONS) is None
+    assert cache.lookup_exact("a", VERSIONS) is not None and cache.lookup_exact("c", VERSIONS) is not None
+    assert cache.stats()["lru_evictions"] == 1
+
+
+def test_only_clean_results_are_cacheable():
+    assert is_cacheable(RESULT)
+    assert not is_cacheable({**RESULT, "validation": {"is_valid": True, "warnings": ["全表扫描"]}})
+    assert not is_cacheable({"sql": "", "validation": {"is_valid": True}})
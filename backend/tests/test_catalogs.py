@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from app.core import catalogs
+from app.core.catalogs import CatalogRegistry
+
+
+class _Pool:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = CatalogRegistry([{"name": name, "duckdb_path": f"/tmp/{name}.duckdb"} for name in ["a", "b", "c", "d"]])
+    monkeypatch.setattr(catalogs, "_registry", registry)
+    monkeypatch.setattr(catalogs, "CATALOG_IDLE_SECONDS", 600)
+    monkeypatch.setattr(catalogs, "CATALOG_MEMORY_LIMIT_MB", 0)
+    monkeypatch.setattr(catalogs, "CATALOG_MIN_IDLE_SECONDS", 60)
+    return registry
+
+
+def _load(catalog, last_used):
+    pool = catalog.get_state("connection_pool", _Pool)
+    catalog.last_used = last_used
+    return pool
+
+
+def test_idle_catalogs_are_released_unless_busy(registry):
+    a, b, c, _ = registry.catalogs()
+    pool_a, pool_b = _load(a, 100), _load(b, 100)
+    _load(c, 900)
+    b.enter()
+    b.last_used = 100
+
+    assert registry.evict_idle(now=1000) == ["a"]
+    assert pool_a.closed and not a.state and a.evictions == 1
+    assert not pool_b.closed and b.state, "有进行中请求的目录不回收"
+    assert c.state, "最近用过的目录不回收"
+
+    b.exit()
+    assert registry.evict_idle(now=time.monotonic() + 601) == ["b", "c"]
+    assert pool_b.closed and registry.stats()["idle_evictions"] == 3
+
+
+def test_release_rechecks_under_the_lock(registry):
+    catalog = registry.get("a")
+    _load(catalog, 100)
+    # 挑选时还空闲，释放前有请求进入：以释放时的检查为准。
+    catalog.enter()
+    assert catalog.release(idle_before=1000) == []
+    catalog.exit()
+    assert catalog.release(idle_before=time.monotonic() - 1) == [], "刚用过"
+    assert catalog.release(idle_before=time.monotonic() + 1) == ["connection_pool"]
+
+
+def test_eviction_never_closes_state_in_use(registry, monkeypatch):
+    monkeypatch.setattr(catalogs, "CATALOG_IDLE_SECONDS", 0)
+    stop = threading.Event()
+    errors = []
+
+    def worker():
+        while not stop.is_set():
+            with catalogs.use_catalog("a"):
+                pool = catalogs.current_catalog().get_state("connection_pool", _Pool)
+                time.sleep(0)
+                if pool.closed:
+                    errors.append("在用的状态被回收")
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        registry.evict_idle(now=time.monotonic() + 1)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert registry.get("a").active == 0
+
+
+def test_memory_pressure_evicts_least_recently_used(registry, monkeypatch):
+    monkeypatch.setattr(catalogs, "CATALOG_MEMORY_LIMIT_MB", 1000)
+    readings = iter([1200, 900, 900])
+    monkeypatch.setattr(catalogs, "_current_rss_mb", lambda: next(readings))
+    a, b, c, d = registry.catalogs()
+    _load(a, 800)
+    _load(b, 700)
+    _load(c, 750)
+    _load(d, 980)
+
+    assert registry.evict_idle(now=1000, rss_mb=1500) == ["b", "c"]
+    assert a.state and d.state
+    assert registry.stats()["memory_evictions"] == 2
+
+
+def test_memory_eviction_skips_recent_and_busy_catalogs(registry, monkeypatch):
+    monkeypatch.setattr(catalogs, "CATALOG_MEMORY_LIMIT_MB", 1000)
+    monkeypatch.setattr(catalogs, "_current_rss_mb", lambda: 1500)
+    a, b, _, _ = registry.catalogs()
+    _load(a, 990)
+    _load(b, 500)
+    b.enter()
+    b.last_used = 500
+    assert registry.evict_idle(now=1000, rss_mb=1500) == []
+    b.exit()
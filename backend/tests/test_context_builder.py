@@ -0,0 +1,45 @@
+from app.core.context_builder import build_sql_generation_prompt, estimate_tokens
+from app.core.knowledge_base import load_knowledge_base
+
+SCHEMA = {
+    "tygyjzbtj": {
+        "comment": "员工收入指标表",
+        "columns": [{"name": name, "type": "VARCHAR"} for name in ["ryid", "mon", "zbdm", "zbz"]],
+    }
+}
+
+
+def _prompt(budget, time_rules=()):
+    return build_sql_generation_prompt(
+        "2026年1月新增客户收入",
+        {"metrics": ["新增客户收入"]},
+        [{"table_name": f"t{index}", "columns": [{"name": f"c{index}_{col}", "type": "INTEGER"} for col in range(8)]} for index in range(80)],
+        [],
+        [],
+        [],
+        list(time_rules),
+        [],
+        full_schema=SCHEMA,
+        token_budget=budget,
+    )
+
+
+def test_time_rules_only_enter_the_dynamic_part_when_matched():
+    time_rules = load_knowledge_base()["time_rules"]
+    assert time_rules
+    unmatched = _prompt(3000)
+    system, user = (message["content"] for message in unmatched["messages"])
+    assert all(rule["name"] not in system + user for rule in time_rules)
+
+    matched = _prompt(3000, time_rules[:1])
+    assert time_rules[0]["name"] in matched["messages"][1]["content"]
+    assert matched["messages"][0]["content"] == system
+
+
+def test_budget_covers_prefix_and_dynamic_part():
+    for budget in (1200, 2000, 3000):
+        assembled = _prompt(budget)
+        # 只有段落标题行不计入预算。
+        assert assembled["prompt_tokens"] <= budget + 10
+        assert assembled["dropped_sections"]
+        assert assembled["prefix_tokens"] == estimate_tokens(assembled["messages"][0]["content"])
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+from app.core import db_snapshots  # noqa: E402
+
+
+def _make_db(path, rows):
+    with duckdb.connect(path) as conn:
+        conn.execute("CREATE TABLE t AS SELECT range AS id FROM range(?)", [rows])
+    return path
+
+
+def _row_count(path):
+    with db_snapshots.connect_read_only(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+def test_publish_rollback_and_prune(tmp_path):
+    db_path = str(tmp_path / "example.duckdb")
+    first = db_snapshots.publish_snapshot(_make_db(str(tmp_path / "a.duckdb"), 1), "s1", keep=10, db_path=db_path)
+    second = db_snapshots.publish_snapshot(_make_db(str(tmp_path / "b.duckdb"), 2), "s2", keep=10, db_path=db_path)
+    assert os.path.exists(tmp_path / "a.duckdb"), "默认拷贝，源文件保留"
+    assert db_snapshots.current_snapshot(db_path) == second
+    assert _row_count(db_snapshots.current_snapshot(db_path).path) == 2
+
+    assert db_snapshots.rollback_snapshot("s1", db_path) == first
+    assert db_snapshots.current_snapshot(db_path).id == "s1"
+    with pytest.raises(FileNotFoundError):
+        db_snapshots.rollback_snapshot("missing", db_path)
+
+    third = db_snapshots.publish_snapshot(_make_db(str(tmp_path / "c.duckdb"), 3), "s3", move=True, keep=10, db_path=db_path)
+    assert not os.path.exists(tmp_path / "c.duckdb")
+    for age, snapshot in enumerate([third, second, first]):
+        os.utime(snapshot.path, (1_000_000 - age, 1_000_000 - age))
+    db_snapshots.rollback_snapshot("s1", db_path)
+
+    # 当前快照（最旧的 s1）永不删除，其余只保留最新的 keep - 1 个。
+    assert db_snapshots.prune_snapshots(keep=2, db_path=db_path) == ["s2"]
+    assert sorted(item["snapshot_id"] for item in db_snapshots.list_snapshots(db_path)) == ["s1", "s3"]
+    with pytest.raises(FileExistsError):
+        db_snapshots.publish_snapshot(str(tmp_path / "a.duckdb"), "s3", db_path=db_path)
+
+
+@pytest.mark.parametrize("move", [False, True])
+def test_failed_publish_keeps_source_and_current_snapshot(tmp_path, move):
+    db_path = str(tmp_path / "example.duckdb")
+    live = db_snapshots.publish_snapshot(_make_db(str(tmp_path / "a.duckdb"), 1), "s1", db_path=db_path)
+    source = tmp_path / "export.duckdb"
+    source.write_bytes(b"not a duckdb file" * 100)
+
+    with pytest.raises(Exception):
+        db_snapshots.publish_snapshot(str(source), "bad", move=move, db_path=db_path)
+
+    assert source.read_bytes() == b"not a duckdb file" * 100
+    assert db_snapshots.current_snapshot(db_path) == live
+    assert [name for name in os.listdir(tmp_path) if ".bad." in name] == []
@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core import llm_gateway
+from app.core.llm_gateway import CircuitBreaker, LLMGateway, LLMProvider, TokenBucket
+
+
+class _StubCompletions:
+    """按顺序消费预设的结果：异常直接抛出，列表作为流式分片，其余原样返回。"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    async def create(self, **params):
+        self.calls.append(params)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if isinstance(outcome, list):
+            return _stream(outcome)
+        return outcome
+
+
+async def _stream(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, BaseException):
+            raise chunk
+        yield chunk
+
+
+class _StubClient:
+    def __init__(self, outcomes):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = _StubCompletions(outcomes)
+
+    async def close(self):
+        pass
+
+
+def _provider(name, *outcomes):
+    provider = LLMProvider({"name": name, "base_url": f"http://{name}", "model": "m", "api_key": "test"})
+    provider._client = _StubClient(outcomes)
+    return provider
+
+
+def _calls(provider):
+    return len(provider._client.chat.completions.calls)
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_BASE_SECONDS", 0)
+    monkeypatch.setattr(llm_gateway, "LLM_HEDGE_ENABLED", False)
+
+
+def test_token_bucket_allows_burst_then_waits():
+    async def main():
+        bucket = TokenBucket(rate=20, capacity=2)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.04
+    unlimited = TokenBucket(rate=0, capacity=1)
+    asyncio.run(unlimited.acquire())
+
+
+def test_breaker_opens_then_probes_once():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=60)
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.available()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.available()
+
+    breaker.cooldown_seconds = 0
+    assert breaker.state == "half_open" and breaker.available()
+    breaker.before_request()
+    assert not breaker.available(), "半开时只放行一个探测请求"
+    breaker.cancel_probe()
+    assert breaker.available(), "探测被取消后允许再探测"
+
+    breaker.before_request()
+    breaker.record_failure()
+    breaker.cooldown_seconds = 60
+    assert breaker.state == "open", "探测失败重新打开"
+    breaker.cooldown_seconds = 0
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.available()
+
+
+def test_candidates_skip_open_breakers_and_rotate_tried():
+    first, second, third = _provider("a"), _provider("b"), _provider("c")
+    gateway = LLMGateway([first, second, third])
+    assert gateway._candidates() == [first, second, third]
+    assert gateway._candidates([first]) == [second, third, first]
+    for _ in range(llm_gateway.LLM_BREAKER_FAILURES):
+        second.breaker.record_failure()
+    assert gateway._candidates([first]) == [third, first]
+    for provider in (first, third):
+        for _ in range(llm_gateway.LLM_BREAKER_FAILURES):
+            provider.breaker.record_failure()
+    assert gateway._candidates() == [first, second, third], "全部熔断时仍返回全部"
+
+
+def test_complete_retries_on_the_next_provider():
+    first = _provider("a", asyncio.TimeoutError())
+    second = _provider("b", "ok")
+    gateway = LLMGateway([first, second])
+    assert asyncio.run(gateway.complete(messages=[])) == "ok"
+    assert (_calls(first), _calls(second)) == (1, 1)
+    assert first.stats["retries"] == 1 and first.stats["failures"] == 1
+
+
+def test_complete_does_not_retry_client_errors():
+    first = _provider("a", ValueError("bad request"))
+    second = _provider("b", "ok")
+    with pytest.raises(ValueError):
+        asyncio.run(LLMGateway([first, second]).complete(messages=[]))
+    assert _calls(second) == 0
+    assert first.breaker.state == "closed"
+
+
+def test_stream_retries_only_before_the_first_chunk():
+    async def collect(gateway):
+        return [chunk async for chunk in gateway.stream(messages=[])]
+
+    first = _provider("a", asyncio.TimeoutError())
+    second = _provider("b", ["x", "y"])
+    assert asyncio.run(collect(LLMGateway([first, second]))) == ["x", "y"]
+    assert second._client.chat.completions.calls[0]["stream"] is True
+    assert len(second.stream_ttfb) == 1 and not second.latencies
+
+    broken = _provider("a", ["x", asyncio.TimeoutError()])
+    spare = _provider("b", ["z"])
+    received = []
+
+    async def consume():
+        async for chunk in LLMGateway([broken, spare]).stream(messages=[]):
+            received.append(chunk)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(consume())
+    assert received == ["x"] and _calls(spare) == 0
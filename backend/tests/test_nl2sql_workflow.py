@@ -0,0 +1,31 @@
+from app.core.nl2sql_workflow import _literal_replacements, dedupe_questions
+
+MONTH = {"grain": "month", "normalized_value": "202512", "raw_text": "2025年12月"}
+
+
+def test_dedupe_questions_groups_normalized_duplicates_in_order():
+    groups = dedupe_questions(["本月佣金？", "  本月佣金", "", "各营业部人数", "本月 佣金。"])
+    assert groups == {"本月佣金？": [0, 1, 4], "各营业部人数": [3]}
+
+
+def test_literal_replacements_for_time_change():
+    previous = {"time_range": MONTH, "entities": []}
+    intent = {"time_range": {**MONTH, "normalized_value": "202601"}, "entities": []}
+    delta = {"changed": ["time_range"], "structural": False}
+    assert _literal_replacements(previous, intent, delta) == {"202512": "202601"}
+
+
+def test_literal_replacements_for_entity_change():
+    previous = {"time_range": MONTH, "entities": [{"type": "column_value", "value": "北京营业部"}]}
+    intent = {"time_range": MONTH, "entities": [{"type": "column_value", "value": "上海营业部"}]}
+    delta = {"changed": ["entities"], "structural": False}
+    assert _literal_replacements(previous, intent, delta) == {"北京营业部": "上海营业部"}
+
+
+def test_literal_replacements_refuses_structural_or_mismatched_changes():
+    previous = {"time_range": MONTH, "entities": [{"type": "employee_id", "value": "E1"}]}
+    assert _literal_replacements(previous, previous, {"changed": ["metrics"], "structural": True}) == {}
+    year = {"time_range": {"grain": "year", "normalized_value": "2026"}, "entities": []}
+    assert _literal_replacements(previous, year, {"changed": ["time_range"], "structural": False}) == {}
+    other_type = {"time_range": MONTH, "entities": [{"type": "column_value", "value": "北京"}]}
+    assert _literal_replacements(previous, other_type, {"changed": ["entities"], "structural": False}) == {}
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.priority_lanes import Lane, LaneRegistry, LaneRejected
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_up_to_concurrency_then_rejects_when_queue_full():
+    async def scenario():
+        lane = Lane("query", concurrency=1, queue_limit=1, max_wait=5)
+        await lane.acquire()
+        queued = asyncio.ensure_future(lane.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(LaneRejected) as rejected:
+            await lane.acquire()
+        assert rejected.value.status_code == 429
+        assert rejected.value.retry_after >= 1
+
+        # 释放名额后直接转交给队首请求。
+        lane.release(0.01)
+        await queued
+        stats = lane.stats()
+        assert stats["in_flight"] == 1 and stats["waiting"] == 0
+        assert stats["admitted"] == 2 and stats["rejected"] == 1
+        lane.release(0.01)
+        assert lane.stats()["in_flight"] == 0
+
+    _run(scenario())
+
+
+def test_expired_deadline_is_dropped_with_504():
+    async def scenario():
+        lane = Lane("llm", concurrency=4, queue_limit=4, max_wait=5)
+        with pytest.raises(LaneRejected) as rejected:
+            await lane.acquire(deadline=time.monotonic() - 1)
+        assert rejected.value.status_code == 504
+        assert lane.stats()["expired"] == 1
+
+    _run(scenario())
+
+
+def test_queue_timeout_returns_503_and_frees_queue_slot():
+    async def scenario():
+        lane = Lane("batch", concurrency=1, queue_limit=1, max_wait=0.05)
+        await lane.acquire()
+        with pytest.raises(LaneRejected) as rejected:
+            await lane.acquire()
+        assert rejected.value.status_code == 503
+        assert lane.stats()["waiting"] == 0
+        lane.release(0.01)
+        assert lane.stats()["in_flight"] == 0
+
+    _run(scenario())
+
+
+def test_cancelled_waiter_hands_slot_to_next():
+    async def scenario():
+        lane = Lane("query", concurrency=1, queue_limit=2, max_wait=5)
+        await lane.acquire()
+        first = asyncio.ensure_future(lane.acquire())
+        second = asyncio.ensure_future(lane.acquire())
+        await asyncio.sleep(0)
+        first.cancel()
+        lane.release(0.01)
+        await second
+        assert lane.stats()["in_flight"] == 1
+        lane.release(0.01)
+        assert lane.stats()["in_flight"] == 0
+
+    _run(scenario())
+
+
+def test_routes_by_method_and_prefix():
+    registry = LaneRegistry()
+    assert registry.route("POST", "/nl2sql/batch").name == "batch"
+    assert registry.route("POST", "/nl2sql/ask").name == "llm"
+    assert registry.route("DELETE", "/nl2sql/session/abc").name == "metadata"
+    assert registry.route("POST", "/query/stream").name == "query"
+    assert registry.route("GET", "/nl2sqlx") is None
+    assert registry.route("GET", "/metrics") is None
@@ -0,0 +1,46 @@
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.api.v1 import query  # noqa: E402
+from app.core import catalogs, query_executor  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "example.duckdb")
+    with duckdb.connect(db_path) as conn:
+        conn.execute("CREATE TABLE t AS SELECT range AS id FROM range(10)")
+    registry = catalogs.CatalogRegistry([{"name": "default", "duckdb_path": db_path}])
+    monkeypatch.setattr(catalogs, "_registry", registry)
+    monkeypatch.setattr(query_executor, "QUERY_MAX_ROWS", 5)
+    app = FastAPI()
+    app.include_router(query.router)
+    yield TestClient(app)
+    registry.close()
+
+
+def test_injected_limit_is_reported(client):
+    response = client.post("/query/", json={"sql": "SELECT id FROM t"})
+    assert response.status_code == 200
+    assert len(response.json()) == 5
+    assert response.headers["X-Row-Limit"] == "5"
+    assert response.headers["X-Result-Truncated"] == "true"
+
+
+def test_results_under_the_cap_are_not_truncated(client):
+    response = client.post("/query/", json={"sql": "SELECT id FROM t WHERE id < 3"})
+    assert len(response.json()) == 3
+    assert response.headers["X-Row-Limit"] == "5"
+    assert response.headers["X-Result-Truncated"] == "false"
+
+
+def test_explicit_limit_is_not_capped(client):
+    response = client.post("/query/", json={"sql": "SELECT id FROM t LIMIT 8"})
+    assert len(response.json()) == 8
+    assert "X-Row-Limit" not in response.headers
+    assert response.headers["X-Result-Truncated"] == "false"
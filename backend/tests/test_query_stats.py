@@ -0,0 +1,62 @@
+import multiprocessing
+
+import pytest
+
+pytest.importorskip("duckdb")
+
+from app.core.query_stats import QueryStatsStore  # noqa: E402
+
+SQL = "SELECT mon FROM t WHERE mon = 202601"
+
+
+def _record_and_flush(path, calls):
+    store = QueryStatsStore(path)
+    for index in range(calls):
+        store.record_execution(SQL, 1.0, rows=2)
+        if index % 10 == 9:
+            store.flush()
+    store.flush()
+
+
+def test_workers_accumulate_into_one_file(tmp_path):
+    path = str(tmp_path / "query_stats.json")
+    worker_a, worker_b = QueryStatsStore(path), QueryStatsStore(path)
+    worker_a.record_execution(SQL, 10.0, rows=1)
+    worker_b.record_execution("SELECT mon FROM t WHERE mon = 202512", 30.0, rows=3)
+    worker_b.record_generation(SQL, cache_hit=True)
+    assert worker_a.flush() and worker_b.flush()
+    assert not worker_a.flush(), "没有新增量时不写文件"
+
+    # 相同形状的 SQL 合并成一个指纹；worker_a 还能看到自己尚未落盘的增量。
+    worker_a.record_execution(SQL, 20.0)
+    (entry,) = worker_a.top()
+    assert (entry["calls"], entry["rows"], entry["total_ms"], entry["generated"], entry["cache_hits"]) == (3, 4, 60.0, 1, 1)
+    assert (entry["min_ms"], entry["max_ms"]) == (10.0, 30.0)
+    assert QueryStatsStore(path).top()[0]["calls"] == 2
+
+    worker_a.reset()
+    assert worker_a.top() == [] and worker_b.top() == []
+
+
+def test_concurrent_flushes_from_processes_lose_nothing(tmp_path):
+    path = str(tmp_path / "query_stats.json")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_record_and_flush, args=(path, 95)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    (entry,) = QueryStatsStore(path).top()
+    assert entry["calls"] == 380 and entry["rows"] == 760
+
+
+def test_merged_file_keeps_at_most_max_entries(tmp_path):
+    path = str(tmp_path / "query_stats.json")
+    for worker in range(3):
+        store = QueryStatsStore(path, max_entries=20)
+        for index in range(10):
+            fingerprint = {"id": f"{worker}-{index}", "text": f"SELECT {worker * 10 + index}"}
+            store.record_execution(fingerprint["text"], 1.0, fingerprint=fingerprint)
+        store.flush()
+    assert len(QueryStatsStore(path).top(limit=100)) <= 20
@@ -0,0 +1,63 @@
+from app.core.rule_sql_compiler import compile_sql_from_rules
+
+RULES = {
+    "metric_rules": [
+        {
+            "name": "新增客户收入",
+            "aliases": ["新增客收"],
+            "source_table": "tygyjzbtj",
+            "code_field": "zbdm",
+            "code_value": "XZKHSR",
+            "value_field": "zbz",
+            "default_aggregation": "sum",
+        }
+    ],
+    "business_term_rules": [],
+    "time_rules": [{"grain": "month", "time_field": "mon", "storage_format": "YYYYMM"}],
+    "join_rules": [{"join_keys": ["tygyjzbtj.ryid = emp_bas_info.emp_num"]}],
+}
+SCHEMA = {
+    "tygyjzbtj": {
+        "table_name": "tygyjzbtj",
+        "columns": [
+            {"name": "ryid", "type": "VARCHAR"},
+            {"name": "mon", "type": "INTEGER"},
+            {"name": "zbdm", "type": "VARCHAR"},
+            {"name": "zbz", "type": "DOUBLE"},
+        ],
+    }
+}
+
+
+def _intent(**overrides):
+    intent = {
+        "query_type": "aggregate",
+        "metrics": ["新增客户收入"],
+        "business_terms": [],
+        "entities": [{"type": "employee_id", "value": "E001", "field_hint": "emp_num"}],
+        "time_range": {"grain": "month", "raw_text": "2026年1月", "normalized_value": "202601"},
+        "dimensions": [],
+        "aggregation": "sum",
+        "needs_clarification": False,
+    }
+    intent.update(overrides)
+    return intent
+
+
+def test_fully_covered_question_compiles():
+    compiled = compile_sql_from_rules("2026年1月员工E001新增客户收入", _intent(), RULES, SCHEMA)
+    assert compiled is not None
+    assert compiled["sql"] == (
+        'SELECT SUM(zbz) AS "新增客户收入"\nFROM tygyjzbtj\nWHERE zbdm = \'XZKHSR\'\n  AND mon = 202601\n  AND ryid = \'E001\''
+    )
+    assert compiled["tables"] == [SCHEMA["tygyjzbtj"]]
+
+
+def test_leftover_words_fall_back_to_llm():
+    assert compile_sql_from_rules("2026年1月员工E001新增客户收入环比增长率", _intent(), RULES, SCHEMA) is None
+
+
+def test_unknown_metric_or_column_falls_back_to_llm():
+    assert compile_sql_from_rules("2026年1月员工E001佣金", _intent(metrics=["佣金"]), RULES, SCHEMA) is None
+    narrow = {"tygyjzbtj": {"columns": [{"name": "zbdm", "type": "VARCHAR"}, {"name": "zbz", "type": "DOUBLE"}]}}
+    assert compile_sql_from_rules("2026年1月员工E001新增客户收入", _intent(), RULES, narrow) is None
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution_and_get_own_copies():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return {"sql": "SELECT 1", "tables": ["t"]}
+
+        callers = [asyncio.create_task(flight.do("q", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers)
+
+        assert len(calls) == 1
+        assert [shared for _, shared in results] == [False, True, True]
+        values = [value for value, _ in results]
+        values[0]["tables"].append("leaked")
+        assert values[1] == values[2] == {"sql": "SELECT 1", "tables": ["t"]}
+        assert flight.stats() == {"executions": 1, "coalesced": 2, "inflight": 0}
+
+        # 执行结束后相同 key 重新执行。
+        await flight.do("q", work)
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_exception_reaches_every_waiter():
+    async def main():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.do("q", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.stats()["executions"] == 1
+
+    asyncio.run(main())
+
+
+def test_execution_survives_until_the_last_waiter_cancels():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        cancelled = []
+
+        async def work():
+            try:
+                await release.wait()
+                return "done"
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        first = asyncio.create_task(flight.do("q", work))
+        second = asyncio.create_task(flight.do("q", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == ("done", True)
+        assert not cancelled
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.clear()
+        lone = asyncio.create_task(flight.do("other", work))
+        await asyncio.sleep(0)
+        lone.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == [1]
+
+    asyncio.run(main())
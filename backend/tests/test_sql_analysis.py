@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("duckdb")
+
+from app.core.sql_analysis import analyze_sql, inject_limit, replace_filter_literals  # noqa: E402
+
+
+def test_inject_limit_appends_to_single_select():
+    assert inject_limit("SELECT mon FROM t", 100) == "SELECT mon FROM t LIMIT 100"
+
+
+def test_inject_limit_keeps_existing_limit_and_non_select():
+    assert inject_limit("SELECT mon FROM t LIMIT 5", 100) == "SELECT mon FROM t LIMIT 5"
+    assert inject_limit("DELETE FROM t", 100) == "DELETE FROM t"
+    assert inject_limit("SELECT 1; SELECT 2", 100) == "SELECT 1; SELECT 2"
+    assert inject_limit("SELECT mon FROM t", 0) == "SELECT mon FROM t"
+
+
+def test_inject_limit_wraps_only_top_level():
+    # 子查询里的 LIMIT 不算顶层 LIMIT。
+    limited = inject_limit("SELECT * FROM (SELECT mon FROM t LIMIT 3) AS s", 10)
+    assert limited.endswith("LIMIT 10")
+    assert analyze_sql(limited)["has_limit"]
+
+
+def test_replace_filter_literals_touches_only_matching_constants():
+    sql = "SELECT a.mon AS m202512, SUM(x) FROM t AS a WHERE a.mon = 202512 AND d >= DATE '2025-12-01' AND name = '张三' GROUP BY a.mon"
+    patched = replace_filter_literals(sql, {"202512": "202601", "张三": "李\\1四"})
+    assert "a.mon = 202601" in patched
+    assert "'李\\1四'" in patched
+    assert "m202512" in patched and "2025-12-01" in patched
+
+
+def test_replace_filter_literals_refuses_partial_or_incompatible():
+    sql = "SELECT mon FROM t WHERE mon = 202512 AND d >= DATE '2025-12-01'"
+    assert replace_filter_literals(sql, {"12": "01"}) is None
+    assert replace_filter_literals(sql, {"202512": "abc"}) is None
+    assert replace_filter_literals("SELECT 1; SELECT 2", {"1": "2"}) is None
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("duckdb")
+
+from app.core import sql_dry_run  # noqa: E402
+from app.core.sql_dry_run import check_and_repair_sql, dry_run_sql  # noqa: E402
+
+SCHEMA = {"t": {"columns": [{"name": "mon", "type": "INTEGER"}, {"name": "amount", "type": "DOUBLE"}]}}
+
+
+def test_single_select_binds():
+    assert dry_run_sql("SELECT mon, SUM(amount) FROM t GROUP BY mon;", SCHEMA) is None
+
+
+def test_bind_error_is_reported():
+    error = dry_run_sql("SELECT month FROM t", SCHEMA)
+    assert error is not None and "month" in error
+
+
+def test_multi_statement_is_rejected_without_touching_catalog():
+    error = dry_run_sql("SELECT mon FROM t; DROP TABLE t", SCHEMA)
+    assert error is not None and "DROP" in error
+    # 后半句不能被执行：空表目录里的 t 仍然存在。
+    assert dry_run_sql("SELECT mon FROM t", SCHEMA) is None
+
+
+def test_non_select_is_rejected():
+    assert dry_run_sql("DROP TABLE t", SCHEMA) is not None
+    assert dry_run_sql("SELECT mon FROM t", SCHEMA) is None
+
+
+def test_multi_statement_report_fails_without_llm(monkeypatch):
+    monkeypatch.setattr(sql_dry_run, "SQL_REPAIR_MAX_LLM_CALLS", 0)
+    report = asyncio.run(check_and_repair_sql("SELECT mon FROM t; DROP TABLE t", SCHEMA))
+    assert report["status"] == "failed"
+    assert dry_run_sql("SELECT amount FROM t", SCHEMA) is None
+
+
+def test_catalog_is_keyed_on_schema_version(monkeypatch):
+    def no_rehash(full_schema):
+        raise AssertionError("传入版本号时不应再计算 schema 签名")
+
+    monkeypatch.setattr(sql_dry_run, "_schema_signature", no_rehash)
+    assert dry_run_sql("SELECT mon FROM t", SCHEMA, "v1") is None
+    # 同一版本复用已建好的空表库。
+    assert dry_run_sql("SELECT mon FROM t", {}, "v1") is None
+    renamed = {"t": {"columns": [{"name": "month", "type": "INTEGER"}]}}
+    assert dry_run_sql("SELECT month FROM t", renamed, "v2") is None
+    assert dry_run_sql("SELECT mon FROM t", renamed, "v2") is not None
@@ -0,0 +1,49 @@
+from app.core.value_index import ValueIndex
+
+COLUMNS = [
+    {"table": "emp", "column": "emp_num", "identifier": True, "approx_distinct": 3},
+    {"table": "emp", "column": "branch", "identifier": False, "approx_distinct": 2},
+]
+
+
+def _index() -> ValueIndex:
+    postings = {"E10023": [0], "E10088": [0], "10023": [0], "北京营业部": [1], "北京": [1]}
+    values = sorted(postings)
+    return ValueIndex(values, [postings[value] for value in values], COLUMNS, "snap-1")
+
+
+def test_link_prefers_longest_exact_match():
+    mentions = _index().link("北京营业部的佣金")
+    assert [(item["value"], item["match"]) for item in mentions] == [("北京营业部", "exact")]
+    assert mentions[0]["columns"][0]["column"] == "branch"
+
+
+def test_link_respects_alphanumeric_boundaries():
+    index = _index()
+    assert [item["value"] for item in index.link("员工10023的佣金")] == ["10023"]
+    # 更长数字里的片段不是工号。
+    assert index.link("员工100234的佣金") == []
+
+
+def test_link_fuzzy_only_for_unique_candidate():
+    index = _index()
+    mentions = index.link("员工E10024的佣金")
+    assert [(item["value"], item["match"]) for item in mentions] == [("E10023", "fuzzy")]
+    # 纯数字片段不做模糊匹配。
+    assert index.link("员工10024的佣金") == []
+
+
+def test_fuzzy_within_one_edit():
+    index = _index()
+    assert [item["value"] for item in index.fuzzy("E1002")] == ["E10023"]
+    assert sorted(item["value"] for item in index.fuzzy("E10083")) == ["E10023", "E10088"]
+    # 精确相等的取值不算模糊命中，删掉一个字符的 10023 算。
+    assert [item["value"] for item in index.fuzzy("E10023")] == ["10023"]
+    assert index.fuzzy("X") == []
+
+
+def test_prefix_and_exact():
+    index = _index()
+    assert [item["value"] for item in index.prefix("E100")] == ["E10023", "E10088"]
+    assert index.exact("北京")["columns"][0]["column"] == "branch"
+    assert index.exact("上海") is None
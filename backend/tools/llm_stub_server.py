@@ -0,0 +1,255 @@
+"""
+本地 OpenAI 兼容 LLM 桩服务，用于在不访问真实服务商的情况下测试 LLM 网关的重试、熔断与对冲，也供基准测试回放录制的响应。
+
+用法（backend 目录下）：
+    python tools/llm_stub_server.py --port 9001 --latency-ms 300 --jitter-ms 200 --error-rate 0.1 --rate-limit-rate 0.1
+
+录制与回放：
+    # 把请求转发给真实服务商并录制到 JSONL
+    python tools/llm_stub_server.py --record bench/recordings.jsonl \
+        --upstream-url https://api.moonshot.cn/v1 --upstream-model kimi2.5 --upstream-api-key-env LLM_API_KEY
+    # 按请求内容回放，延迟按指定分布采样
+    python tools/llm_stub_server.py --replay bench/recordings.jsonl --latency-dist lognormal --latency-ms 800 --jitter-ms 400
+
+回放文件每行一个 JSON：{"key": 请求 messages 的摘要, "response": 文本}，
+或 {"match": 子串, "response": 文本}（消息内容包含该子串即命中）；都未命中时返回 --response。
+
+然后把服务指向它，例如：
+    LLM_PROVIDERS='[{"name":"stub-a","base_url":"http://127.0.0.1:9001/v1","model":"stub","api_key":"x"},
+                    {"name":"stub-b","base_url":"http://127.0.0.1:9002/v1","model":"stub","api_key":"x"}]'
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+DEFAULT_RESPONSE = "SELECT 1"
+
+# 模拟服务商的前缀缓存：system 消息出现过即视为命中，cached_tokens 按其字符数粗略估算。
+_seen_prefixes = set()
+_seen_lock = threading.Lock()
+
+
+def _usage_payload(request: Dict[str, Any], content: str) -> Dict[str, Any]:
+    messages = request.get("messages") or []
+    prompt_chars = sum(len(str(message.get("content") or "")) for message in messages)
+    system_text = "".join(str(message.get("content") or "") for message in messages if message.get("role") == "system")
+    cached = 0
+    if system_text:
+        digest = hashlib.sha1(system_text.encode("utf-8")).hexdigest()
+        with _seen_lock:
+            if digest in _seen_prefixes:
+                cached = len(system_text)
+            _seen_prefixes.add(digest)
+    return {
+        "prompt_tokens": prompt_chars,
+        "completion_tokens": len(content),
+        "total_tokens": prompt_chars + len(content),
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """录制/回放的匹配键：只取 messages，忽略温度、超时等参数。"""
+    payload = json.dumps(request.get("messages") or [], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class ReplayBook:
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+        self.exact: Dict[str, str] = {}
+        self.patterns: List[Dict[str, str]] = []
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as handle:
+                for line in handle:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry.get("key"):
+                        self.exact[entry["key"]] = entry["response"]
+                    elif entry.get("match"):
+                        self.patterns.append(entry)
+
+    def lookup(self, request: Dict[str, Any]) -> Optional[str]:
+        response = self.exact.get(request_key(request))
+        if response is not None:
+            return response
+        text = "\n".join(str(message.get("content") or "") for message in request.get("messages") or [])
+        for entry in self.patterns:
+            if entry["match"] in text:
+                return entry["response"]
+        return None
+
+    def record(self, request: Dict[str, Any], response: str) -> None:
+        key = request_key(request)
+        with self._lock:
+            self.exact[key] = response
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(json.dumps({"key": key, "response": response}, ensure_ascii=False) + "\n")
+
+
+def sample_latency_ms(dist: str, mean_ms: float, jitter_ms: float) -> float:
+    """按分布采样一次延迟：normal（均值/标准差）、lognormal（同均值/标准差的长尾）、uniform（均值±jitter）、fixed。"""
+    if dist == "fixed" or mean_ms <= 0:
+        return max(0.0, mean_ms)
+    if dist == "uniform":
+        return max(0.0, random.uniform(mean_ms - jitter_ms, mean_ms + jitter_ms))
+    if dist == "lognormal":
+        sigma = math.sqrt(math.log(1 + (jitter_ms / mean_ms) ** 2))
+        return random.lognormvariate(math.log(mean_ms) - sigma ** 2 / 2, sigma)
+    return max(0.0, random.gauss(mean_ms, jitter_ms))
+
+
+def _call_upstream(args: argparse.Namespace, request: Dict[str, Any]) -> str:
+    body = {**request, "model": args.upstream_model or request.get("model"), "stream": False}
+    body.pop("stream_options", None)
+    http_request = urllib.request.Request(
+        args.upstream_url.rstrip("/") + "/chat/completions",
+        data=json.dumps(body, ensure_ascii=False).encode("utf-8"),
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {os.getenv(args.upstream_api_key_env, '')}",
+        },
+    )
+    with urllib.request.urlopen(http_request, timeout=120) as response:
+        payload = json.loads(response.read())
+    return payload["choices"][0]["message"]["content"] or ""
+
+
+def _completion_payload(model: str, content: str, usage: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def _chunk_payload(model: str, delta: Dict[str, Any], finish_reason: Any = None) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def build_handler(args: argparse.Namespace):
+    book = ReplayBook(args.record or args.replay)
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *values: Any) -> None:
+            if args.verbose:
+                super().log_message(format, *values)
+
+        def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            model = request.get("model", "stub")
+
+            if args.record:
+                content = book.lookup(request) if request_key(request) in book.exact else None
+                if content is None:
+                    try:
+                        content = _call_upstream(args, request)
+                    except Exception as exc:
+                        self._send_json(502, {"error": {"message": f"upstream failed: {exc}", "type": "server_error"}})
+                        return
+                    book.record(request, content)
+                self._respond(request, model, content)
+                return
+
+            time.sleep(sample_latency_ms(args.latency_dist, args.latency_ms, args.jitter_ms) / 1000)
+
+            roll = random.random()
+            if roll < args.rate_limit_rate:
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}}, {"Retry-After": "1"})
+                return
+            if roll < args.rate_limit_rate + args.error_rate:
+                self._send_json(500, {"error": {"message": "stub internal error", "type": "server_error"}})
+                return
+
+            content = book.lookup(request)
+            self._respond(request, model, args.response if content is None else content)
+
+        def _respond(self, request: Dict[str, Any], model: str, content: str) -> None:
+            if not request.get("stream"):
+                self._send_json(200, _completion_payload(model, content, _usage_payload(request, content)))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+            for piece in pieces:
+                self.wfile.write(f"data: {json.dumps(_chunk_payload(model, {'content': piece}))}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(args.token_interval_ms / 1000)
+            self.wfile.write(f"data: {json.dumps(_chunk_payload(model, {}, 'stop'))}\n\n".encode("utf-8"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage_chunk = {**_chunk_payload(model, {}), "choices": [], "usage": _usage_payload(request, content)}
+                self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return StubHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 LLM 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=200, help="平均响应延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="延迟标准差（毫秒）")
+    parser.add_argument("--latency-dist", choices=["normal", "lognormal", "uniform", "fixed"], default="normal", help="延迟分布")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现延迟序列")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--token-interval-ms", type=float, default=20, help="流式模式下分片间隔（毫秒）")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE, help="回放未命中时返回的文本")
+    parser.add_argument("--replay", default=None, help="回放文件（JSONL）")
+    parser.add_argument("--record", default=None, help="录制文件（JSONL），需同时指定 --upstream-url")
+    parser.add_argument("--upstream-url", default=None, help="录制模式下转发的真实服务商地址")
+    parser.add_argument("--upstream-model", default=None, help="录制模式下使用的模型名")
+    parser.add_argument("--upstream-api-key-env", default="LLM_API_KEY", help="录制模式下读取 API Key 的环境变量")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.record and not args.upstream_url:
+        parser.error("--record 需要同时指定 --upstream-url")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = ThreadingHTTPServer((args.host, args.port), build_handler(args))
+    print(f"LLM stub server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
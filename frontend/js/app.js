@@ -72,7 +72,7 @@ async function sendNL2SQL() {
         const response = await fetch(`${API_BASE}/nl2sql`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ text: input }),
+            body: JSON.stringify({ text: input, verbosity: 'minimal' }),
         });
 
         const data = await response.json();